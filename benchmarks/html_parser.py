@@ -0,0 +1,75 @@
+"""
+Benchmark the HTML parser backends used to extract the wiki page content
+
+Times `extract_content_section` on each page with each parser backend, and
+shows the time per page.  By default the parity test corpus is used, but
+saved wiki page HTML files can be given instead.
+
+Run as:  python benchmarks/html_parser.py [--repeat N] [HTML files...]
+"""
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import attr
+import click
+from furl import furl
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from moin2gitwiki.moin2markdown import HtmlTranslator  # noqa: E402
+from moin2gitwiki.moin2markdown import HTML_PARSERS  # noqa: E402
+from moin2gitwiki.moin2markdown import lxml  # noqa: E402
+from moin2gitwiki.wikiindex import MoinLinkTable  # noqa: E402
+
+CORPUS = Path(__file__).resolve().parent.parent.joinpath("tests", "corpus")
+
+
+def time_extraction(translator: HtmlTranslator, html: str, repeat: int) -> float:
+    """The median time, in seconds, to extract the content of a page"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        translator.extract_content_section(html)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+@click.command()
+@click.option("--repeat", default=50, type=click.IntRange(min=1))
+@click.argument("pages", nargs=-1, type=click.Path(exists=True, dir_okay=False))
+def main(repeat, pages):
+    """Show the time per page taken by each HTML parser backend"""
+    paths = [Path(page) for page in pages] or sorted(CORPUS.glob("*.html"))
+    translator = HtmlTranslator(
+        url_prefix=furl("http://localhost/wiki/"),
+        links=MoinLinkTable(link_table={}, attachment_link_table={}),
+    )
+    parsers = [
+        parser for parser in HTML_PARSERS if parser != "lxml" or lxml is not None
+    ]
+    click.echo(f"{'page':30s}" + "".join(f"{parser:>16s}" for parser in parsers))
+    totals = dict.fromkeys(parsers, 0.0)
+    for path in paths:
+        html = path.read_text()
+        line = f"{path.name[:30]:30s}"
+        for parser in parsers:
+            seconds = time_extraction(
+                attr.evolve(translator, html_parser=parser),
+                html,
+                repeat,
+            )
+            totals[parser] += seconds
+            line += f"{seconds * 1000:14.3f}ms"
+        click.echo(line)
+    click.echo(
+        f"{'total':30s}"
+        + "".join(f"{totals[parser] * 1000:14.3f}ms" for parser in parsers),
+    )
+
+
+if __name__ == "__main__":
+    main()
+
+# end
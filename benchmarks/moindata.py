@@ -0,0 +1,186 @@
+"""
+Generate a synthetic MoinMoin data directory for benchmarking
+
+Writes a `pages` tree - each page with an `edit-log`, `revisions` and
+`attachments` - and a `user` directory, shaped like a real MoinMoin 1.9
+wiki.  Pages live in nested namespaces, revisions link to other pages and
+attachments, some revisions revert to an earlier text, and some pages are
+deleted.  The same seed always gives the same wiki.
+
+Run as:  python benchmarks/moindata.py [--pages N] [--revisions N] DESTINATION
+"""
+import random
+from pathlib import Path
+
+import click
+
+WORDS = [
+    "Alpha",
+    "Build",
+    "Config",
+    "Deploy",
+    "Engine",
+    "Folder",
+    "Gateway",
+    "Howto",
+    "Index",
+    "Journal",
+    "Kernel",
+    "Library",
+    "Meeting",
+    "Network",
+    "Office",
+    "Project",
+    "Release",
+    "Server",
+    "Team",
+    "Upgrade",
+]
+SMILEYS = [":)", ";)", "{i}", "/!\\", "(./)", ":D"]
+START_TIME = 1262304000000000  # 2010-01-01 in microseconds
+
+
+def escape(page_name: str) -> str:
+    """Escape a page name into its filesystem form, as MoinMoin does"""
+    return page_name.replace("/", "(2f)").replace(" ", "(20)")
+
+
+def page_text(
+    rng: random.Random, page_name: str, page_names: list, attachments: list
+) -> str:
+    """Make up the wiki markup of a page revision"""
+    lines = [f"= {page_name.split('/')[-1]} =", ""]
+    for paragraph in range(rng.randint(1, 4)):
+        words = rng.choices(WORDS, k=rng.randint(5, 30))
+        lines.append(" ".join(words).lower() + f" {rng.choice(SMILEYS)}")
+        lines.append(
+            f"See [[{rng.choice(page_names)}]] and [[{rng.choice(page_names)}]]."
+        )
+        lines.append("")
+        if paragraph % 2 == 1:
+            lines.extend(
+                f" * item {item} of [[{rng.choice(page_names)}]]" for item in range(3)
+            )
+            lines.append("")
+    if len(attachments) > 0:
+        lines.append(f"Attached: [[attachment:{rng.choice(attachments)}]]")
+    lines.append(f"||'''{rng.choice(WORDS)}'''||{rng.randint(0, 999)}||")
+    lines.append("{{{")
+    lines.append(f"code {rng.random()} < & >")
+    lines.append("}}}")
+    return "\n".join(lines) + "\n"
+
+
+def generate_wiki(
+    destination: Path,
+    pages: int = 100,
+    revisions: int = 10,
+    attachments: float = 0.3,
+    users: int = 5,
+    seed: int = 1,
+) -> dict:
+    """
+    Write a synthetic MoinMoin data directory
+
+    Parameters:
+        destination:    Directory to create the wiki data in
+        pages:          Number of pages
+        revisions:      Average number of revisions per page
+        attachments:    Average number of attachments per page
+        users:          Number of wiki users
+        seed:           Seed for the random choices
+
+    Returns counts of what was written.
+    """
+    rng = random.Random(seed)
+    user_dir = destination.joinpath("user")
+    user_dir.mkdir(parents=True, exist_ok=True)
+    user_ids = []
+    for number in range(users):
+        user_id = f"{1300000000 + number}.{number:02d}.{10000 + number}"
+        user_dir.joinpath(user_id).write_text(
+            f"name=User{number}\nemail=user{number}@example.org\n",
+        )
+        user_ids.append(user_id)
+    #
+    # pages in namespaces up to three deep - names are unique
+    page_names = []
+    seen = set()
+    while len(page_names) < pages:
+        name = "/".join(rng.choices(WORDS, k=rng.choice([1, 1, 2, 2, 3])))
+        if name not in seen:
+            seen.add(name)
+            page_names.append(name)
+    counts = {"pages": pages, "revisions": 0, "attachments": 0, "deleted": 0}
+    for page_name in page_names:
+        page_dir = destination.joinpath("pages", escape(page_name))
+        page_dir.joinpath("revisions").mkdir(parents=True, exist_ok=True)
+        page_dir.joinpath("attachments").mkdir(exist_ok=True)
+        attachment_count = int(attachments) + (rng.random() < attachments % 1)
+        attachment_names = [f"file{number}.txt" for number in range(attachment_count)]
+        when = START_TIME + rng.randrange(10**14)
+        texts = []
+        log_lines = []
+        revision_count = max(1, int(rng.expovariate(1 / revisions)))
+        deleted = rng.random() < 0.05
+        for number in range(1, revision_count + 1):
+            when += rng.randrange(10**9, 10**12)
+            revision = f"{number:08d}"
+            user_id = rng.choice(user_ids)
+            if number == revision_count and deleted and number > 1:
+                # a deleted page has a log entry but no revision file
+                edit_type = "SAVE"
+                counts["deleted"] += 1
+            else:
+                if number > 1 and rng.random() < 0.1:
+                    text = rng.choice(texts)
+                    edit_type = "SAVE/REVERT"
+                else:
+                    text = page_text(rng, page_name, page_names, attachment_names)
+                    edit_type = "SAVENEW" if number == 1 else "SAVE"
+                texts.append(text)
+                page_dir.joinpath("revisions", revision).write_text(text)
+            log_lines.append(
+                f"{when}\t{revision}\t{edit_type}\t{escape(page_name)}\t"
+                f"127.0.0.1\thost.example.org\t{user_id}\t\t\n",
+            )
+            counts["revisions"] += 1
+        for attachment in attachment_names:
+            when += rng.randrange(10**6, 10**9)
+            size = rng.randrange(100, 50000)
+            page_dir.joinpath("attachments", attachment).write_bytes(
+                rng.getrandbits(size * 8).to_bytes(size, "little"),
+            )
+            log_lines.append(
+                f"{when}\t99999999\tATTNEW\t{escape(page_name)}\t"
+                f"127.0.0.1\thost.example.org\t{rng.choice(user_ids)}\t{attachment}\t\n",
+            )
+            counts["attachments"] += 1
+        page_dir.joinpath("edit-log").write_text("".join(log_lines))
+    return counts
+
+
+@click.command()
+@click.option("--pages", default=100, type=click.IntRange(min=1))
+@click.option("--revisions", default=10, type=click.IntRange(min=1))
+@click.option("--attachments", default=0.3, type=click.FloatRange(min=0))
+@click.option("--users", default=5, type=click.IntRange(min=1))
+@click.option("--seed", default=1, type=int)
+@click.argument("destination", type=click.Path(exists=False, file_okay=False))
+def main(pages, revisions, attachments, users, seed, destination):
+    """Write a synthetic MoinMoin data directory to DESTINATION"""
+    counts = generate_wiki(
+        Path(destination),
+        pages=pages,
+        revisions=revisions,
+        attachments=attachments,
+        users=users,
+        seed=seed,
+    )
+    click.echo(", ".join(f"{count} {name}" for name, count in counts.items()))
+
+
+if __name__ == "__main__":
+    main()
+
+# end
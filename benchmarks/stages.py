@@ -0,0 +1,197 @@
+"""
+Benchmark each stage of the conversion on a synthetic wiki
+
+Generates a synthetic MoinMoin data directory with `moindata.py`, serves
+it with the `wikiserver.py` stand-in, and then times each stage of the
+conversion in turn:-
+
+- reading the edit-logs with `MoinEditEntries.create_edit_entries`
+- fetching the pages with `FetchCache.fetch`, both uncached and cached
+- `extract_content_section` with each HTML parser backend
+- `translate` with `pandoc`, page by page and in batches
+- writing the `GitExportStream` to `/dev/null`
+
+Run as:  python benchmarks/stages.py [--pages N] [--revisions N] [--keep DIR]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import attr
+import click
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from moin2gitwiki.context import Moin2GitContext  # noqa: E402
+from moin2gitwiki.fetch_cache import FetchCache  # noqa: E402
+from moin2gitwiki.gitrevision import GitExportStream  # noqa: E402
+from moin2gitwiki.moin2markdown import HTML_PARSERS  # noqa: E402
+from moin2gitwiki.moin2markdown import lxml  # noqa: E402
+from moin2gitwiki.moin2markdown import Moin2Markdown  # noqa: E402
+from moin2gitwiki.pipeline import chunked  # noqa: E402
+from moin2gitwiki.wikiindex import MoinEditEntries  # noqa: E402
+from moin2gitwiki.wikiindex import MoinEditType  # noqa: E402
+from moindata import generate_wiki  # noqa: E402
+from wikiserver import start_server  # noqa: E402
+
+
+@attr.s(kw_only=True, slots=True)
+class StageTimer:
+    """
+    Times the stages of a benchmark run, and reports on them
+
+    Attributes:
+        results:    A list of `(stage, items, seconds)` tuples
+
+    """
+
+    results: list = attr.ib(factory=list)
+
+    def run(self, stage: str, function, *args):
+        """Time a call of `function(*args)`, returning the number of items handled"""
+        start = time.perf_counter()
+        items = function(*args)
+        seconds = time.perf_counter() - start
+        self.results.append((stage, items, seconds))
+        click.echo(
+            f"{stage:36s}{items:10d}{seconds:12.3f}s"
+            f"{items / seconds if seconds > 0 else 0:14.1f}/s",
+            err=True,
+        )
+        return items
+
+
+@click.command()
+@click.option("--pages", default=200, type=click.IntRange(min=1))
+@click.option("--revisions", default=10, type=click.IntRange(min=1))
+@click.option("--attachments", default=0.3, type=click.FloatRange(min=0))
+@click.option("--translate-sample", default=100, type=click.IntRange(min=0))
+@click.option("--pandoc-batch", default=20, type=click.IntRange(min=1))
+@click.option("--keep", type=click.Path(file_okay=False), default=None)
+def main(pages, revisions, attachments, translate_sample, pandoc_batch, keep):
+    """
+    Time each stage of the conversion on a synthetic wiki
+
+    The `--translate-sample` option limits how many pages are passed through
+    `pandoc`, since that stage is by far the slowest.  With `--keep` the
+    generated wiki and caches are kept in the given directory.
+    """
+    work_dir = Path(keep) if keep else Path(tempfile.mkdtemp(prefix="moin2gitbench"))
+    work_dir.mkdir(parents=True, exist_ok=True)
+    moin_data = work_dir.joinpath("data")
+    cache_dir = work_dir.joinpath("cache")
+    os.chdir(work_dir)  # the log file is written in the current directory
+    try:
+        timer = StageTimer()
+        click.echo(f"{'stage':36s}{'items':>10s}{'time':>13s}{'rate':>16s}", err=True)
+        if not moin_data.exists():
+            timer.run(
+                "generate wiki data",
+                lambda: generate_wiki(
+                    moin_data,
+                    pages=pages,
+                    revisions=revisions,
+                    attachments=attachments,
+                )["revisions"],
+            )
+        server, url_prefix = start_server(moin_data)
+        ctx = Moin2GitContext.create_context(moin_data=moin_data, user_map=None)
+        #
+        # reading the edit-logs
+        holder = {}
+
+        def read_entries():
+            holder["revisions"] = MoinEditEntries.create_edit_entries(ctx=ctx)
+            return holder["revisions"].count()
+
+        timer.run("create_edit_entries", read_entries)
+        revisions_set = holder["revisions"]
+        translator = Moin2Markdown.create_translator(
+            ctx=ctx,
+            cache_directory=cache_dir,
+            url_prefix=url_prefix,
+            revisions=revisions_set,
+        )
+        pages_to_fetch = [
+            revision
+            for revision in revisions_set.entries
+            if revision.edit_type == MoinEditType.PAGE
+        ]
+        #
+        # fetching the pages - cold and then from the cache
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        fetch_cache = FetchCache.initialise_cache(cache_directory=cache_dir, ctx=ctx)
+        urls = [translator.revision_url(revision) for revision in pages_to_fetch]
+
+        def fetch_all():
+            return sum(1 for url in urls if fetch_cache.fetch(url))
+
+        timer.run("FetchCache.fetch (uncached)", fetch_all)
+        timer.run("FetchCache.fetch (cached)", fetch_all)
+        htmls = [fetch_cache.fetch(url) for url in urls]
+        #
+        # extracting the content
+        sections = []
+        for parser in HTML_PARSERS:
+            if parser == "lxml" and lxml is None:
+                continue
+            html_translator = attr.evolve(
+                translator.html_translator, html_parser=parser
+            )
+
+            def extract_all():
+                sections[:] = [
+                    html_translator.extract_content_section(html) for html in htmls
+                ]
+                return len(sections)
+
+            timer.run(f"extract_content_section ({parser})", extract_all)
+        #
+        # translating a sample of the pages
+        sample = sections[:translate_sample]
+        if shutil.which("pandoc") is not None and len(sample) > 0:
+            html_translator = translator.html_translator
+            translated = []
+
+            def translate_singly():
+                translated[:] = [
+                    html_translator.translate(section) for section in sample
+                ]
+                return len(translated)
+
+            def translate_batched():
+                batches = chunked(sample, pandoc_batch)
+                return sum(
+                    len(html_translator.translate_batch(batch)) for batch in batches
+                )
+
+            timer.run("translate (single)", translate_singly)
+            timer.run(f"translate (batches of {pandoc_batch})", translate_batched)
+        #
+        # writing the fast-import stream, with the same markdown for each page
+        markdown = b"# Page\n\n" + b"Some text for the page.\n" * 50
+
+        def export_all():
+            with open(os.devnull, "wb") as output:
+                export = GitExportStream(output=output, ctx=ctx)
+                for revision in revisions_set.entries:
+                    content = markdown + revision.page_revision.encode("utf-8")
+                    export.add_wiki_revision(revision=revision, content=content)
+                export.end_stream()
+            return revisions_set.count()
+
+        timer.run("GitExportStream", export_all)
+        server.shutdown()
+    finally:
+        if keep is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
+
+# end
@@ -0,0 +1,234 @@
+"""
+A local stand-in for a MoinMoin wiki webserver, for benchmarking
+
+Serves `action=recall` requests for page revisions out of a MoinMoin data
+directory, rendering the wiki markup into HTML shaped like that of a
+MoinMoin 1.9 `modernized` theme page - header, navigation, anchor spans,
+`line` classed paragraphs, smiley images and attachment links - so the
+whole conversion can be run without a real wiki.  Only the markup written
+by `moindata.py` is understood.
+
+Run as:  python benchmarks/wikiserver.py [--port N] MOIN_DATA
+"""
+import html
+import http.server
+import re
+import threading
+import urllib.parse
+from pathlib import Path
+
+import click
+
+SMILEY_IMAGES = {
+    ":)": "smile.png",
+    ";)": "smile4.png",
+    "{i}": "icon-info.png",
+    "/!\\": "alert.png",
+    "(./)": "checkmark.png",
+    ":D": "biggrin.png",
+}
+SMILEY_RE = re.compile(
+    "|".join(re.escape(html.escape(smiley)) for smiley in SMILEY_IMAGES)
+)
+LINK_RE = re.compile(r"\[\[(attachment:)?([^\]]+)\]\]")
+STRONG_RE = re.compile(r"'''(.*?)'''")
+PAGE_TEMPLATE = """<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.01//EN"
+"http://www.w3.org/TR/html4/strict.dtd">
+<html>
+<head>
+<meta http-equiv="Content-Type" content="text/html;charset=utf-8">
+<title>{title} - Benchmark Wiki</title>
+<link rel="stylesheet" type="text/css" charset="utf-8" media="all"
+href="/moin_static/modernized/css/common.css">
+</head>
+<body lang="en" dir="ltr">
+<div id="header">
+<form id="searchform" method="get" action="{prefix}{page}">
+<div>
+<input type="hidden" name="action" value="fullsearch">
+<input id="searchinput" type="text" name="value" value="" size="20">
+</div>
+</form>
+<ul id="navibar">
+<li class="wikilink"><a href="{prefix}FrontPage">FrontPage</a></li>
+<li class="wikilink"><a href="{prefix}RecentChanges">RecentChanges</a></li>
+<li class="wikilink"><a href="{prefix}FindPage">FindPage</a></li>
+</ul>
+<ul class="editbar">
+<li><a href="{prefix}{page}?action=edit&amp;editor=text">Edit</a></li>
+<li><a href="{prefix}{page}?action=info">Info</a></li>
+<li><a href="{prefix}{page}?action=AttachFile">Attachments</a></li>
+</ul>
+</div>
+<div id="page" lang="en" dir="ltr">
+<div id="content" dir="ltr" lang="en">
+<span class="anchor" id="top"></span>
+{content}<span class="anchor" id="bottom"></span></div>
+<p id="pageinfo" class="info" lang="en" dir="ltr">{title}  (revision {revision})</p>
+</div>
+</body>
+</html>
+"""
+
+
+def render_markup(text: str, page: str, prefix: str, pages_dir: Path) -> str:
+    """Render the wiki markup written by `moindata.py` into MoinMoin style HTML"""
+
+    def link(match):
+        target = match.group(2)
+        if match.group(1):
+            return (
+                f'<a class="attachment" href="{prefix}{page}?action=AttachFile'
+                f'&amp;do=view&amp;target={target}" title="">{target}</a>'
+            )
+        exists = pages_dir.joinpath(target.replace("/", "(2f)")).is_dir()
+        css = "" if exists else ' class="nonexistent"'
+        return f'<a{css} href="{prefix}{target}">{target}</a>'
+
+    def smiley(match):
+        title = match.group(0)
+        image = SMILEY_IMAGES[html.unescape(title)]
+        return (
+            f'<img alt="{title}" class="smiley" height="16" '
+            f'src="/moin_static/modernized/img/{image}" title="{title}" width="16">'
+        )
+
+    def inline(line):
+        line = LINK_RE.sub(link, html.escape(line, quote=False))
+        return STRONG_RE.sub(r"<strong>\1</strong>", SMILEY_RE.sub(smiley, line))
+
+    parts = []
+    in_list = False
+    in_pre = False
+    for number, line in enumerate(text.splitlines(), start=1):
+        anchor = f'<span class="anchor" id="line-{number}"></span>'
+        if in_pre:
+            if line == "}}}":
+                parts.append("</pre>")
+                in_pre = False
+            else:
+                parts.append(f"{anchor}{html.escape(line, quote=False)}\n")
+            continue
+        if in_list and not line.startswith(" * "):
+            parts.append("</ul>")
+            in_list = False
+        if line == "{{{":
+            parts.append(f'{anchor}<p class="line867"><pre>')
+            in_pre = True
+        elif line.startswith("= ") and line.endswith(" ="):
+            heading = html.escape(line[2:-2])
+            parts.append(
+                f'{anchor}<p class="line867">\n<h1 id="{heading}">{heading}</h1>\n'
+            )
+        elif line.startswith(" * "):
+            if not in_list:
+                parts.append(f'{anchor}<p class="line867"><ul>')
+                in_list = True
+            parts.append(f'<li><p class="line862">{inline(line[3:])} {anchor}</li>')
+        elif line.startswith("||"):
+            cells = "".join(
+                f'  <td><p class="line862">{inline(cell)} </td>\n'
+                for cell in line.strip("|").split("||")
+            )
+            parts.append(
+                f'{anchor}<p class="line867"><div><table><tbody><tr>{cells}</tr>\n'
+                "</tbody></table></div>",
+            )
+        elif line == "":
+            parts.append(f'{anchor}<p class="line867">\n')
+        else:
+            parts.append(f'{anchor}<p class="line874">{inline(line)} ')
+    if in_list:
+        parts.append("</ul>")
+    return "".join(parts)
+
+
+class WikiHandler(http.server.BaseHTTPRequestHandler):
+    """Answers page revision requests from the MoinMoin data directory"""
+
+    moin_data: Path
+    prefix: str
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        page = urllib.parse.unquote(url.path)
+        if not page.startswith(self.prefix) or query.get("action") != ["recall"]:
+            self.send_error(404)
+            return
+        page = page[len(self.prefix) :]
+        revision = query.get("rev", [""])[0]
+        pages_dir = self.moin_data.joinpath("pages")
+        revision_path = pages_dir.joinpath(
+            page.replace("/", "(2f)"), "revisions", revision
+        )
+        if "/" in revision or not revision_path.is_file():
+            self.send_error(404)
+            return
+        content = render_markup(revision_path.read_text(), page, self.prefix, pages_dir)
+        body = PAGE_TEMPLATE.format(
+            title=html.escape(page),
+            page=page,
+            prefix=self.prefix,
+            revision=revision,
+            content=content,
+        ).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def create_server(
+    moin_data: Path, host: str = "127.0.0.1", port: int = 0, prefix: str = "/wiki/"
+):
+    """
+    Build a threaded stand-in wiki server
+
+    Parameters:
+        moin_data:  Path of the MoinMoin data directory to serve
+        host:       Address to listen on
+        port:       Port to listen on - 0 picks a free port
+        prefix:     URL path the wiki pages are served under
+
+    Returns the server object - its `server_address` gives the port.
+    """
+    handler = type(
+        "BoundWikiHandler",
+        (WikiHandler,),
+        {"moin_data": Path(moin_data), "prefix": prefix},
+    )
+    return http.server.ThreadingHTTPServer((host, port), handler)
+
+
+def start_server(moin_data: Path, **kwargs):
+    """Start a stand-in wiki server in a background thread, returning its URL prefix"""
+    server = create_server(moin_data, **kwargs)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address[:2]
+    return (server, f"http://{host}:{port}{kwargs.get('prefix', '/wiki/')}")
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1")
+@click.option("--port", default=8080, type=click.IntRange(min=0))
+@click.option("--prefix", default="/wiki/")
+@click.argument("moin_data", type=click.Path(exists=True, file_okay=False))
+def main(host, port, prefix, moin_data):
+    """Serve the page revisions of MOIN_DATA as a MoinMoin wiki would"""
+    server = create_server(Path(moin_data), host=host, port=port, prefix=prefix)
+    click.echo(
+        f"Serving {moin_data} at http://{host}:{server.server_address[1]}{prefix}"
+    )
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
+
+# end
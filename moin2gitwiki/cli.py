@@ -5,18 +5,28 @@ Documentation is in the commands part of the documentation - the general
 internals handling does not parse click decorators very well :-(
 
 """
+import contextlib
 import os
 import subprocess
 import sys
+import time
 from pathlib import Path
 
 import click
 
 from . import __version__
 from .context import Moin2GitContext
+from .gitrevision import GitExportState
 from .gitrevision import GitExportStream
+from .gitrevision import GitPackingPolicy
 from .moin2markdown import Moin2Markdown
+from .revision_index import RevisionIndex
+from .stats import ConversionStats
+from .stats import rank_traces
+from .stats import RevisionTrace
+from .wikiindex import MoinDirectoryLinkTable
 from .wikiindex import MoinEditEntries
+from .wikiindex import MoinEditEntryMethods
 
 
 # -----------------------------------------------------------------------
@@ -35,9 +45,58 @@ from .wikiindex import MoinEditEntries
     envvar="MOIN2GIT_USERS",
 )
 @click.option("--proxy", multiple=True, default=[], envvar="MOIN2GIT_PROXY")
+@click.option(
+    "--http-pool-size",
+    default=10,
+    type=click.IntRange(min=1),
+    envvar="MOIN2GIT_HTTP_POOL_SIZE",
+)
+@click.option(
+    "--http-timeout",
+    default=60.0,
+    type=click.FloatRange(min=0),
+    envvar="MOIN2GIT_HTTP_TIMEOUT",
+)
+@click.option(
+    "--http-retries",
+    default=3,
+    type=click.IntRange(min=0),
+    envvar="MOIN2GIT_HTTP_RETRIES",
+)
+@click.option(
+    "--http-backoff",
+    default=0.5,
+    type=click.FloatRange(min=0),
+    envvar="MOIN2GIT_HTTP_BACKOFF",
+)
+@click.option(
+    "--scan-workers",
+    default=8,
+    type=click.IntRange(min=1),
+    envvar="MOIN2GIT_SCAN_WORKERS",
+)
+@click.option(
+    "--index-cache",
+    type=click.Path(file_okay=True, dir_okay=False),
+    envvar="MOIN2GIT_INDEX_CACHE",
+)
 @click.version_option(__version__)
 @click.pass_context
-def moin2gitwiki(ctx, syslog, verbose, debug, moin_data, user_map, proxy):
+def moin2gitwiki(
+    ctx,
+    syslog,
+    verbose,
+    debug,
+    moin_data,
+    user_map,
+    proxy,
+    http_pool_size,
+    http_timeout,
+    http_retries,
+    http_backoff,
+    scan_workers,
+    index_cache,
+):
     """
     MoinMoin To Git Wiki Tools Command Line Utility
 
@@ -66,6 +125,30 @@ def moin2gitwiki(ctx, syslog, verbose, debug, moin_data, user_map, proxy):
 
     - `--user-map` - `MOIN2GIT_USERS` - User map for moin - see the `save-users` command for info
 
+    - `--proxy` - `MOIN2GIT_PROXY` - Proxy setting for wiki requests, given as
+      `scheme=proxy_url`
+
+    - `--http-pool-size` - `MOIN2GIT_HTTP_POOL_SIZE` - Number of kept alive
+      connections to the wiki webserver.  Defaults to 10.
+
+    - `--http-timeout` - `MOIN2GIT_HTTP_TIMEOUT` - Timeout in seconds for
+      requests to the wiki webserver.  Defaults to 60.
+
+    - `--http-retries` - `MOIN2GIT_HTTP_RETRIES` - Number of times a request
+      is retried on connection errors or a 5xx response.  Defaults to 3.
+
+    - `--http-backoff` - `MOIN2GIT_HTTP_BACKOFF` - Backoff factor in seconds
+      between retries, doubling on each retry.  Defaults to 0.5.
+
+    - `--scan-workers` - `MOIN2GIT_SCAN_WORKERS` - Number of threads reading
+      the wiki page edit-logs, which helps where the wiki data is on network
+      storage.  Defaults to 8.
+
+    - `--index-cache` - `MOIN2GIT_INDEX_CACHE` - File to keep an index of the
+      parsed wiki page edit-logs in between runs.  Only pages whose edit-log
+      has changed since are read again, so startup on a large wiki is much
+      quicker.  By default no index is kept.
+
     - `cache-directory` - `MOIN2GIT_CACHE` - Directory for moin component fetches.
       This defaults to `_cache` in the current directory.
 
@@ -86,9 +169,28 @@ def moin2gitwiki(ctx, syslog, verbose, debug, moin_data, user_map, proxy):
         moin_data=moin_data,
         user_map=user_map,
         proxies=proxy,
+        http_pool_size=http_pool_size,
+        http_timeout=http_timeout,
+        http_retries=http_retries,
+        http_backoff=http_backoff,
+        scan_workers=scan_workers,
+        index_cache=None if index_cache is None else Path(index_cache).resolve(),
     )
 
 
+# -----------------------------------------------------------------------
+def read_revisions(ctx) -> MoinEditEntries:
+    """Read the wiki revisions - through the revision index if one is set"""
+    revision_index = None
+    if ctx.index_cache is not None:
+        revision_index = RevisionIndex.open_index(
+            index_path=ctx.index_cache,
+            moin_data=ctx.moin_data,
+            logger=ctx.logger,
+        )
+    return MoinEditEntries.create_edit_entries(ctx=ctx, revision_index=revision_index)
+
+
 # -----------------------------------------------------------------------
 @moin2gitwiki.command()
 @click.pass_obj
@@ -141,21 +243,143 @@ def save_users(ctx, filename):
     envvar="MOIN2GIT_PREFIX",
 )
 @click.option("--home-page/--no-home-page", default=True)
+@click.option(
+    "--namespace-index/--no-namespace-index",
+    default=False,
+    envvar="MOIN2GIT_NAMESPACE_INDEX",
+)
+@click.option(
+    "--fetch-workers",
+    default=0,
+    type=click.IntRange(min=0),
+    envvar="MOIN2GIT_FETCH_WORKERS",
+)
+@click.option(
+    "--translate-workers",
+    default=0,
+    type=click.IntRange(min=0),
+    envvar="MOIN2GIT_TRANSLATE_WORKERS",
+)
+@click.option(
+    "--pandoc-batch",
+    default=1,
+    type=click.IntRange(min=1),
+    envvar="MOIN2GIT_PANDOC_BATCH",
+)
+@click.option(
+    "--translation-cache/--no-translation-cache",
+    default=False,
+    envvar="MOIN2GIT_TRANSLATION_CACHE",
+)
+@click.option(
+    "--skip-identical/--no-skip-identical",
+    default=True,
+    envvar="MOIN2GIT_SKIP_IDENTICAL",
+)
+@click.option(
+    "--stream-file",
+    type=click.Path(file_okay=True, dir_okay=False, allow_dash=True),
+    default=None,
+)
+@click.option("--incremental/--no-incremental", default=False)
+@click.option(
+    "--html-parser",
+    default="beautifulsoup",
+    type=click.Choice(["auto", "lxml", "beautifulsoup"]),
+    envvar="MOIN2GIT_HTML_PARSER",
+)
+@click.option(
+    "--stats-json",
+    type=click.Path(file_okay=True, dir_okay=False, resolve_path=True),
+    default=None,
+    envvar="MOIN2GIT_STATS_JSON",
+)
+@click.option(
+    "--trace-file",
+    type=click.Path(file_okay=True, dir_okay=False, resolve_path=True),
+    default=None,
+    envvar="MOIN2GIT_TRACE_FILE",
+)
+@click.option(
+    "--packing",
+    default=None,
+    type=click.Choice(GitPackingPolicy.PACKINGS),
+    envvar="MOIN2GIT_PACKING",
+)
+@click.option(
+    "--pack-threads",
+    default=None,
+    type=click.IntRange(min=0),
+    envvar="MOIN2GIT_PACK_THREADS",
+)
+@click.option(
+    "--pack-window",
+    default=None,
+    type=click.IntRange(min=1),
+    envvar="MOIN2GIT_PACK_WINDOW",
+)
+@click.option(
+    "--pack-depth",
+    default=None,
+    type=click.IntRange(min=1),
+    envvar="MOIN2GIT_PACK_DEPTH",
+)
+@click.option(
+    "--pack-window-memory", default=None, envvar="MOIN2GIT_PACK_WINDOW_MEMORY"
+)
+@click.option(
+    "--import-depth",
+    default=None,
+    type=click.IntRange(min=1),
+    envvar="MOIN2GIT_IMPORT_DEPTH",
+)
+@click.option("--max-pack-size", default=None, envvar="MOIN2GIT_MAX_PACK_SIZE")
+@click.option(
+    "--big-file-threshold",
+    default=None,
+    envvar="MOIN2GIT_BIG_FILE_THRESHOLD",
+)
 @click.argument(
     "destination",
+    required=False,
     type=click.Path(exists=False, file_okay=False, dir_okay=True),
 )
 @click.pass_obj
-def fast_export(ctx, cache_directory, url_prefix, home_page, destination):
+def fast_export(
+    ctx,
+    cache_directory,
+    url_prefix,
+    home_page,
+    namespace_index,
+    fetch_workers,
+    translate_workers,
+    pandoc_batch,
+    translation_cache,
+    skip_identical,
+    stream_file,
+    incremental,
+    html_parser,
+    stats_json,
+    trace_file,
+    packing,
+    pack_threads,
+    pack_window,
+    pack_depth,
+    pack_window_memory,
+    import_depth,
+    max_pack_size,
+    big_file_threshold,
+    destination,
+):
     """
     Git fast-export all the revisions in the wiki into markdown git wiki form
 
     Named for the `git fast-export` command, although it actually builds a new
     git repository and then translates each revision at a time into a command
     stream for `git-fast-import` on that new repository.  After all pages and
-    revisions have been processed the new git wiki repo instance is garbage
-    collected  (to compress all the revisions into a more compact set of git
-    packs) and finally checked out.
+    revisions have been processed the new git wiki repo instance is packed
+    (to compress all the revisions into a more compact set of git packs) and
+    finally checked out.
 
     Page names are slightly modified - the "(2f)" seen in wiki file names
     (which is normally displayed as a `/` character) are changed to
@@ -172,15 +396,163 @@ def fast_export(ctx, cache_directory, url_prefix, home_page, destination):
     pass through pandoc to get a markdown (specifically github flavoured
     markdown).
 
+    Unless the `--no-home-page` option is given, a synthetic `Home` page is
+    added at the end listing all the pages in the wiki, other than those
+    deleted or renamed away.  With the `--namespace-index` option the home
+    page lists only the top level pages, each top level namespace getting
+    its own `Home-` index page - which keeps each page a reasonable size on
+    a very large wiki.  This can also be set using the
+    `MOIN2GIT_NAMESPACE_INDEX` environment variable.
+
+    The `--fetch-workers` option sets a number of threads used to fetch the
+    page revisions from the wiki webserver concurrently - a bounded window of
+    fetches is kept running ahead of the revision being committed, but the
+    commits are still made strictly in revision date order.  The default of
+    `0` fetches each page in turn.  This can also be set using the
+    `MOIN2GIT_FETCH_WORKERS` environment variable.
+
+    The `--translate-workers` option sets a number of worker processes used
+    to extract the content from the page HTML and convert it with `pandoc`,
+    so this CPU bound work can be spread over several cores.  The default of
+    `0` does the translation within the main process.  This can also be set
+    using the `MOIN2GIT_TRANSLATE_WORKERS` environment variable.
+
+    The `--pandoc-batch` option sets how many page revisions are translated
+    by each run of `pandoc`, saving the cost of starting pandoc for every
+    revision.  Should a batch fail then its pages are translated one at a
+    time.  This can also be set using the `MOIN2GIT_PANDOC_BATCH` environment
+    variable.
+
+    The `--translation-cache` option keeps the translated Markdown of each
+    page in the cache directory, keyed on the page HTML, how its links are
+    rewritten, and the `pandoc` version.  A later run with the same inputs
+    then skips the HTML extraction and `pandoc` entirely.  This can also be
+    set using the `MOIN2GIT_TRANSLATION_CACHE` environment variable.
+
+    By default a revision whose wiki source is identical to an earlier
+    revision of the same page, such as a revert, is not fetched or
+    translated again - the earlier translation is reused.  This can be
+    turned off with `--no-skip-identical`, or by setting the
+    `MOIN2GIT_SKIP_IDENTICAL` environment variable to false.
+
+    The `--html-parser` option picks the parser used to pull the content
+    out of the page HTML - `beautifulsoup`, the default, or `lxml`, which
+    is much faster but needs the optional `lxml` package installed.  With
+    `auto` the `lxml` parser is used if it is installed.  Both give the
+    same Markdown.
+    This can also be set using the `MOIN2GIT_HTML_PARSER` environment
+    variable.
+
+    The `--stream-file` option writes the `git fast-import` command stream
+    to the given file, or to stdout if given as `-`, instead of building a
+    git repository - no destination is then given.  The stream can later be
+    imported with `git fast-import` into a new repository, possibly on a
+    different machine.  The packing and `git fast-import` options below
+    cannot be used with it.
+
+    The `--incremental` option allows the destination to be a repository
+    built by an earlier `--incremental` run, in which case only the wiki
+    revisions made since that run are added onto the existing branch.  The
+    git fast-import marks and the time of the last revision exported are
+    kept within the `.git` directory of the repository for this.  If the
+    destination does not exist then it is built from scratch as usual.  If
+    any wiki pages could not be fetched the saved state is left as it was,
+    and the run ends with an error, so that the next incremental run writes
+    those revisions again.
+
+    At the end of the run a summary is shown of the time spent in each
+    stage - fetching pages, parsing the HTML, `pandoc`, and writing to
+    `git fast-import` (which includes any time waiting for it to catch up) -
+    with the throughput and latencies of each, along with counts of cache
+    hits and misses, bytes fetched and blob bytes written.  The
+    `--stats-json` option also writes these figures to the given JSON file,
+    for comparing runs.  This can also be set using the
+    `MOIN2GIT_STATS_JSON` environment variable.
+
+    The `--trace-file` option writes a JSON Lines trace to the given file,
+    with a record for each wiki revision giving its page and revision, the
+    sizes of its HTML and Markdown, the time spent fetching, parsing, in
+    `pandoc` and writing it, and whether the fetch and translation caches
+    were hit.  The `slowest` command ranks the pages in a trace.  This can
+    also be set using the `MOIN2GIT_TRACE_FILE` environment variable.
+
+    The `--packing` option sets how the repository is packed after the
+    import.  The default of `aggressive` runs `git gc --aggressive`, which
+    gives the smallest repository but can take longer than the import
+    itself.  With `fast` a single `git repack` is run, reusing the deltas
+    made by `git fast-import` and comparing each remaining object with up
+    to `--pack-window` others (default 10) to make delta chains no longer
+    than `--pack-depth` (default 20).  With `none` the packs written by
+    `git fast-import` are left as they are.  The `--pack-threads` option
+    limits the threads used for packing, and `--pack-window-memory` limits
+    the memory used by each thread, given as a git size such as `256m` -
+    by default git picks both.  These can also be set using the
+    `MOIN2GIT_PACKING`, `MOIN2GIT_PACK_THREADS`, `MOIN2GIT_PACK_WINDOW`,
+    `MOIN2GIT_PACK_DEPTH` and `MOIN2GIT_PACK_WINDOW_MEMORY` environment
+    variables.
+
+    The `--import-depth`, `--max-pack-size` and `--big-file-threshold`
+    options are passed to `git fast-import` as its `--depth`,
+    `--max-pack-size` and `--big-file-threshold` options.  These can also
+    be set using the `MOIN2GIT_IMPORT_DEPTH`, `MOIN2GIT_MAX_PACK_SIZE` and
+    `MOIN2GIT_BIG_FILE_THRESHOLD` environment variables.  The time spent
+    in each git step is shown in the summary at the end of the run.
+
     """
     # cwd = Path.cwd()
-    destination = Path(destination)
-    if destination.exists():
-        raise SystemExit(f"Destination path {destination} already exists.")
+    state = None
+    #
+    # the packing options given - the defaults are left to GitPackingPolicy
+    packing_options = [
+        (option, attribute, value)
+        for option, attribute, value in (
+            ("--packing", "packing", packing),
+            ("--pack-threads", "threads", pack_threads),
+            ("--pack-window", "window", pack_window),
+            ("--pack-depth", "depth", pack_depth),
+            ("--pack-window-memory", "window_memory", pack_window_memory),
+            ("--import-depth", "import_depth", import_depth),
+            ("--max-pack-size", "max_pack_size", max_pack_size),
+            ("--big-file-threshold", "big_file_threshold", big_file_threshold),
+        )
+        if value is not None
+    ]
+    packing_policy = GitPackingPolicy(
+        **{attribute: value for _, attribute, value in packing_options},
+    )
+    if stream_file is not None:
+        if incremental:
+            raise click.UsageError("--incremental cannot be used with --stream-file")
+        if destination is not None:
+            raise click.UsageError("A destination cannot be used with --stream-file")
+        for option, _, _ in packing_options:
+            raise click.UsageError(f"{option} cannot be used with --stream-file")
+        if stream_file == "-":
+            # stdout carries the stream, so everything else goes to stderr
+            ctx.log_console_to_stderr()
+    else:
+        if destination is None:
+            raise click.UsageError("A destination is required")
+        destination = Path(destination)
+        if destination.exists():
+            if not incremental:
+                raise SystemExit(f"Destination path {destination} already exists.")
+            state = GitExportState.load_state(destination.joinpath(".git"))
+            if state is None:
+                raise SystemExit(
+                    f"Destination path {destination} was not built by an "
+                    "incremental export.",
+                )
+    to_stderr = stream_file == "-"
+    stats = ConversionStats()
     #
     # build your initial revision set from the wiki data
-    revisions = MoinEditEntries.create_edit_entries(ctx=ctx)
-    click.echo(click.style(f"Read {revisions.count()} wiki revisions", fg="green"))
+    with stats.timed("read revisions"):
+        revisions = read_revisions(ctx)
+    click.echo(
+        click.style(f"Read {revisions.count()} wiki revisions", fg="green"),
+        err=to_stderr,
+    )
     #
     # build the translator
     translator = Moin2Markdown.create_translator(
@@ -188,27 +560,148 @@ def fast_export(ctx, cache_directory, url_prefix, home_page, destination):
         cache_directory=Path(cache_directory),
         url_prefix=url_prefix,
         revisions=revisions,
+        translation_cache=translation_cache,
+        html_parser=html_parser,
+        stats=stats,
     )
     #
-    # build the output git instance
-    destination.mkdir(mode=0o755)
-    os.chdir(destination)
-    subprocess.run(["git", "init"])
-    with subprocess.Popen(["git", "fast-import"], stdin=subprocess.PIPE) as gitstream:
-        export = GitExportStream(output=gitstream.stdin, ctx=ctx)
-        with click.progressbar(revisions.entries) as entries:
-            for revision in entries:
-                content = translator.retrieve_and_translate(revision=revision)
+    # pick out the revisions not yet exported
+    entries = revisions.entries
+    if state is not None:
+        entries = state.new_revisions(entries)
+        click.echo(click.style(f"{len(entries)} new wiki revisions", fg="green"))
+        if len(entries) == 0:
+            return
+    translated = translator.translate_revisions_traced(
+        revisions=entries,
+        fetch_workers=fetch_workers,
+        translate_workers=translate_workers,
+        batch_size=pandoc_batch,
+        skip_identical=skip_identical,
+    )
+
+    def write_stream(output):
+        if state is None:
+            export = GitExportStream(output=output, ctx=ctx, stats=stats)
+        else:
+            export = state.create_stream(output, ctx=ctx, stats=stats)
+        progress_file = sys.stderr if to_stderr else None
+        if trace_file is not None:
+            trace_output = open(trace_file, "w")
+        else:
+            trace_output = contextlib.nullcontext()
+        with trace_output, click.progressbar(
+            length=len(entries),
+            file=progress_file,
+        ) as progress:
+            for revision, content, trace in translated:
+                if trace.fetch_failed:
+                    # rather than replace the page with an empty one
+                    ctx.logger.warning(
+                        f"Skipping {trace.page} revision {trace.revision}"
+                        " - its page could not be fetched",
+                    )
+                    stats.count("revisions skipped")
+                else:
+                    start = time.perf_counter()
+                    export.add_wiki_revision(
+                        revision=revision,
+                        content=content,
+                    )
+                    trace.write = time.perf_counter() - start
+                if trace_file is not None:
+                    trace_output.write(trace.as_json() + "\n")
+                progress.update(1)
+        if home_page:
+            if namespace_index:
+                index_pages = revisions.create_index_pages()
+            else:
+                index_pages = [revisions.create_home_page()]
+            for revision, content in index_pages:
                 export.add_wiki_revision(
                     revision=revision,
-                    content=content,
+                    content=content.encode("utf-8"),
                 )
-        if home_page:
-            revision, content = revisions.create_home_page()
-            export.add_wiki_revision(revision=revision, content=content.encode("utf-8"))
         export.end_stream()
-    subprocess.run(["git", "gc", "--aggressive"])  # pack it
-    subprocess.run(["git", "checkout", "master"])  # check out the data
+        return export
+
+    #
+    # write the stream out to a file if asked
+    if stream_file == "-":
+        write_stream(sys.stdout.buffer)
+        sys.stdout.buffer.flush()
+        report_stats(translator, stats_json, to_stderr)
+        return
+    elif stream_file is not None:
+        with open(stream_file, "wb") as output:
+            write_stream(output)
+        report_stats(translator, stats_json, to_stderr)
+        return
+    #
+    # build the output git instance
+    if state is None:
+        destination.mkdir(mode=0o755)
+        os.chdir(destination)
+        subprocess.run(["git", "init"])
+    else:
+        os.chdir(destination)
+    git_dir = Path(".git").resolve()
+    fast_import = ["git", "fast-import"] + packing_policy.fast_import_options()
+    if incremental:
+        fast_import += GitExportState.fast_import_options(git_dir, state)
+    with subprocess.Popen(fast_import, stdin=subprocess.PIPE) as gitstream:
+        export = write_stream(gitstream.stdin)
+        gitstream.stdin.close()
+        with stats.timed("git fast-import finish"):
+            gitstream.wait()
+    if gitstream.returncode != 0:
+        raise SystemExit(f"git fast-import failed with status {gitstream.returncode}")
+    #
+    # the revisions which could not be fetched were skipped - leave the
+    # saved state as it was so that the next export writes them again
+    fetch_failures = translator.fetch_cache.failures
+    if incremental and fetch_failures == 0:
+        GitExportState.from_export(
+            export=export,
+            revisions=entries,
+            previous=state,
+        ).save_state(git_dir)
+    pack_command = packing_policy.pack_command()
+    if pack_command is not None:
+        with stats.timed(f"git pack ({packing_policy.packing})"):
+            subprocess.run(pack_command)  # pack it
+    # check out the data - forced so an existing checkout is updated
+    with stats.timed("git checkout"):
+        subprocess.run(["git", "checkout", "--force", "master"])
+    report_stats(translator, stats_json, to_stderr)
+    if incremental and fetch_failures > 0:
+        if state is None:
+            retry = f"remove {destination} and export again"
+        else:
+            retry = "the next incremental export will retry them"
+        raise SystemExit(
+            f"{fetch_failures} wiki pages could not be fetched, so the export "
+            f"state was not saved - {retry}",
+        )
+
+
+def report_stats(translator: Moin2Markdown, stats_json, to_stderr: bool):
+    """Show the conversion stats summary, and save them as JSON if asked"""
+    stats = translator.stats
+    cache = translator.fetch_cache
+    stats.count("fetch cache hits", cache.hits)
+    stats.count("fetch cache misses", cache.misses)
+    stats.count("fetch failures", cache.failures)
+    stats.count("bytes fetched", cache.bytes_fetched)
+    link_cache = translator.html_translator.link_cache
+    if link_cache.hits + link_cache.misses > 0:
+        # only gathered when translating in the main process
+        stats.count("link cache hits", link_cache.hits)
+        stats.count("link cache misses", link_cache.misses)
+    for line in stats.summary():
+        click.echo(line, err=to_stderr)
+    if stats_json is not None:
+        stats.save_json(Path(stats_json))
 
 
 # -----------------------------------------------------------------------
@@ -224,21 +717,180 @@ def fast_export(ctx, cache_directory, url_prefix, home_page, destination):
     default="http://localhost/jrtwiki/",
     envvar="MOIN2GIT_PREFIX",
 )
+@click.option(
+    "--concurrency",
+    default=8,
+    type=click.IntRange(min=1),
+    envvar="MOIN2GIT_PREFETCH_CONCURRENCY",
+)
+@click.option(
+    "--skip-identical/--no-skip-identical",
+    default=True,
+    envvar="MOIN2GIT_SKIP_IDENTICAL",
+)
+@click.pass_obj
+def prefetch(ctx, cache_directory, url_prefix, concurrency, skip_identical):
+    """
+    Fill the fetch cache with every page revision needed by `fast-export`
+
+    This reads the wiki revisions in the same way as `fast-export`, and
+    fetches the web page of each revision not already in the cache - on
+    `--concurrency` threads, each with one request to the webserver in
+    flight at a time.  The cache can be warmed like this while the wiki is
+    still live, and the `fast-export` run later made without needing the
+    webserver.  As with `fast-export`, revisions identical to an earlier
+    revision of the same page are skipped unless `--no-skip-identical` is
+    given.
+
+    The number of pages found in the cache, the number fetched, the number
+    which failed, and the bytes transferred are reported at the end.
+    """
+    #
+    # build your initial revision set from the wiki data
+    revisions = read_revisions(ctx)
+    click.echo(click.style(f"Read {revisions.count()} wiki revisions", fg="green"))
+    #
+    # build the translator
+    translator = Moin2Markdown.create_translator(
+        ctx=ctx,
+        cache_directory=Path(cache_directory),
+        url_prefix=url_prefix,
+        revisions=revisions,
+    )
+    #
+    # fetch everything into the cache
+    translator.prefetch(
+        revisions=revisions.entries,
+        concurrency=concurrency,
+        skip_identical=skip_identical,
+    )
+    cache = translator.fetch_cache
+    click.echo(
+        click.style(
+            f"Cache hits {cache.hits}, misses {cache.misses}, "
+            f"failures {cache.failures}, {cache.bytes_fetched} bytes fetched",
+            fg="red" if cache.failures > 0 else "green",
+        ),
+    )
+
+
+# -----------------------------------------------------------------------
+@moin2gitwiki.command()
+@click.option(
+    "--cache-directory",
+    default="_cache",
+    envvar="MOIN2GIT_CACHE",
+)
+@click.option(
+    "--old-prefix",
+    required=True,
+    multiple=True,
+    envvar="MOIN2GIT_OLD_PREFIX",
+)
+@click.pass_obj
+def migrate_cache(ctx, cache_directory, old_prefix):
+    """
+    Rekey fetch cache entries made with an old wiki URL prefix
+
+    The web page of each revision is now held in the fetch cache under the
+    identity of the revision - its page path, revision number and a hash of
+    its wiki source - rather than under the URL it was fetched from.  That
+    way moving the wiki to a different host, changing between `http` and
+    `https`, or putting a proxy in front of it does not throw away the
+    cache.
+
+    Caches filled by older versions hold the pages under their URLs.  These
+    are picked up automatically while the `--url-prefix` stays the same,
+    but if the wiki has moved then this command brings the old entries
+    across.  Give the URL prefix the cache was filled from as the
+    `--old-prefix` option - this may be repeated if the cache was filled
+    from more than one.  It can also be set using the `MOIN2GIT_OLD_PREFIX`
+    environment variable.
+    """
+    #
+    # build your initial revision set from the wiki data
+    revisions = read_revisions(ctx)
+    click.echo(click.style(f"Read {revisions.count()} wiki revisions", fg="green"))
+    translator = Moin2Markdown.create_translator(
+        ctx=ctx,
+        cache_directory=Path(cache_directory),
+        url_prefix=old_prefix[0],
+        revisions=revisions,
+    )
+    for url_prefix in old_prefix:
+        copied = translator.migrate_fetch_cache(
+            revisions=revisions.entries,
+            url_prefix=url_prefix,
+        )
+        click.echo(
+            click.style(
+                f"Migrated {copied} cache entries from {url_prefix}", fg="green"
+            ),
+        )
+
+
+# -----------------------------------------------------------------------
+@moin2gitwiki.command()
+@click.option(
+    "--cache-directory",
+    default="_cache",
+    envvar="MOIN2GIT_CACHE",
+)
+@click.option(
+    "--url-prefix",
+    "--prefix",
+    default="http://localhost/jrtwiki/",
+    envvar="MOIN2GIT_PREFIX",
+)
+@click.option("--lazy/--no-lazy", default=False)
+@click.option(
+    "--html-parser",
+    default="beautifulsoup",
+    type=click.Choice(["auto", "lxml", "beautifulsoup"]),
+    envvar="MOIN2GIT_HTML_PARSER",
+)
 @click.argument("page", required=True, type=str)
 @click.argument("version", required=True, type=int)
 @click.pass_obj
-def translate_page(ctx, cache_directory, url_prefix, page, version):
+def translate_page(ctx, cache_directory, url_prefix, lazy, html_parser, page, version):
     """
     Fetch a single page revision and translate to Markdown
 
-    The first argument is a page name, the second an integer revision.
+    The first argument is a page name, the second an integer revision.  The
+    page name is as in the wiki - a `/` within it may be given as is or as
+    the `(2f)` used on the filesystem.
 
-    The translation process is as described for the `fast-export` command.
+    The translation process is as described for the `fast-export` command,
+    including the `--html-parser` option.
+
+    With the `--lazy` option only the edit-log of the page itself is read,
+    rather than that of every page in the wiki, and each link within the
+    page is checked against the wiki data directory as it is translated.
+    This is much quicker for spot checking pages of a large wiki, but links
+    to pages which have been renamed may not be translated.  A revision
+    made under an earlier name of a renamed page is not within the edit-log
+    of that name, so the whole wiki is read to find it.
     """
     #
-    # build your initial revision set from the wiki data
-    revisions = MoinEditEntries.create_edit_entries(ctx=ctx)
+    # the edit-log holds the page names as escaped on the filesystem
+    page_name = MoinEditEntryMethods.escape(page)
+    revision = None
+    links = None
+    if lazy:
+        revisions = MoinEditEntries.create_page_entries(ctx=ctx, page_path=page_name)
+        revision = revisions.find_revision(page_name, version)
+        if revision is None:
+            ctx.logger.info(f"No revision {version} in the edit-log of page {page}")
+        else:
+            links = MoinDirectoryLinkTable(
+                pages_dir=str(ctx.moin_data.joinpath("pages")),
+            )
+    if revision is None:
+        revisions = read_revisions(ctx)
+        revision = revisions.find_revision(page_name, version)
     click.echo(click.style(f"Read {revisions.count()} wiki revisions", fg="green"))
+    if revision is None:
+        raise SystemExit(f"No revision {version} of page {page} in the wiki")
     #
     # build the translator
     translator = Moin2Markdown.create_translator(
@@ -246,13 +898,66 @@ def translate_page(ctx, cache_directory, url_prefix, page, version):
         cache_directory=Path(cache_directory),
         url_prefix=url_prefix,
         revisions=revisions,
+        links=links,
+        html_parser=html_parser,
     )
     #
-    # find the page and translate it
-    for revision in revisions.entries:
-        if revision.page_name == page and int(revision.page_revision) == version:
-            content = translator.retrieve_and_translate(revision=revision)
-            print(content.decode("utf-8"))
+    # translate the page
+    content = translator.retrieve_and_translate(revision=revision)
+    if content is None:
+        raise SystemExit(
+            f"Page {page} revision {version} has no content, or could not be fetched",
+        )
+    print(content.decode("utf-8"))
+
+
+# -----------------------------------------------------------------------
+@moin2gitwiki.command()
+@click.option(
+    "--by",
+    default="total",
+    type=click.Choice(
+        list(RevisionTrace.TIMES) + ["total", "html_bytes", "markdown_bytes"],
+    ),
+)
+@click.option("--limit", default=20, type=click.IntRange(min=1))
+@click.option("--per-revision/--per-page", default=False)
+@click.argument(
+    "trace_file",
+    required=True,
+    type=click.Path(exists=True, file_okay=True, dir_okay=False),
+)
+def slowest(by, limit, per_revision, trace_file):
+    """
+    Rank the slowest pages from a `fast-export` trace file
+
+    The argument is a trace file written by the `--trace-file` option of
+    `fast-export`.  The pages are listed slowest first, with the time spent
+    on all their revisions in each stage, so the pages worth simplifying
+    stand out.
+
+    The `--by` option picks what to rank on - the `total` time (the
+    default), one stage - `fetch`, `parse`, `pandoc` or `write` - or the
+    `html_bytes` or `markdown_bytes` sizes.  The `--limit` option sets how
+    many are listed, defaulting to 20.  With `--per-revision` each revision
+    is ranked on its own, rather than totalled up for each page.
+    """
+    with open(trace_file) as lines:
+        ranked = rank_traces(lines, by=by, per_revision=per_revision)
+    header = f"{'total':>9s}{'fetch':>9s}{'parse':>9s}{'pandoc':>9s}{'write':>9s}"
+    header += f"{'html':>10s}{'markdown':>10s}"
+    header += "  revision" if per_revision else f"{'revs':>6s}"
+    click.echo(f"{header}  page")
+    for record in ranked[:limit]:
+        line = "".join(
+            f"{record[field]:9.3f}" for field in ("total",) + RevisionTrace.TIMES
+        )
+        line += f"{record['html_bytes']:10d}{record['markdown_bytes']:10d}"
+        if per_revision:
+            line += f"  {record['revision']:8s}"
+        else:
+            line += f"{record['revisions']:6d}"
+        click.echo(f"{line}  {record['page']}")
 
 
 # -----------------------------------------------------------------------
@@ -38,6 +38,13 @@ class Moin2GitContext:
         logger:     Logging object
         moin_data:  Path of the MoinMoin data directory
         users:      Moin user set object
+        proxies:    Proxy settings for HTTP requests
+        http_pool_size: Maximum number of pooled connections per host
+        http_timeout: Timeout, in seconds, for HTTP requests
+        http_retries: Number of retries of failed HTTP requests
+        http_backoff: Backoff factor between HTTP retries, in seconds
+        scan_workers: Number of threads reading the wiki edit-logs
+        index_cache: Path of the persistent revision index, if one is used
 
     """
 
@@ -48,6 +55,13 @@ class Moin2GitContext:
     debug: bool = attr.ib(default=False)
     verbose: bool = attr.ib(default=False)
     proxies: Dict[str, str] = attr.ib(default={})
+    http_pool_size: int = attr.ib(default=10)
+    http_timeout: float = attr.ib(default=60.0)
+    http_retries: int = attr.ib(default=3)
+    http_backoff: float = attr.ib(default=0.5)
+    scan_workers: int = attr.ib(default=8)
+    index_cache: Path = attr.ib(default=None)
+    _console_handler: logging.Handler = attr.ib(default=None, init=False, repr=False)
 
     @property
     def moin_data(self):
@@ -135,6 +149,7 @@ class Moin2GitContext:
             console_handler.setLevel(logging.WARNING)
         console_handler.setFormatter(CONSOLE_FORMATTER)
         logger.addHandler(console_handler)
+        self._console_handler = console_handler
         #
         # set up syslog
         if self.syslog:
@@ -147,5 +162,12 @@ class Moin2GitContext:
             logger.addHandler(syslog_handler)
         logger.addHandler(self.get_file_handler())
 
+    def log_console_to_stderr(self):
+        """
+        Move the console logging to stderr - for when stdout carries data
+        """
+        if self._console_handler is not None:
+            self._console_handler.setStream(sys.stderr)
+
 
 # end
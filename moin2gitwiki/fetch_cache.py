@@ -1,9 +1,158 @@
+import gzip
+import hashlib
 import json
+import os
+import sqlite3
+import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Callable
+from typing import Iterable
+from typing import Iterator
+from typing import Optional
+from typing import Tuple
 
 import attr
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+@attr.s(kw_only=True, slots=True)
+class FetchCacheIndex:
+    """
+    The index of a fetch cache - maps keys to the cache file holding them
+
+    The keys are normally the URLs fetched, but may be any string which
+    identifies the content - wiki page revisions are keyed on the page
+    identity, so that they survive the wiki moving host.
+
+    The index is kept in an SQLite database, so that adding an entry costs
+    the same however large the cache is, and each entry is committed as it
+    is added so that an interrupted run loses nothing already fetched.
+
+    Attributes:
+        index_path:     Path of the SQLite index file
+        connection:     The SQLite database connection
+
+    The index may be used from several threads at once - access to the
+    database connection is serialised by an internal lock.
+
+    """
+
+    index_path: Path = attr.ib()
+    connection: sqlite3.Connection = attr.ib(repr=False)
+    _lock: threading.Lock = attr.ib(factory=threading.Lock, init=False, repr=False)
+
+    @classmethod
+    def open_index(cls, index_path: Path, logger):
+        """
+        Open, creating if needed, the index database
+
+        Parameters:
+            index_path:     Path of the SQLite index file
+            logger:         Logger object
+
+        """
+        connection = sqlite3.connect(
+            str(index_path),
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache_index "
+            "(url TEXT PRIMARY KEY, item TEXT NOT NULL)",
+        )
+        logger.debug(f"Opened cache index {index_path}")
+        return cls(index_path=index_path, connection=connection)
+
+    def migrate_json_index(self, json_path: Path, logger):
+        """
+        Migrate the entries of an old style `index.json` into this index
+
+        Parameters:
+            json_path:      Path of the old JSON index file
+            logger:         Logger object
+
+        Once the entries are safely committed, the JSON file is renamed with
+        a `.migrated` suffix so it is not read again.
+        """
+        try:
+            cache_map = json.loads(json_path.read_text())
+        except (OSError, ValueError):
+            logger.warning(f"Unable to read old cache index {json_path} - ignored")
+            return
+        with self._lock:
+            self.connection.execute("BEGIN")
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO cache_index (url, item) VALUES (?, ?)",
+                cache_map.items(),
+            )
+            self.connection.execute("COMMIT")
+        json_path.rename(json_path.with_name(json_path.name + ".migrated"))
+        logger.info(f"Migrated {len(cache_map)} entries from {json_path}")
+
+    def get(self, url: str) -> Optional[str]:
+        """Return the cache file name for a URL, or None if not in the index"""
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT item FROM cache_index WHERE url = ?",
+                (url,),
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def set(self, url: str, item_name: str):
+        """Add or replace the cache file name for a URL"""
+        with self._lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO cache_index (url, item) VALUES (?, ?)",
+                (url, item_name),
+            )
+
+    def copy_keys(self, key_pairs: Iterable[Tuple[str, str]]) -> int:
+        """
+        Copy index entries to new keys
+
+        Parameters:
+            key_pairs:  Pairs of `(old_key, new_key)` - each new key is set to
+                        the cache file of the old key, if the old key is in
+                        the index
+
+        The old entries are left in place.  Returns the number of entries
+        copied.
+        """
+        with self._lock:
+            self.connection.execute("BEGIN")
+            before = self.connection.total_changes
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO cache_index (url, item) "
+                "SELECT ?, item FROM cache_index WHERE url = ?",
+                ((new_key, old_key) for old_key, new_key in key_pairs),
+            )
+            copied = self.connection.total_changes - before
+            self.connection.execute("COMMIT")
+        return copied
+
+    def items(self) -> Iterator[Tuple[str, str]]:
+        """Return all the `(url, item_name)` pairs in the index"""
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT url, item FROM cache_index",
+            ).fetchall()
+        return iter(rows)
+
+    def __contains__(self, url: str) -> bool:
+        return self.get(url) is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            (count,) = self.connection.execute(
+                "SELECT COUNT(*) FROM cache_index",
+            ).fetchone()
+        return count
 
 
 @attr.s(kw_only=True, slots=True)
@@ -11,105 +160,343 @@ class FetchCache:
     """
     Implements a local cache for URLs which can be persistant between runs
 
-    Basic cache directory which contains an `index.json` file with a table of
-    URLs and the cache file they map to.  Has zero intelligence - assumes
-    everything can be cached for ever - which is reasonable considering the
-    things we request via the cache.
+    Basic cache directory which contains an `index.sqlite` index with a
+    table of URLs and the cache file they map to.  Has zero intelligence -
+    assumes everything can be cached for ever - which is reasonable
+    considering the things we request via the cache.
+
+    A fetch may give a key to cache the content under in place of the URL,
+    so that content which does not depend on where it was fetched from
+    stays cached when the URL changes.  Entries cached under the URL by
+    older versions are picked up, and copied to the key, when first used.
+
+    Cached content is stored gzip compressed under the `objects` directory,
+    named by the SHA-256 hash of the content, so identical responses are
+    only stored once.  Entries written by older versions - uncompressed
+    files named by a random UUID - are still read transparently.
+
+    Requests are made through a single `requests` session, which keeps a
+    pool of connections alive to the webserver and retries, with backoff,
+    on connection errors and 5xx responses.  A request which still fails is
+    never written to the cache, so is tried again on the next run.
 
     Attributes:
         cache_directory:    Path of the cache directory
-        index_path:         Path of the cache index file - normally `index.json` within `cache_directory`
-        cache_map:          The dict mapping URLs to filenames within the cache
+        index:              The FetchCacheIndex mapping URLs to filenames within the cache
         ctx:                Context object (used for logging etc)
+        session:            The requests session used for fetches
+        hits:               Count of URLs found in the cache
+        misses:             Count of URLs fetched from the webserver
+        failures:           Count of URLs which could not be fetched
+        bytes_fetched:      Total size of the responses fetched from the webserver
+
+    The cache may be used from several threads at once.
 
     """
 
     cache_directory: Path = attr.ib()
-    index_path: Path = attr.ib()
-    cache_map: dict = attr.ib(default={})
+    index: FetchCacheIndex = attr.ib()
     ctx = attr.ib(repr=False)
     session: requests.sessions.Session = attr.ib()
+    hits: int = attr.ib(default=0, init=False)
+    misses: int = attr.ib(default=0, init=False)
+    failures: int = attr.ib(default=0, init=False)
+    bytes_fetched: int = attr.ib(default=0, init=False)
+    _lock: threading.Lock = attr.ib(factory=threading.Lock, init=False, repr=False)
 
     @classmethod
     def initialise_cache(cls, cache_directory: Path, ctx):
         """
         Build and preload the cache object
 
-        Creates if needed the passed `cache_directory`, and either loads the
-        existing `index.json` or writes an empty one.
+        Creates if needed the passed `cache_directory`, and opens or creates
+        the index within it.  Should there be an `index.json` from an older
+        version, its entries are migrated into the new index.
         """
         # ensure directory exists
         cache_directory.mkdir(mode=0o777, parents=True, exist_ok=True)
         # ensure we have it as an absolute path
         cache_directory = cache_directory.resolve(strict=True)
         #
-        # load the index should it exist
-        index_path = cache_directory.joinpath("index.json")
-        cache_map = {}
-        try:
-            cache_map = json.loads(index_path.read_text())
-        except (OSError, ValueError):
-            # if anything goes wrong then we just ignore it and
-            # write out a blank cache file
-            cache_map = {}
-            cls.write_index(index_path=index_path, cache_map=cache_map)
+        # open the index, bringing across any old style index
+        index = FetchCacheIndex.open_index(
+            index_path=cache_directory.joinpath("index.sqlite"),
+            logger=ctx.logger,
+        )
+        json_index_path = cache_directory.joinpath("index.json")
+        if json_index_path.exists():
+            index.migrate_json_index(json_path=json_index_path, logger=ctx.logger)
         #
         # build the requests session
-        session = requests.Session()
-        if len(ctx.proxies) > 0:
-            session.proxies.update(ctx.proxies)
+        session = cls.create_session(ctx)
         #
         # build and return the object
         ctx.logger.debug(f"Building cache in directory {cache_directory}")
         return cls(
             cache_directory=cache_directory,
-            index_path=index_path,
-            cache_map=cache_map,
+            index=index,
             ctx=ctx,
-            session=requests.Session(),
+            session=session,
         )
 
     @classmethod
-    def write_index(cls, index_path: Path, cache_map: dict):
-        """Write the cache index out to disk"""
-        index_path.write_text(json.dumps(cache_map, indent=2))
+    def create_session(cls, ctx) -> requests.Session:
+        """
+        Build a requests session with connection pooling and retries
 
-    def fetch(self, url: str) -> str:
-        """Fetch a URL, from the cache if there, otherwise put a copy into cache"""
+        The pool size, retry count and backoff are taken from the context.
+        """
+        retry = Retry(
+            total=ctx.http_retries,
+            backoff_factor=ctx.http_backoff,
+            status_forcelist=(500, 502, 503, 504),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=ctx.http_pool_size,
+            pool_maxsize=ctx.http_pool_size,
+            max_retries=retry,
+        )
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        if len(ctx.proxies) > 0:
+            session.proxies.update(ctx.proxies)
+        return session
+
+    def fetch(self, url: str, key: Optional[str] = None) -> Optional[str]:
+        """
+        Fetch a URL, from the cache if there, otherwise put a copy into cache
+
+        Parameters:
+            url:    The URL to fetch
+            key:    The key the content is cached under - defaults to the URL
+
+        Returns the content, or None if the fetch failed.
+        """
+        content, _ = self.fetch_item(url, key=key)
+        return content
+
+    def fetch_item(
+        self,
+        url: str,
+        key: Optional[str] = None,
+    ) -> Tuple[Optional[str], bool]:
+        """
+        Fetch a URL as `fetch`, also saying whether it came from the cache
+
+        Returns a tuple of the content, or None if the fetch failed, and
+        True if it was found in the cache.
+        """
+        if key is None:
+            key = url
         #
         # is this in the cache already
-        if url in self.cache_map:
-            item_name = self.cache_map[url]
-            item_path = self.cache_directory.joinpath(item_name)
+        item_name = self.lookup(url, key)
+        if item_name is not None:
             try:
-                content = item_path.read_text()
+                content = self.read_item(item_name)
                 self.ctx.logger.debug(f"Retrieved {url} from cache")
-                return content
-            except OSError:
+                self.count(hits=1)
+                return (content, True)
+            except (OSError, EOFError):
                 pass  # just move on to refetch
         #
         # if you get here then the url is either not in the cache or we
         # failed to retrieve it off disk - in either case we just fetch it
-        item_name = uuid.uuid4().hex
-        item_path = item_path = self.cache_directory.joinpath(item_name)
+        # - a failure is not cached, so it will be retried next time
+        return (self.download(url, key=key), False)
+
+    def lookup(self, url: str, key: str) -> Optional[str]:
+        """
+        Find the cache file name for a URL cached under a key
+
+        Should the key not be in the index, but the URL is - as cached by an
+        older version of this package - the entry is copied to the key.
+        Returns None if neither is in the index, or if the entry is a failed
+        fetch cached by an older version.
+        """
+        item_name = self.index.get(key)
+        if item_name is None and key != url:
+            item_name = self.index.get(url)
+            if item_name is not None and not self.is_legacy_failure(item_name):
+                self.index.set(key, item_name)
+        if item_name is not None and self.is_legacy_failure(item_name):
+            return None
+        return item_name
+
+    def is_legacy_failure(self, item_name: str) -> bool:
+        """
+        Check if a cache entry is a failed fetch cached by an older version
+
+        Older versions cached failed fetches as empty uncompressed files -
+        these are treated as not cached, so they are fetched again and the
+        entry replaced.
+        """
+        if item_name.endswith(".gz"):
+            return False
+        try:
+            return self.cache_directory.joinpath(item_name).stat().st_size == 0
+        except OSError:
+            return False
+
+    def download(self, url: str, key: Optional[str] = None) -> Optional[str]:
+        """
+        Fetch a URL from the webserver and put a copy into cache
+
+        The content is cached under the given key, or the URL if there is no
+        key.  Returns the content, or None if the fetch failed.
+        """
         self.ctx.logger.debug(f"Fetching {url}")
         try:
-            response = requests.get(url, proxies=self.ctx.proxies)
+            response = self.session.get(url, timeout=self.ctx.http_timeout)
+            response.raise_for_status()
             content = response.text
-        except OSError:
-            self.ctx.logger.warning(f"No response to {url}")
-            content = ""
+        except OSError as error:
+            self.ctx.logger.warning(f"No response to {url} - {error}")
+            self.count(failures=1)
+            return None
+        self.count(misses=1, bytes_fetched=self.transferred_length(response))
         #
         # write to cache
-        item_path.write_text(content)
+        item_name = self.store_item(content)
         self.ctx.logger.debug(f"Wrote {url} to {item_name}")
         #
         # update cache index
-        self.cache_map[url] = item_name
-        self.write_index(index_path=self.index_path, cache_map=self.cache_map)
+        self.index.set(url if key is None else key, item_name)
         #
         # return response content
         return content
 
+    def count(self, hits=0, misses=0, failures=0, bytes_fetched=0):
+        """Update the cache counters"""
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+            self.failures += failures
+            self.bytes_fetched += bytes_fetched
+
+    def transferred_length(self, response: requests.Response) -> int:
+        """
+        The number of bytes of a response body as sent over the wire
+
+        This is the compressed length for a compressed response, rather
+        than the length of the decoded content.
+        """
+        try:
+            return response.raw.tell()
+        except AttributeError:
+            return len(response.content)
+
+    def prefetch(self, urls: Iterable[str], concurrency: int = 8):
+        """
+        Make sure a set of URLs are in the cache, fetching any that are not
+
+        Parameters:
+            urls:           The URLs wanted in the cache
+            concurrency:    The maximum number of requests in flight at once
+
+        The requests are made by a pool of `concurrency` threads sharing the
+        pooled session, each looking up and fetching one URL at a time.
+        URLs already in the index are counted as hits without reading their
+        content, and repeated URLs are only requested once.  The cache
+        counters are updated.
+        """
+        self.prefetch_keyed(
+            items=((url, url) for url in urls),
+            concurrency=concurrency,
+        )
+
+    def prefetch_keyed(
+        self,
+        items: Iterable,
+        concurrency: int = 8,
+        url_key: Optional[Callable] = None,
+    ):
+        """
+        Make sure a set of URLs are in the cache, as `prefetch`
+
+        Parameters:
+            items:          The items wanted in the cache - `(url, key)` pairs
+                            unless `url_key` is given
+            concurrency:    The maximum number of requests in flight at once
+            url_key:        Function giving the `(url, key)` pair for an item,
+                            or None if it is not to be fetched
+
+        Each URL is cached under its key.  The `url_key` function is called
+        on the worker threads, so any work it does - such as reading the
+        wiki source of a revision - overlaps with the fetches.
+        """
+        item_iterator = iter(items)
+        lock = threading.Lock()
+        seen = set()
+
+        def prefetch_next() -> bool:
+            # returns False once there are no more items
+            with lock:
+                item = next(item_iterator, None)
+            if item is None:
+                return False
+            url_keyed = item if url_key is None else url_key(item)
+            if url_keyed is None:
+                return True
+            url, key = url_keyed
+            with lock:
+                if key in seen:
+                    return True
+                seen.add(key)
+            if self.lookup(url, key) is not None:
+                self.count(hits=1)
+            else:
+                self.download(url, key)
+            return True
+
+        def prefetch_worker():
+            while prefetch_next():
+                pass
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            workers = [executor.submit(prefetch_worker) for _ in range(concurrency)]
+            for worker in workers:
+                worker.result()
+
+    def read_item(self, item_name: str) -> str:
+        """
+        Read the content of a cache file
+
+        Parameters:
+            item_name:  The name of the cache file, relative to the cache directory
+
+        """
+        item_path = self.cache_directory.joinpath(item_name)
+        if item_path.suffix == ".gz":
+            return gzip.decompress(item_path.read_bytes()).decode("utf-8")
+        else:
+            # an uncompressed entry written by an older version
+            return item_path.read_text()
+
+    def store_item(self, content: str) -> str:
+        """
+        Store content in the cache, returning the cache file name
+
+        Parameters:
+            content:    The content to store
+
+        The file is named after the hash of the content - if a file for that
+        hash already exists then it is not written again.  New files are
+        written under a temporary name and renamed into place, so a partly
+        written file is never seen under its final name.
+        """
+        data = content.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        item_name = os.path.join("objects", digest[:2], f"{digest}.gz")
+        item_path = self.cache_directory.joinpath(item_name)
+        if not item_path.exists():
+            item_path.parent.mkdir(mode=0o777, parents=True, exist_ok=True)
+            temp_path = item_path.with_name(f".{uuid.uuid4().hex}.tmp")
+            temp_path.write_bytes(gzip.compress(data))
+            os.replace(temp_path, item_path)
+        return item_name
+
 
 # end
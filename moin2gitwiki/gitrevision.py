@@ -1,10 +1,16 @@
+import hashlib
+import json
 import typing
+from pathlib import Path
 
 import attr
 
+from .stats import ConversionStats
 from .wikiindex import MoinEditEntry
 from .wikiindex import MoinEditType
 
+BLOB_CHUNK_SIZE = 1024 * 1024
+
 
 @attr.s(kw_only=True, slots=True)
 class GitExportStream:
@@ -18,7 +24,19 @@ class GitExportStream:
         output:     The output file stream of git fast-export commands
         mark_number: The current git mark number
         last_commit_mark: The git mark number of the last commit
+        blob_marks: Maps the hash of each blob content output to its mark
+        buffer:     Buffer the stream is assembled in before being written
         ctx:        The context object - used for `logger` and `user` mapping
+        stats:      Counts of what is written, and the time spent writing it
+
+    Each distinct blob is only output once - content matching a blob already
+    in the stream reuses that blob's mark.
+
+    Each commit, along with its blobs, is assembled in a buffer and written
+    to the output in one go, rather than as many small writes.  The time
+    taken by each write is recorded as the `git write` stage - when the
+    output is a pipe to `git fast-import` this is the time spent waiting for
+    it to catch up.
 
     """
 
@@ -26,7 +44,10 @@ class GitExportStream:
     mark_number: int = attr.ib(default=1)
     last_commit_mark: int = attr.ib(default=None)
     branch: str = attr.ib(default="refs/heads/master")
+    blob_marks: dict = attr.ib(factory=dict, repr=False)
+    buffer: bytearray = attr.ib(factory=bytearray, repr=False)
     ctx = attr.ib(repr=False)
+    stats: ConversionStats = attr.ib(factory=ConversionStats, repr=False)
 
     def add_wiki_revision(
         self,
@@ -45,7 +66,7 @@ class GitExportStream:
         if content is not None:
             blob_ref = self.output_blob(content)
         elif revision.edit_type == MoinEditType.ATTACH:
-            blob_ref = self.output_blob(revision.attachment_content_bytes())
+            blob_ref = self.output_blob_file(revision.attachment_content_path())
         if self.last_commit_mark is None:
             self.write_string(f"reset {self.branch}\n")
         self.write_string(f"commit {self.branch}\n")
@@ -81,6 +102,8 @@ class GitExportStream:
                 f"M 100644 :{blob_ref} {revision.attachment_destination()}\n\n",
             )
 
+        self.flush()
+        self.stats.count("commits written")
         self.last_commit_mark = commit_ref
         self.ctx.logger.debug(f"Written commit {commit_ref}")
 
@@ -120,10 +143,57 @@ class GitExportStream:
         Parameters:
             content:    The content of the blob, as bytes
 
+        Returns the mark of the blob - if the same content has already been
+        output then the mark of that blob is returned and nothing is written.
         """
-        self.output.write(b"blob\n")
+        digest = hashlib.sha1(content).digest()
+        if digest in self.blob_marks:
+            self.stats.count("blobs reused")
+            return self.blob_marks[digest]
+        self.write_bytes(b"blob\n")
         blob_ref = self.write_next_mark()
         self.output_data(content)
+        self.stats.count("blobs written")
+        self.stats.count("blob bytes written", len(content))
+        self.blob_marks[digest] = blob_ref
+        return blob_ref
+
+    def output_blob_file(self, path: Path):
+        """
+        Output a blob object from the content of a file
+
+        Parameters:
+            path:       The path of the file
+
+        The file is hashed and copied into the stream in fixed size chunks,
+        so memory use does not grow with the size of the file.  As with
+        `output_blob` the mark of the blob is returned, and content already
+        output is not written again.
+        """
+        digest = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(BLOB_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        if digest.digest() in self.blob_marks:
+            self.stats.count("blobs reused")
+            return self.blob_marks[digest.digest()]
+        self.write_bytes(b"blob\n")
+        blob_ref = self.write_next_mark()
+        with open(path, "rb") as f:
+            size = Path(path).stat().st_size
+            remaining = size
+            self.write_string(f"data {size}\n")
+            # the file content goes straight to the output, not the buffer
+            self.flush()
+            while remaining > 0:
+                chunk = f.read(min(BLOB_CHUNK_SIZE, remaining))
+                if len(chunk) == 0:
+                    raise OSError(f"File {path} truncated while being read")
+                self.write_output(chunk)
+                remaining -= len(chunk)
+        self.stats.count("blobs written")
+        self.stats.count("blob bytes written", size)
+        self.blob_marks[digest.digest()] = blob_ref
         return blob_ref
 
     def output_data(self, content: bytes):
@@ -135,13 +205,35 @@ class GitExportStream:
 
         """
         self.write_string(f"data {len(content)}\n")
-        self.output.write(content)
+        self.write_bytes(content)
 
     def write_string(self, string: str):
         """
         Write a string out with utf-8 encoding into bytes
         """
-        self.output.write(string.encode("utf-8"))
+        self.buffer += string.encode("utf-8")
+
+    def write_bytes(self, data: bytes):
+        """
+        Write bytes out - these are held in the buffer until `flush` is called
+        """
+        self.buffer += data
+
+    def flush(self):
+        """
+        Write out the buffer contents to the output, and empty the buffer
+        """
+        if len(self.buffer) > 0:
+            self.write_output(self.buffer)
+            del self.buffer[:]
+
+    def write_output(self, data):
+        """
+        Write data straight to the output, timing the write
+        """
+        with self.stats.timed("git write"):
+            self.output.write(data)
+        self.stats.count("stream bytes written", len(data))
 
     def output_data_string(self, string: str):
         """
@@ -153,8 +245,209 @@ class GitExportStream:
         """
         Write the end of stream information
         """
-        self.write_string(f"reset {self.branch}\n")
-        self.write_string(f"from :{self.last_commit_mark}\n")
+        if self.last_commit_mark is not None:
+            self.write_string(f"reset {self.branch}\n")
+            self.write_string(f"from :{self.last_commit_mark}\n")
+        self.flush()
+
+
+@attr.s(kw_only=True, slots=True)
+class GitExportState:
+    """
+    The state left by an export into a git repository
+
+    This is saved within the `.git` directory of the repository built, along
+    with the git fast-import marks file, so that a later export can add just
+    the wiki revisions made since onto the existing branch.
+
+    Attributes:
+        last_edit_date: The edit time of the last wiki revision exported, as
+                        microseconds since the epoch
+        last_commit_mark: The git mark number of the last commit
+        mark_number: The next git mark number to use
+
+    """
+
+    STATE_FILE = "moin2gitwiki-state.json"
+    MARKS_FILE = "moin2gitwiki-marks"
+
+    last_edit_date: int = attr.ib()
+    last_commit_mark: int = attr.ib()
+    mark_number: int = attr.ib()
+
+    @classmethod
+    def load_state(cls, git_dir: Path):
+        """
+        Load the export state from a git directory
+
+        Returns None if there is no saved state.
+        """
+        try:
+            data = json.loads(git_dir.joinpath(cls.STATE_FILE).read_text())
+        except OSError:
+            return None
+        return cls(**data)
+
+    def save_state(self, git_dir: Path):
+        """Save the export state into a git directory"""
+        state_path = git_dir.joinpath(self.STATE_FILE)
+        temp_path = state_path.with_suffix(".tmp")
+        temp_path.write_text(json.dumps(attr.asdict(self), indent=2))
+        temp_path.replace(state_path)
+
+    @classmethod
+    def marks_path(cls, git_dir: Path) -> Path:
+        """The path of the git fast-import marks file within a git directory"""
+        return git_dir.joinpath(cls.MARKS_FILE)
+
+    @classmethod
+    def fast_import_options(
+        cls,
+        git_dir: Path,
+        state: typing.Optional["GitExportState"] = None,
+    ) -> typing.List[str]:
+        """
+        The git fast-import options to keep the marks of an incremental export
+
+        Parameters:
+            git_dir:    The `.git` directory of the repository
+            state:      The saved state of the export being resumed, if any
+
+        When resuming, `--force` is also given.  A run which could not fetch
+        every page moves the branch on without saving its state, so the
+        branch has to be put back onto the last commit of the saved state -
+        the commits of the failed run are replaced by those of this run.
+        """
+        marks_path = cls.marks_path(git_dir)
+        options = [f"--export-marks={marks_path}"]
+        if state is not None:
+            options += [f"--import-marks={marks_path}", "--force"]
+        return options
+
+    @classmethod
+    def from_export(
+        cls,
+        export: GitExportStream,
+        revisions: typing.List[MoinEditEntry],
+        previous: typing.Optional["GitExportState"] = None,
+    ):
+        """
+        The export state after an export
+
+        Parameters:
+            export:     The export stream the revisions were written to
+            revisions:  The wiki revisions exported, in edit order
+            previous:   The export state the export started from, if any
+
+        If no revisions were exported the last edit date is carried over
+        from the previous state.
+        """
+        if len(revisions) > 0:
+            last_edit_date = revisions[-1].edit_microseconds()
+        elif previous is not None:
+            last_edit_date = previous.last_edit_date
+        else:
+            last_edit_date = 0
+        return cls(
+            last_edit_date=last_edit_date,
+            last_commit_mark=export.last_commit_mark,
+            mark_number=export.mark_number,
+        )
+
+    def new_revisions(
+        self,
+        revisions: typing.Iterable[MoinEditEntry],
+    ) -> typing.List[MoinEditEntry]:
+        """The wiki revisions made since the last export"""
+        return [
+            revision
+            for revision in revisions
+            if revision.edit_microseconds() > self.last_edit_date
+        ]
+
+    def create_stream(self, output: typing.BinaryIO, **kwargs) -> GitExportStream:
+        """
+        An export stream carrying on from the last export
+
+        The stream continues the mark numbering, and the branch, of the last
+        export.  Any other `GitExportStream` attributes can be given.
+        """
+        return GitExportStream(
+            output=output,
+            mark_number=self.mark_number,
+            last_commit_mark=self.last_commit_mark,
+            **kwargs,
+        )
+
+
+@attr.s(kw_only=True, frozen=True, slots=True)
+class GitPackingPolicy:
+    """
+    How the git repository is packed, during and after the fast-import
+
+    Attributes:
+        packing:    What is done after the import - `none`, `fast` or `aggressive`
+        threads:    Threads used to compute deltas, or 0 to leave it to git
+        window:     Objects compared for each delta by the `fast` repack
+        depth:      Longest delta chain made by the `fast` repack
+        window_memory: Memory limit of each delta window, as a git size such as `256m`
+        import_depth: Longest delta chain made by `git fast-import`
+        max_pack_size: Largest pack made by `git fast-import`, as a git size
+        big_file_threshold: Size above which `git fast-import` does not make deltas
+
+    With `none` the packs written by `git fast-import` are left as they
+    are.  The `fast` repack puts everything into a single pack, reusing the
+    deltas already made by `git fast-import` and with a bounded delta window
+    and depth for the rest.  The `aggressive` packing runs `git gc
+    --aggressive`, which recomputes every delta - the tightest packing but
+    by far the slowest.
+
+    """
+
+    PACKINGS = ("none", "fast", "aggressive")
+
+    packing: str = attr.ib(
+        default="aggressive", validator=attr.validators.in_(PACKINGS)
+    )
+    threads: int = attr.ib(default=0)
+    window: int = attr.ib(default=10)
+    depth: int = attr.ib(default=20)
+    window_memory: typing.Optional[str] = attr.ib(default=None)
+    import_depth: typing.Optional[int] = attr.ib(default=None)
+    max_pack_size: typing.Optional[str] = attr.ib(default=None)
+    big_file_threshold: typing.Optional[str] = attr.ib(default=None)
+
+    def fast_import_options(self) -> typing.List[str]:
+        """The options to pass to `git fast-import`"""
+        options = []
+        if self.import_depth is not None:
+            options.append(f"--depth={self.import_depth}")
+        if self.max_pack_size is not None:
+            options.append(f"--max-pack-size={self.max_pack_size}")
+        if self.big_file_threshold is not None:
+            options.append(f"--big-file-threshold={self.big_file_threshold}")
+        return options
+
+    def pack_command(self) -> typing.Optional[typing.List[str]]:
+        """The git command to pack the repository, or None if not packing"""
+        if self.packing == "none":
+            return None
+        command = ["git"]
+        if self.threads > 0:
+            command += ["-c", f"pack.threads={self.threads}"]
+        if self.window_memory is not None:
+            command += ["-c", f"pack.windowMemory={self.window_memory}"]
+        if self.packing == "fast":
+            command += [
+                "repack",
+                "-a",
+                "-d",
+                f"--window={self.window}",
+                f"--depth={self.depth}",
+            ]
+        else:
+            command += ["gc", "--aggressive"]
+        return command
 
 
 # end
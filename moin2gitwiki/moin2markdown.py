@@ -1,43 +1,150 @@
+import functools
+import hashlib
+import itertools
+import logging
+import multiprocessing
 import re
 import subprocess
+import threading
+import time
+import uuid
+from collections import Counter
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from html import unescape
 from pathlib import Path
+from typing import Callable
+from typing import Iterable
+from typing import Iterator
+from typing import List
 from typing import Optional
+from typing import Sequence
+from typing import Tuple
 
 import attr
 from bs4 import BeautifulSoup
 from furl import furl
 
 from .fetch_cache import FetchCache
+from .pipeline import chunked
+from .pipeline import ordered_map
+from .stats import ConversionStats
+from .stats import RevisionTrace
+from .stats import TranslationTiming
+from .translation_cache import TranslationCache
 from .wikiindex import MoinEditEntries
 from .wikiindex import MoinEditEntry
+from .wikiindex import MoinLinkTable
+
+try:
+    import lxml.html
+except ImportError:  # pragma: no cover - lxml is an optional package
+    lxml = None
+
+PANDOC_COMMAND = ["pandoc", "-f", "html", "-t", "gfm"]
+LINK_ATTRIBUTE_RE = re.compile(r'\b(href|src)="([^"]*)"')
+LINEMARK_CLASS_RE = re.compile(r"line\\d+")
+HTML_PARSERS = ("beautifulsoup", "lxml")
+LINK_CACHE_SIZE = 10000
+REUSE_LIMIT = 256
 
 
 def is_a_linemark_para(tag):
     return (
         tag.name == "p"
         and tag.has_attr("class")
-        and re.match(r"line\\d+", tag["class"][0])
+        and LINEMARK_CLASS_RE.match(tag["class"][0])
     )
 
 
+class LruCache:
+    """
+    A bounded memo of computed values, forgetting the least recently used
+
+    Parameters:
+        maxsize:    The most entries held
+
+    The entries are not pickled - a copy starts empty - so a cache can be
+    held by an object handed to worker processes without its contents
+    being sent along too.
+    """
+
+    __slots__ = ("maxsize", "hits", "misses", "_entries", "_lock")
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute: Callable, *args):
+        """Return the value held for `key`, or compute it with `compute(*args)`"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+        value = compute(*args)
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = value
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __getstate__(self):
+        return {"maxsize": self.maxsize}
+
+    def __setstate__(self, state):
+        self.__init__(state["maxsize"])
+
+
+def default_html_parser() -> str:
+    """The fastest HTML parser backend available - lxml if it is installed"""
+    return "beautifulsoup" if lxml is None else "lxml"
+
+
 @attr.s(kw_only=True, frozen=True, slots=True)
-class Moin2Markdown:
+class HtmlTranslator:
     """
-    Conversion object to convert MoinMoin wiki markup to Markdown
+    Converts the HTML of a wiki page into Markdown
+
+    This holds only what is needed to rewrite the page HTML and run it
+    through `pandoc` - it is picklable so that it can be handed to worker
+    processes.
 
     Attributes:
-        fetch_cache:    A FetchCache object used to retrieve URLs
         url_prefix:     The URL prefix of the Moin wiki web presence
-        link_table:     A mapping of Moin unescaped names to page names
-        ctx:            Context object - logger and user mapping etc
+        links:          A snapshot of the wiki link and attachment tables
+        translation_cache: An optional TranslationCache of translated pages
+        html_parser:    The HTML parser backend - `beautifulsoup` or `lxml`
+        link_cache:     Memo of how each link and image target is rewritten
+
+    The same navigation and content links turn up in nearly every revision
+    of a page, so how each distinct link is rewritten is worked out once and
+    held in the `link_cache` for the rest of the run.
     """
 
     #
     # -- attributes
-    fetch_cache: FetchCache = attr.ib()
     url_prefix: furl = attr.ib()
-    revisions: MoinEditEntries = attr.ib()
-    ctx = attr.ib(repr=False)
+    links: MoinLinkTable = attr.ib()
+    translation_cache: Optional[TranslationCache] = attr.ib(default=None)
+    html_parser: str = attr.ib(
+        default="beautifulsoup",
+        validator=attr.validators.in_(HTML_PARSERS),
+    )
+    link_cache: LruCache = attr.ib(
+        factory=lambda: LruCache(LINK_CACHE_SIZE),
+        init=False,
+        eq=False,
+        repr=False,
+    )
     #
     # smiley mapping
     smiley_map = {
@@ -74,61 +181,19 @@ class Moin2Markdown:
         "{2}": ":two:",
     }
 
-    @classmethod
-    def create_translator(
-        cls,
-        ctx,
-        cache_directory: Path,
-        url_prefix: str,
-        revisions: MoinEditEntries,
-    ):
-        """
-        Build a translator object
+    @property
+    def logger(self) -> logging.Logger:
+        return logging.getLogger("moin2gitwiki")
 
-        Parameters:
-            ctx:            Context object (logger etc)
-            cache_directory:    Path object for the cache directory
-            url_prefix:     The base URL for the MoinMoin wiki
-            link_table:     A translation table for wiki links
-
-        """
-        #
-        # Build a fetch cache
-        fetch_cache = FetchCache.initialise_cache(
-            cache_directory=cache_directory,
-            ctx=ctx,
-        )
-        return cls(
-            fetch_cache=fetch_cache,
-            revisions=revisions,
-            url_prefix=furl(url_prefix),
-            ctx=ctx,
-        )
-
-    def retrieve_and_translate(self, revision: MoinEditEntry) -> Optional[bytes]:
+    def translate_html(self, html: Optional[str]) -> Optional[bytes]:
         """
-        Retrieve a wiki revision, and translate it to markdown
+        Extract the content section of page HTML, and translate it to markdown
 
         Parameters:
-            revision:    The wiki revision object for the revision we want
-
-        If the revision maps to an empty object - ie it deleted the page, or
-        similar, then a None object is returned.
+            html:    The html data, or None if the revision has no content
 
         """
-        # check if this revision has any content...
-        lines = revision.wiki_content()
-        if lines is None:
-            return None
-        else:
-            target = self.url_prefix.copy()
-            target /= revision.page_path_unescaped()
-            target.args["action"] = "recall"
-            target.args["rev"] = revision.page_revision
-            content = self.fetch_cache.fetch(target.url)
-            main_content = self.extract_content_section(content)
-            translated = self.translate(main_content)
-            return translated
+        return self.translate_html_batch([html])[0]
 
     def extract_content_section(self, html: str) -> str:
         """
@@ -147,7 +212,20 @@ class Moin2Markdown:
         - strip class attributes from links
         - remap any emoji img to the emoji sequence
 
+        The work is done by either `extract_content_section_soup` or
+        `extract_content_section_lxml`, depending on the `html_parser`.
+        HTML which lxml cannot parse - such as a string still carrying an
+        XML encoding declaration - is left to BeautifulSoup.
         """
+        if self.html_parser == "lxml":
+            try:
+                return self.extract_content_section_lxml(html)
+            except (lxml.etree.ParserError, ValueError):
+                pass
+        return self.extract_content_section_soup(html)
+
+    def extract_content_section_soup(self, html: str) -> str:
+        """Extract and simplify the content part of the HTML using BeautifulSoup"""
         soup = BeautifulSoup(html, "html.parser")
         content = soup.find(id="content")
         if content is None:
@@ -165,33 +243,11 @@ class Moin2Markdown:
         for tag in content.find_all("a"):
             target = tag["href"]
             if target:
-                self.ctx.logger.debug(f"Trying to map link {target}")
-                url = self.url_prefix.copy().join(target)
-                if url.url.startswith(self.url_prefix.url):
-                    new_url = (
-                        url.copy().remove(query=True).url[len(self.url_prefix.url) :]
-                    )
-                    if len(str(url.query)) == 0:
-                        # no query - this is a conventional link
-                        new_target = self.revisions.get_new_link_target(new_url)
-                        if new_target:
-                            tag["href"] = new_target
-                            self.ctx.logger.debug(f"Normal map -> {new_target}")
-                    elif (
-                        "action" in url.query.params
-                        and "target" in url.query.params
-                        and url.query.params["action"] == "AttachFile"
-                    ):
-                        attach_target = url.query.params["target"]
-                        new_target = self.revisions.get_new_attachment_link_target(
-                            new_url,
-                            attach_target,
-                        )
-                        if new_target:
-                            tag["href"] = new_target
-                            self.ctx.logger.debug(f"Attach map -> {new_target}")
-                    else:
-                        tag.unwrap()
+                action, new_target = self.resolve_link(target)
+                if action == "rewrite":
+                    tag["href"] = new_target
+                elif action == "unwrap":
+                    tag.unwrap()
             #
             # strip any class attributes on links - tend to upset the translator
             if tag.has_attr("class"):
@@ -201,32 +257,14 @@ class Moin2Markdown:
         # MoinMoin puts the emoji code in the title, so will purely match on that
         for tag in content.find_all("img"):
             target = tag["src"]
-            self.ctx.logger.debug(f"Image target {target}")
+            self.logger.debug(f"Image target {target}")
             if tag.has_attr("title") and tag["title"] in self.smiley_map:
                 tag.replace_with(" " + self.smiley_map[tag["title"]] + " ")
             elif target:
                 # now find all the images, and if an attachment within the wiki, rewrite
-                url = self.url_prefix.copy().join(target)
-                if url.url.startswith(self.url_prefix.url):
-                    new_url = (
-                        url.copy().remove(query=True).url[len(self.url_prefix.url) :]
-                    )
-                    self.ctx.logger.debug(f"Image params {url.query.params}")
-                    if (
-                        "action" in url.query.params
-                        and "target" in url.query.params
-                        and url.query.params["action"] == "AttachFile"
-                    ):
-                        attach_target = url.query.params["target"]
-                        new_target = self.revisions.get_new_attachment_link_target(
-                            new_url,
-                            attach_target,
-                        )
-                        if new_target:
-                            tag["src"] = new_target
-                            self.ctx.logger.debug(f"Image mapped to {new_target}")
-                else:
-                    self.ctx.logger.debug(f"Not mapped - {url.query.params}")
+                new_target = self.resolve_image(target)
+                if new_target:
+                    tag["src"] = new_target
             #
             # strip any class attributes on links - tend to upset the translator
             if tag.has_attr("class"):
@@ -246,15 +284,912 @@ class Moin2Markdown:
 
         return "".join([str(x) for x in content.contents])
 
+    def extract_content_section_lxml(self, html: str) -> str:
+        """
+        Extract and simplify the content part of the HTML using lxml
+
+        This applies the same rules as `extract_content_section_soup`, but
+        with the C based libxml2 parser, which is many times faster.  The
+        result is serialised in the way BeautifulSoup does - in particular
+        text directly within the content div is not escaped - so that it
+        translates to the same Markdown.
+
+        Raises `lxml.etree.ParserError` or `ValueError` if the HTML cannot
+        be parsed.
+        """
+        document = lxml.html.document_fromstring(html)
+        found = document.xpath('//*[@id="content"]')
+        if len(found) == 0:
+            return ""
+        content = found[0]
+        #
+        # now strip out excess rubbish - anchor spans
+        for tag in content.xpath(
+            './/*[contains(concat(" ", normalize-space(@class), " "), " anchor ")]',
+        ):
+            tag.drop_tree()
+        #
+        # Remove dead <p class="line???"> with no closer
+        for tag in list(content.iterdescendants("p")):
+            classes = tag.get("class", "").split()
+            if len(classes) > 0 and LINEMARK_CLASS_RE.match(classes[0]):
+                tag.drop_tag()
+        #
+        # now find all the links, and if within the wiki, rewrite
+        for tag in list(content.iterdescendants("a")):
+            target = tag.get("href")
+            if target:
+                action, new_target = self.resolve_link(target)
+                if action == "rewrite":
+                    tag.set("href", new_target)
+                elif action == "unwrap":
+                    tag.drop_tag()
+            #
+            # strip any class attributes on links - tend to upset the translator
+            tag.attrib.pop("class", None)
+        #
+        # now find all the images and see if they map to emojis
+        for tag in list(content.iterdescendants("img")):
+            target = tag.get("src")
+            title = tag.get("title")
+            if title is not None and title in self.smiley_map:
+                replace_with_text(tag, " " + self.smiley_map[title] + " ")
+                continue
+            elif target:
+                new_target = self.resolve_image(target)
+                if new_target:
+                    tag.set("src", new_target)
+            tag.attrib.pop("class", None)
+        #
+        # strip the forms and input fields, and all the <div>s
+        for tag in list(content.iterdescendants("form")):
+            tag.drop_tag()
+        for tag in list(content.iterdescendants("input")):
+            tag.drop_tree()
+        for tag in list(content.iterdescendants("div")):
+            tag.drop_tag()
+        #
+        # BeautifulSoup leaves top level text and comments unescaped
+        parts = [content.text or ""]
+        for child in content:
+            if isinstance(child, lxml.html.HtmlComment):
+                parts.append(child.text or "")
+            else:
+                parts.append(
+                    lxml.html.tostring(child, encoding="unicode", with_tail=False),
+                )
+            parts.append(child.tail or "")
+        return "".join(parts)
+
+    def resolve_link(self, target: str) -> Tuple[str, Optional[str]]:
+        """
+        Work out how a link within a page should be rewritten
+
+        Parameters:
+            target:     The href of the link
+
+        Returns a tuple of the action to take and the new target.  The action
+        is `keep` to leave the link as it is, `rewrite` to change its target
+        to the new target, or `unwrap` to remove the link leaving its text.
+        """
+        return self.link_cache.get_or_compute(
+            ("href", target), self.lookup_link, target
+        )
+
+    def lookup_link(self, target: str) -> Tuple[str, Optional[str]]:
+        """Work out how a link should be rewritten - uncached `resolve_link`"""
+        self.logger.debug(f"Trying to map link {target}")
+        url = self.url_prefix.copy().join(target)
+        if url.url.startswith(self.url_prefix.url):
+            new_url = url.copy().remove(query=True).url[len(self.url_prefix.url) :]
+            if len(str(url.query)) == 0:
+                # no query - this is a conventional link
+                new_target = self.links.get_new_link_target(new_url)
+                if new_target:
+                    self.logger.debug(f"Normal map -> {new_target}")
+                    return ("rewrite", new_target)
+            elif (
+                "action" in url.query.params
+                and "target" in url.query.params
+                and url.query.params["action"] == "AttachFile"
+            ):
+                attach_target = url.query.params["target"]
+                new_target = self.links.get_new_attachment_link_target(
+                    new_url,
+                    attach_target,
+                )
+                if new_target:
+                    self.logger.debug(f"Attach map -> {new_target}")
+                    return ("rewrite", new_target)
+            else:
+                return ("unwrap", None)
+        return ("keep", None)
+
+    def resolve_image(self, target: str) -> Optional[str]:
+        """
+        Work out the new source of an image within a page
+
+        Parameters:
+            target:     The src of the image
+
+        Returns the new image source for an attachment within the wiki,
+        otherwise None.
+        """
+        return self.link_cache.get_or_compute(
+            ("src", target), self.lookup_image, target
+        )
+
+    def lookup_image(self, target: str) -> Optional[str]:
+        """Work out the new source of an image - uncached `resolve_image`"""
+        url = self.url_prefix.copy().join(target)
+        if url.url.startswith(self.url_prefix.url):
+            new_url = url.copy().remove(query=True).url[len(self.url_prefix.url) :]
+            self.logger.debug(f"Image params {url.query.params}")
+            if (
+                "action" in url.query.params
+                and "target" in url.query.params
+                and url.query.params["action"] == "AttachFile"
+            ):
+                attach_target = url.query.params["target"]
+                new_target = self.links.get_new_attachment_link_target(
+                    new_url,
+                    attach_target,
+                )
+                if new_target:
+                    self.logger.debug(f"Image mapped to {new_target}")
+                return new_target
+        else:
+            self.logger.debug(f"Not mapped - {url.query.params}")
+        return None
+
+    def translate_html_batch(
+        self,
+        htmls: List[Optional[str]],
+        stats: Optional[ConversionStats] = None,
+        timings: Optional[List[Optional[TranslationTiming]]] = None,
+    ) -> List[Optional[bytes]]:
+        """
+        Extract and translate the HTML of several pages, as `translate_html`
+
+        Parameters:
+            htmls:   A list of html data, with None for revisions with no content
+            stats:   Optional stats object to record the parse and pandoc times in
+            timings: Optional list to add a `TranslationTiming` for each page to
+
+        All the pages with content are converted in a single `pandoc` run.
+        Each run is recorded as a `pandoc batches` time, and the share of
+        the run given to each page as a `pandoc` time.
+        Pages found in the translation cache, if there is one, are taken from
+        there without being extracted or translated at all.
+        """
+        if stats is None:
+            stats = ConversionStats()
+        results: List[Optional[bytes]] = [None] * len(htmls)
+        page_timings: List[Optional[TranslationTiming]] = [
+            None if html is None else TranslationTiming() for html in htmls
+        ]
+        keys = {}
+        indexes = []
+        for index, html in enumerate(htmls):
+            if html is None:
+                continue
+            if self.translation_cache is not None:
+                key = self.translation_cache.make_key(html, self.link_targets(html))
+                cached = self.translation_cache.get(key)
+                if cached is not None:
+                    stats.count("translation cache hits")
+                    page_timings[index].cached = True
+                    results[index] = cached
+                    continue
+                stats.count("translation cache misses")
+                keys[index] = key
+            indexes.append(index)
+        if len(indexes) > 0:
+            sections = []
+            for index in indexes:
+                start = time.perf_counter()
+                sections.append(self.extract_content_section(htmls[index]))
+                page_timings[index].parse = time.perf_counter() - start
+                stats.record("parse", page_timings[index].parse)
+            start = time.perf_counter()
+            outputs = self.translate_batch_checked(sections)
+            pandoc_time = time.perf_counter() - start
+            stats.record("pandoc batches", pandoc_time)
+            stats.count("pages translated", len(indexes))
+            #
+            # share the pandoc run time out over the pages by size
+            total_size = sum(len(section) for section in sections) or 1
+            for index, section in zip(indexes, sections):
+                page_timings[index].pandoc = pandoc_time * len(section) / total_size
+                stats.record("pandoc", page_timings[index].pandoc)
+            for index, (output, succeeded) in zip(indexes, outputs):
+                results[index] = output
+                # the output of a failed pandoc run is never cached
+                if index in keys and succeeded:
+                    self.translation_cache.put(keys[index], output)
+        if timings is not None:
+            timings.extend(page_timings)
+        return results
+
+    def link_targets(self, html: str) -> List[str]:
+        """
+        Describe how each distinct link and image in the page HTML is rewritten
+
+        Parameters:
+            html:    The html data
+
+        This is used as part of the translation cache key, so that a cached
+        translation is not used if any link within it would now be rewritten
+        differently.  The links are picked out of the HTML with a regular
+        expression - much cheaper than parsing the page.
+        """
+        targets = []
+        for attribute, value in sorted(set(LINK_ATTRIBUTE_RE.findall(html))):
+            value = unescape(value)
+            if attribute == "href":
+                action, new_target = self.resolve_link(value)
+                targets.append(f"href {value} {action} {new_target}")
+            else:
+                targets.append(f"src {value} {self.resolve_image(value)}")
+        return targets
+
     def translate(self, input: str) -> bytes:
         """Translate HTML to Github Flavoured Markdown using pandoc"""
+        output, _ = self.translate_checked(input)
+        return output
+
+    def translate_checked(self, input: str) -> Tuple[bytes, bool]:
+        """
+        Translate HTML to Markdown as `translate`, also saying if pandoc succeeded
+
+        Returns a tuple of the pandoc output and True if pandoc exited
+        cleanly.  A warning is logged if it did not.
+        """
         process = subprocess.Popen(
-            ["pandoc", "-f", "html", "-t", "gfm"],
+            PANDOC_COMMAND,
             stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
         )
-        (output, _) = process.communicate(input.encode("utf-8"))
-        return output
+        output, _ = process.communicate(input.encode("utf-8"))
+        if process.returncode != 0:
+            self.logger.warning(
+                f"Translation failed - pandoc exited with status {process.returncode}",
+            )
+            return (output, False)
+        return (output, True)
+
+    def translate_batch(self, inputs: List[str]) -> List[bytes]:
+        """
+        Translate several HTML fragments to Markdown with a single pandoc run
+
+        Parameters:
+            inputs:     A list of HTML fragments
+
+        The fragments are joined with a separator paragraph containing a
+        random token, which cannot occur in the wiki content, and the pandoc
+        output is split on the separator lines.  Should pandoc fail, or the
+        output not split back into the right number of pieces, each fragment
+        is translated on its own instead.
+        """
+        return [output for output, _ in self.translate_batch_checked(inputs)]
+
+    def translate_batch_checked(self, inputs: List[str]) -> List[Tuple[bytes, bool]]:
+        """
+        Translate several HTML fragments as `translate_batch`, checking pandoc
+
+        Returns a `(output, succeeded)` tuple for each fragment, as
+        `translate_checked` does.
+        """
+        if len(inputs) < 2:
+            return [self.translate_checked(input) for input in inputs]
+        token = f"MOIN2GITSEPARATOR{uuid.uuid4().hex}"
+        separator = f"\n<p>{token}</p>\n"
+        process = subprocess.Popen(
+            PANDOC_COMMAND,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+        output, _ = process.communicate(separator.join(inputs).encode("utf-8"))
+        pieces = re.split(
+            rf"^{token}$".encode("utf-8"),
+            output,
+            flags=re.MULTILINE,
+        )
+        if process.returncode != 0 or len(pieces) != len(inputs):
+            self.logger.warning(
+                f"Batch translation of {len(inputs)} pages failed - translating singly",
+            )
+            return [self.translate_checked(input) for input in inputs]
+        return [(piece.strip(b"\n") + b"\n", True) for piece in pieces]
+
+
+def replace_with_text(tag, text: str):
+    """Replace an lxml element with a piece of text, keeping the text after it"""
+    text += tag.tail or ""
+    parent = tag.getparent()
+    previous = tag.getprevious()
+    if previous is not None:
+        previous.tail = (previous.tail or "") + text
+    else:
+        parent.text = (parent.text or "") + text
+    parent.remove(tag)
+
+
+@attr.s(kw_only=True, slots=True)
+class TranslationReuse:
+    """
+    Holds translations for reuse by later revisions with the same source
+
+    Attributes:
+        limit:      Most translations held that no claimed repeat still needs
+        held:       The translation held for each source key, None until stored
+        pending:    Count of the claimed repeats of each source key not yet taken
+
+    Each revision's source key is `claim`ed as the revision goes into the
+    pipeline - if the key is already held the revision is a repeat, and is
+    not fetched or translated.  The translation of a revision which is not
+    a repeat is `store`d as it comes out of the pipeline, and each repeat
+    then `take`s it.  A translation is kept while a claimed repeat still
+    needs it, after which only the `limit` most recently used are kept -
+    so a revert to a recent revision is reused without holding every
+    translation of the run.  A revision which could not be fetched is not
+    held - its claimed repeats `take` None, and a later repeat is fetched.
+    """
+
+    limit: int = attr.ib(default=REUSE_LIMIT)
+    held: OrderedDict = attr.ib(factory=OrderedDict)
+    pending: Counter = attr.ib(factory=Counter)
+
+    def claim(self, key: Optional[Tuple[str, str]]) -> bool:
+        """Claim a source key, returning True if it repeats a held translation"""
+        if key is None:
+            # revisions without content are never repeats
+            return False
+        if key in self.held:
+            self.pending[key] += 1
+            return True
+        self.held[key] = None
+        return False
+
+    def store(self, key: Optional[Tuple[str, str]], content: Optional[bytes]):
+        """Store the translation of a source key which was not a repeat"""
+        if key is None:
+            return
+        self.held[key] = content
+        self.held.move_to_end(key)
+        self.release()
+
+    def fail(self, key: Tuple[str, str]):
+        """Drop a source key whose revision could not be fetched"""
+        self.held.pop(key, None)
+
+    def take(self, key: Tuple[str, str]) -> Optional[bytes]:
+        """
+        Take the translation for a repeat of a source key
+
+        Returns None if the revision it repeats could not be fetched.
+        """
+        content = self.held.get(key)
+        self.pending[key] -= 1
+        if self.pending[key] == 0:
+            del self.pending[key]
+        if key in self.held:
+            self.held.move_to_end(key)
+            self.release()
+        return content
+
+    def release(self):
+        """Drop the least recently used translations beyond the limit"""
+        for key in list(self.held):
+            if len(self.held) <= self.limit:
+                break
+            if self.pending[key] == 0:
+                del self.held[key]
+
+
+#
+# Each translate worker process holds its own translator object, set up
+# once when the process starts rather than passed along with every page
+_worker_translator: Optional[HtmlTranslator] = None
+
+
+def _initialise_translate_worker(translator: HtmlTranslator):
+    global _worker_translator
+    _worker_translator = translator
+
+
+def _translate_in_worker(htmls: List[Optional[str]]):
+    return translate_with_stats(_worker_translator, htmls)
+
+
+def translate_with_stats(translator: HtmlTranslator, htmls: List[Optional[str]]):
+    """
+    Translate a batch of pages, returning the results with the stats gathered
+
+    The stats and the timing of each page come back along with the results,
+    so that those gathered in a worker process can be merged into the stats
+    of the main process.
+    """
+    stats = ConversionStats()
+    timings: List[Optional[TranslationTiming]] = []
+    results = translator.translate_html_batch(htmls, stats=stats, timings=timings)
+    return (results, stats, timings)
+
+
+@attr.s(kw_only=True, frozen=True, slots=True)
+class Moin2Markdown:
+    """
+    Conversion object to convert MoinMoin wiki markup to Markdown
+
+    Attributes:
+        fetch_cache:    A FetchCache object used to retrieve URLs
+        url_prefix:     The URL prefix of the Moin wiki web presence
+        revisions:      The wiki revision set
+        html_translator: The HtmlTranslator used to convert page HTML
+        ctx:            Context object - logger and user mapping etc
+        stats:          Counters and timings of the fetch and translation stages
+    """
+
+    #
+    # -- attributes
+    fetch_cache: FetchCache = attr.ib()
+    url_prefix: furl = attr.ib()
+    revisions: MoinEditEntries = attr.ib()
+    html_translator: HtmlTranslator = attr.ib()
+    ctx = attr.ib(repr=False)
+    stats: ConversionStats = attr.ib(factory=ConversionStats, repr=False)
+
+    @classmethod
+    def create_translator(
+        cls,
+        ctx,
+        cache_directory: Path,
+        url_prefix: str,
+        revisions: MoinEditEntries,
+        translation_cache: bool = False,
+        links=None,
+        html_parser: str = "beautifulsoup",
+        stats: Optional[ConversionStats] = None,
+    ):
+        """
+        Build a translator object
+
+        Parameters:
+            ctx:            Context object (logger etc)
+            cache_directory:    Path object for the cache directory
+            url_prefix:     The base URL for the MoinMoin wiki
+            revisions:      The wiki revision set
+            translation_cache:  If true, use a cache of translated pages
+            links:          Link table to use in place of one built from `revisions`
+            html_parser:    HTML parser backend - `lxml`, `beautifulsoup` or `auto`
+            stats:          Stats object to record into, rather than a new one
+
+        The translation cache is kept in a `translations` directory within
+        the cache directory.  The `auto` parser backend is `lxml` if the
+        optional `lxml` package is installed.
+        """
+        if html_parser == "auto":
+            html_parser = default_html_parser()
+        elif html_parser == "lxml" and lxml is None:
+            raise RuntimeError("The lxml HTML parser needs the lxml package installed")
+        #
+        # Build a fetch cache
+        fetch_cache = FetchCache.initialise_cache(
+            cache_directory=cache_directory,
+            ctx=ctx,
+        )
+        html_translator = HtmlTranslator(
+            url_prefix=furl(url_prefix),
+            links=revisions.link_snapshot() if links is None else links,
+            translation_cache=(
+                TranslationCache.initialise_cache(
+                    cache_directory=cache_directory.joinpath("translations"),
+                    pandoc_command=PANDOC_COMMAND,
+                    html_parser=html_parser,
+                    ctx=ctx,
+                )
+                if translation_cache
+                else None
+            ),
+            html_parser=html_parser,
+        )
+        return cls(
+            fetch_cache=fetch_cache,
+            revisions=revisions,
+            url_prefix=furl(url_prefix),
+            html_translator=html_translator,
+            ctx=ctx,
+            stats=ConversionStats() if stats is None else stats,
+        )
+
+    def retrieve_and_translate(self, revision: MoinEditEntry) -> Optional[bytes]:
+        """
+        Retrieve a wiki revision, and translate it to markdown
+
+        Parameters:
+            revision:    The wiki revision object for the revision we want
+
+        If the revision maps to an empty object - ie it deleted the page, or
+        similar, or its page could not be fetched, then a None object is
+        returned.
+
+        """
+        content = self.retrieve(revision=revision)
+        return self.html_translator.translate_html(content)
+
+    def translate_revisions(
+        self,
+        revisions: Sequence[MoinEditEntry],
+        fetch_workers: int = 0,
+        translate_workers: int = 0,
+        batch_size: int = 1,
+        skip_identical: bool = False,
+    ) -> Iterator[Tuple[MoinEditEntry, Optional[bytes]]]:
+        """
+        Retrieve and translate a sequence of wiki revisions
+
+        Parameters:
+            revisions:      The wiki revision objects, in the order wanted
+            fetch_workers:  Number of threads fetching pages concurrently
+            translate_workers:  Number of processes translating pages
+            batch_size:     Number of pages passed through each `pandoc` run
+            skip_identical: Reuse translations of identical page revisions
+
+        Yields a `(revision, content)` tuple for each revision, in the same
+        order as the revisions were passed in - `content` is as returned by
+        `retrieve_and_translate`, so is None for a revision whose page could
+        not be fetched.  When `fetch_workers` is non-zero the page
+        fetches run in a thread pool, keeping a bounded window of requests in
+        flight ahead of the revision currently being handed back.  Similarly
+        when `translate_workers` is non-zero the HTML extraction and `pandoc`
+        conversion run in a pool of worker processes - each of which is given
+        a copy of the `html_translator` rather than the whole context.
+
+        With a `batch_size` greater than 1, revisions are translated in
+        batches, using a single `pandoc` process for each batch.
+
+        With `skip_identical` set, a revision whose wiki source is identical
+        to an earlier revision of the same page - such as a revert - is not
+        fetched or translated, but given the earlier translation.  The link
+        tables are fixed for the run, so the links within it resolve the
+        same way.  The translations of the most recent sources are held for
+        reuse, along with any still needed by a repeat already in the
+        pipeline - see `TranslationReuse`.
+        """
+        for revision, content, _ in self.translate_revisions_traced(
+            revisions=revisions,
+            fetch_workers=fetch_workers,
+            translate_workers=translate_workers,
+            batch_size=batch_size,
+            skip_identical=skip_identical,
+        ):
+            yield (revision, content)
+
+    def translate_revisions_traced(
+        self,
+        revisions: Sequence[MoinEditEntry],
+        fetch_workers: int = 0,
+        translate_workers: int = 0,
+        batch_size: int = 1,
+        skip_identical: bool = False,
+    ) -> Iterator[Tuple[MoinEditEntry, Optional[bytes], RevisionTrace]]:
+        """
+        Retrieve and translate wiki revisions, as `translate_revisions`
+
+        Yields a `(revision, content, trace)` tuple for each revision, where
+        `trace` is a `RevisionTrace` recording the sizes, times and cache use
+        for the revision.  The `write` time of the trace is left for whoever
+        writes the revision out to fill in.  The trace is marked as
+        `fetch_failed` where the page of the revision, or of the earlier
+        revision it repeats, could not be fetched - its content is then None.
+        """
+        #
+        # the source of each revision is read and hashed on a pool of
+        # threads, running ahead of the fetches - the key is then passed
+        # along with the revision so the source is only read once
+        key_executor = None
+        if fetch_workers > 0:
+            key_executor = ThreadPoolExecutor(max_workers=fetch_workers)
+        try:
+            keyed = ordered_map(
+                self.source_key,
+                revisions,
+                executor=key_executor,
+                window=fetch_workers * 2,
+            )
+            reuse = TranslationReuse() if skip_identical else None
+            marked = (
+                (revision, key, reuse is not None and reuse.claim(key))
+                for revision, key in keyed
+            )
+            #
+            # only the revisions that are not repeats go through the pipeline,
+            # which runs ahead of the revisions being handed back
+            ahead, behind = itertools.tee(marked)
+            translated = self.translate_pipeline(
+                revisions=(
+                    (revision, key) for revision, key, repeat in ahead if not repeat
+                ),
+                fetch_workers=fetch_workers,
+                translate_workers=translate_workers,
+                batch_size=batch_size,
+            )
+            for revision, key, repeat in behind:
+                if repeat:
+                    content = reuse.take(key)
+                    trace = self.create_trace(revision)
+                    if content is None:
+                        # the revision it repeats could not be fetched
+                        trace.fetch_failed = True
+                    else:
+                        trace.identical = True
+                        self.stats.count("identical revisions reused")
+                else:
+                    with self.stats.timed("wait for translation"):
+                        _, content, trace = next(translated)
+                    if reuse is None:
+                        pass
+                    elif trace.fetch_failed:
+                        reuse.fail(key)
+                    else:
+                        reuse.store(key, content)
+                if content is not None:
+                    trace.markdown_bytes = len(content)
+                yield (revision, content, trace)
+        finally:
+            if key_executor is not None:
+                key_executor.shutdown(wait=True)
+
+    def translate_pipeline(
+        self,
+        revisions: Iterable[Tuple[MoinEditEntry, Optional[Tuple[str, str]]]],
+        fetch_workers: int = 0,
+        translate_workers: int = 0,
+        batch_size: int = 1,
+    ) -> Iterator[Tuple[MoinEditEntry, Optional[bytes], RevisionTrace]]:
+        """
+        Fetch and translate a sequence of wiki revisions
+
+        See `translate_revisions_traced`.
+
+        The revisions are passed in along with their `source_key`.
+        """
+        fetch_executor = None
+        translate_executor = None
+        if fetch_workers > 0:
+            fetch_executor = ThreadPoolExecutor(max_workers=fetch_workers)
+        if translate_workers > 0:
+            # worker processes are spawned rather than forked, as forking
+            # while the fetch threads are running can copy held locks
+            translate_executor = ProcessPoolExecutor(
+                max_workers=translate_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_initialise_translate_worker,
+                initargs=(self.html_translator,),
+            )
+            translate_function = _translate_in_worker
+        else:
+            translate_function = functools.partial(
+                translate_with_stats,
+                self.html_translator,
+            )
+        try:
+            fetched = ordered_map(
+                lambda keyed: self.retrieve_traced(*keyed),
+                revisions,
+                executor=fetch_executor,
+                window=fetch_workers * 2,
+            )
+            translated = ordered_map(
+                translate_function,
+                chunked(fetched, batch_size),
+                executor=translate_executor,
+                window=translate_workers * 2,
+                argument=lambda batch: [html for _, (html, _) in batch],
+            )
+            for batch, (contents, stats, timings) in translated:
+                self.stats.merge(stats)
+                for ((revision, _), (_, trace)), content, timing in zip(
+                    batch,
+                    contents,
+                    timings,
+                ):
+                    if timing is not None:
+                        trace.add_translation(timing)
+                    yield (revision, content, trace)
+        finally:
+            for executor in (fetch_executor, translate_executor):
+                if executor is not None:
+                    executor.shutdown(wait=True)
+
+    def source_key(self, revision: MoinEditEntry) -> Optional[Tuple[str, str]]:
+        """
+        Identify the wiki source of a revision
+
+        Returns a tuple of the page path and a hash of the revision source,
+        or None if the revision has no content.
+        """
+        content = revision.wiki_content_bytes()
+        if content is None:
+            return None
+        else:
+            return (revision.page_path, hashlib.sha256(content).hexdigest())
+
+    def fetch_key(
+        self,
+        revision: MoinEditEntry,
+        source_key: Optional[Tuple[str, str]] = None,
+    ) -> Optional[str]:
+        """
+        The key the web page of a revision is held under in the fetch cache
+
+        Parameters:
+            revision:   The wiki revision object
+            source_key: The `source_key` of the revision, if already known
+
+        The key is made from the page path, the revision number and a hash
+        of the revision source, rather than from the URL, so the cache stays
+        good when the wiki moves to a different host or scheme, or is put
+        behind a proxy.  Moin writes the links within a page relative to
+        the host, so these still resolve against the new `url_prefix`.
+        Returns None if the revision has no content.
+        """
+        if source_key is None:
+            source_key = self.source_key(revision)
+        if source_key is None:
+            return None
+        page_path, digest = source_key
+        return f"moin:{page_path}:{revision.page_revision}:{digest}"
+
+    def revision_url(self, revision: MoinEditEntry, url_prefix: furl = None) -> str:
+        """
+        The URL of the wiki web page for a given revision
+
+        Parameters:
+            revision:   The wiki revision object
+            url_prefix: The URL prefix of the wiki, if not the translator's own
+
+        """
+        target = (self.url_prefix if url_prefix is None else furl(url_prefix)).copy()
+        target /= revision.page_path_unescaped()
+        target.args["action"] = "recall"
+        target.args["rev"] = revision.page_revision
+        return target.url
+
+    def prefetch(
+        self,
+        revisions: Iterable[MoinEditEntry],
+        concurrency: int = 8,
+        skip_identical: bool = False,
+    ):
+        """
+        Make sure the web pages for a set of revisions are in the fetch cache
+
+        Parameters:
+            revisions:      The wiki revision objects
+            concurrency:    The maximum number of requests in flight at once
+            skip_identical: Skip revisions identical to an earlier one
+
+        Only revisions with content are fetched, matching `retrieve`, and with
+        `skip_identical` set only the first of a set of identical revisions of
+        a page.  This matches `translate_revisions`, other than for a revert
+        to a revision so far back that its translation is no longer held for
+        reuse - that revert is fetched when translated.
+        """
+        seen = {}
+        lock = threading.Lock()
+
+        def url_key(numbered):
+            # runs on the prefetch threads, so reading the sources overlaps
+            # the fetches - the first of a set of identical revisions is
+            # always fetched, though a later one may also be if it is reached
+            # first
+            number, revision = numbered
+            source_key = self.source_key(revision)
+            if source_key is None:
+                return None
+            if skip_identical:
+                with lock:
+                    if seen.get(source_key, number) < number:
+                        return None
+                    seen[source_key] = number
+            return (self.revision_url(revision), self.fetch_key(revision, source_key))
+
+        self.fetch_cache.prefetch_keyed(
+            items=enumerate(revisions),
+            concurrency=concurrency,
+            url_key=url_key,
+        )
+
+    def migrate_fetch_cache(
+        self,
+        revisions: Iterable[MoinEditEntry],
+        url_prefix: str,
+    ) -> int:
+        """
+        Bring across fetch cache entries made by URL to the page identity keys
+
+        Parameters:
+            revisions:  The wiki revision objects
+            url_prefix: The URL prefix of the wiki the cache was filled from
+
+        Older versions cached the web page of each revision under its URL.
+        Each revision found in the cache under its URL, as built with the
+        given `url_prefix`, is also entered under its `fetch_key`, so it is
+        not fetched again.  Returns the number of entries brought across.
+        """
+        url_prefix = furl(url_prefix)
+
+        def key_pairs():
+            for revision in revisions:
+                key = self.fetch_key(revision)
+                if key is not None:
+                    yield (self.revision_url(revision, url_prefix), key)
+
+        return self.fetch_cache.index.copy_keys(key_pairs())
+
+    def retrieve(self, revision: MoinEditEntry) -> Optional[str]:
+        """
+        Retrieve the HTML of a wiki revision
+
+        Parameters:
+            revision:    The wiki revision object for the revision we want
+
+        If the revision has no content, or its page could not be fetched,
+        then None is returned.
+        """
+        html, _ = self.retrieve_traced(revision, self.source_key(revision))
+        return html
+
+    def retrieve_traced(
+        self,
+        revision: MoinEditEntry,
+        source_key: Optional[Tuple[str, str]],
+    ) -> Tuple[Optional[str], RevisionTrace]:
+        """
+        Retrieve the HTML of a wiki revision as `retrieve`, with a trace
+
+        Parameters:
+            revision:   The wiki revision object for the revision we want
+            source_key: The `source_key` of the revision
+
+        Returns a tuple of the HTML and a `RevisionTrace` holding the fetch
+        time and HTML size.  If the page could not be fetched the HTML is
+        None, and the trace is marked as `fetch_failed`.
+        """
+        trace = self.create_trace(revision)
+        # check if this revision has any content...
+        if source_key is None:
+            return (None, trace)
+        key = self.fetch_key(revision, source_key)
+        start = time.perf_counter()
+        html, trace.fetch_cached = self.fetch_cache.fetch_item(
+            self.revision_url(revision),
+            key=key,
+        )
+        trace.fetch = time.perf_counter() - start
+        self.stats.record("fetch", trace.fetch)
+        if html is None:
+            trace.fetch_failed = True
+        else:
+            trace.html_bytes = len(html.encode("utf-8"))
+        return (html, trace)
+
+    def create_trace(self, revision: MoinEditEntry) -> RevisionTrace:
+        """An empty trace record for a revision"""
+        return RevisionTrace(
+            page=revision.page_name_unescaped(),
+            revision=revision.page_revision,
+            edit_type=revision.edit_type.name,
+        )
+
+    def extract_content_section(self, html: str) -> str:
+        """Extract the content part of the HTML, and simplify - see `HtmlTranslator`"""
+        return self.html_translator.extract_content_section(html)
+
+    def translate(self, input: str) -> bytes:
+        """Translate HTML to Github Flavoured Markdown using pandoc"""
+        return self.html_translator.translate(input)
 
 
 # end
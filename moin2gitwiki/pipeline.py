@@ -0,0 +1,84 @@
+"""
+moin2gitwiki pipeline helpers
+
+Helpers used to run stages of the conversion concurrently, while still
+handing the results on in the original order - git history has to be
+written strictly in edit date order.
+"""
+from collections import deque
+from concurrent.futures import Executor
+from typing import Any
+from typing import Callable
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+
+def ordered_map(
+    function: Callable,
+    items: Iterable,
+    executor: Optional[Executor] = None,
+    window: int = 1,
+    argument: Optional[Callable] = None,
+) -> Iterator[Tuple[Any, Any]]:
+    """
+    Map a function over a set of items, returning `(item, result)` in order
+
+    Parameters:
+        function:   The function to apply to each item
+        items:      An iterable of items
+        executor:   A `concurrent.futures` executor, or `None` to run inline
+        window:     The maximum number of calls in flight ahead of the consumer
+        argument:   Optionally picks the value passed to `function` out of each item
+
+    Unlike `Executor.map` the items are only pulled from the iterable as
+    results are consumed, so no more than `window` calls are outstanding at
+    any time and memory use stays bounded however long the input is.
+
+    The `argument` selector is useful where only part of each item needs to
+    go to the function - for example to avoid pickling the whole item when
+    the executor is a process pool.
+    """
+    if argument is None:
+        argument = _identity
+    if executor is None:
+        for item in items:
+            yield (item, function(argument(item)))
+        return
+    pending: deque = deque()
+    for item in items:
+        pending.append((item, executor.submit(function, argument(item))))
+        if len(pending) >= window:
+            item, future = pending.popleft()
+            yield (item, future.result())
+    while len(pending) > 0:
+        item, future = pending.popleft()
+        yield (item, future.result())
+
+
+def chunked(items: Iterable, size: int) -> Iterator[List]:
+    """
+    Split an iterable up into lists of up to `size` items
+
+    Parameters:
+        items:      An iterable of items
+        size:       The maximum number of items in each list
+
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+def _identity(item):
+    return item
+
+
+# end
@@ -0,0 +1,172 @@
+import functools
+import os
+import pickle
+import sqlite3
+from pathlib import Path
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import attr
+
+from . import __version__
+from .wikiindex import read_page_edit_log
+from .wikiindex import scan_pages
+
+
+@attr.s(kw_only=True, slots=True)
+class RevisionIndex:
+    """
+    A persistent index of the parsed edit-log of each wiki page
+
+    The parsed rows of each page edit-log are kept in an SQLite database,
+    along with the modification time and size of the edit-log they were
+    parsed from.  Moin appends to a page edit-log on every change to the
+    page, so a page whose edit-log is unchanged need not be read again.
+
+    The rows of each page are held as a single pickled value, so loading
+    the index costs one database row per page rather than per revision.
+
+    Attributes:
+        index_path:     Path of the SQLite index file
+        connection:     The SQLite database connection
+
+    """
+
+    index_path: Path = attr.ib()
+    connection: sqlite3.Connection = attr.ib(repr=False)
+
+    @classmethod
+    def open_index(cls, index_path: Path, moin_data: Path, logger):
+        """
+        Open, creating if needed, the index database
+
+        Parameters:
+            index_path:     Path of the SQLite index file
+            moin_data:      Path of the MoinMoin data directory indexed
+            logger:         Logger object
+
+        An index built from a different wiki, or by a different version of
+        this package, is emptied so that every page is read again.
+        """
+        connection = sqlite3.connect(str(index_path), isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS settings "
+            "(name TEXT PRIMARY KEY, value TEXT NOT NULL)",
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS pages "
+            "(page TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL, "
+            "size INTEGER NOT NULL, rows BLOB NOT NULL)",
+        )
+        index = cls(index_path=index_path, connection=connection)
+        settings = {"moin_data": str(moin_data), "version": __version__}
+        current_settings = index.get_settings()
+        if current_settings != settings:
+            if len(current_settings) > 0:
+                logger.info(f"Revision index {index_path} is out of date - rebuilding")
+            connection.execute("BEGIN")
+            connection.execute("DELETE FROM pages")
+            connection.execute("DELETE FROM settings")
+            connection.executemany(
+                "INSERT INTO settings (name, value) VALUES (?, ?)",
+                settings.items(),
+            )
+            connection.execute("COMMIT")
+        logger.debug(f"Opened revision index {index_path}")
+        return index
+
+    def get_settings(self) -> dict:
+        """Return the settings the index was built with"""
+        return dict(self.connection.execute("SELECT name, value FROM settings"))
+
+    def scan_edit_logs(
+        self,
+        pages_dir: str,
+        pages: Iterable[str],
+        ctx,
+    ) -> Iterator[Tuple[str, Optional[List[tuple]]]]:
+        """
+        Return the parsed edit-log rows of each page, reading only changed pages
+
+        Parameters:
+            pages_dir:  Path of the wiki `pages` directory
+            pages:      The names on the filesystem of the pages
+            ctx:        Context object
+
+        Returns `(page, rows)` pairs in the order of `pages`, just as
+        reading each edit-log with `read_page_edit_log` would.  The index is
+        updated, in a single transaction, once all pages have been checked.
+        Pages which are no longer in the wiki are dropped from the index.
+        """
+        known = {
+            page: (mtime_ns, size, rows)
+            for page, mtime_ns, size, rows in self.connection.execute(
+                "SELECT page, mtime_ns, size, rows FROM pages",
+            )
+        }
+        changed = []
+        seen = set()
+        scanned = scan_pages(
+            functools.partial(check_page_edit_log, pages_dir, known),
+            pages,
+            workers=ctx.scan_workers,
+        )
+        for page, (signature, rows) in scanned:
+            seen.add(page)
+            if signature is None:
+                yield (page, None)
+            elif rows is None:
+                yield (page, pickle.loads(known[page][2]))
+            else:
+                changed.append((page, signature[0], signature[1], pickle.dumps(rows)))
+                yield (page, rows)
+        removed = [(page,) for page in known if page not in seen]
+        ctx.logger.info(
+            f"Revision index: {len(seen) - len(changed)} pages unchanged, "
+            f"{len(changed)} read, {len(removed)} removed",
+        )
+        self.connection.execute("BEGIN")
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO pages (page, mtime_ns, size, rows) "
+            "VALUES (?, ?, ?, ?)",
+            changed,
+        )
+        self.connection.executemany("DELETE FROM pages WHERE page = ?", removed)
+        self.connection.execute("COMMIT")
+
+
+# -----------------------------------------------------------------------
+def check_page_edit_log(pages_dir: str, known: dict, page: str):
+    """
+    Check a page edit-log against the index, parsing it if it has changed
+
+    Parameters:
+        pages_dir:  Path of the wiki `pages` directory
+        known:      Maps page to the `(mtime_ns, size, rows)` held in the index
+        page:       The name on the filesystem of the page
+
+    Returns a pair of the edit-log `(mtime_ns, size)` and its parsed rows -
+    the rows are `None` if the page is unchanged, and both are `None` if the
+    page has no edit-log.  The edit-log is checked before it is read, so a
+    change made while it is being read is picked up on the next run.
+    """
+    try:
+        stat = os.stat(os.path.join(pages_dir, page, "edit-log"))
+    except OSError:
+        return (None, None)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    entry = known.get(page)
+    if entry is not None and entry[:2] == signature:
+        return (signature, None)
+    rows = read_page_edit_log(pages_dir, page)
+    if rows is None:
+        return (None, None)
+    return (signature, rows)
+
+
+# end
@@ -0,0 +1,343 @@
+"""
+moin2gitwiki conversion statistics
+
+Counters and latency histograms gathered for each stage of a conversion,
+so that a slow run shows where its time went - fetching, HTML parsing,
+`pandoc`, or waiting on `git fast-import`.
+"""
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict
+from typing import Iterable
+from typing import List
+
+import attr
+
+#
+# upper bounds, in seconds, of the latency histogram buckets - the last
+# bucket holds everything slower
+LATENCY_BUCKETS = (
+    0.001,
+    0.002,
+    0.005,
+    0.01,
+    0.02,
+    0.05,
+    0.1,
+    0.2,
+    0.5,
+    1.0,
+    2.0,
+    5.0,
+    10.0,
+)
+
+
+@attr.s(kw_only=True, slots=True)
+class LatencyHistogram:
+    """
+    A histogram of the time taken by each operation in a stage
+
+    Attributes:
+        count:      The number of operations timed
+        total:      Total seconds taken by all the operations
+        maximum:    Seconds taken by the slowest operation
+        buckets:    Count of operations in each of the `LATENCY_BUCKETS`
+
+    """
+
+    count: int = attr.ib(default=0)
+    total: float = attr.ib(default=0.0)
+    maximum: float = attr.ib(default=0.0)
+    buckets: List[int] = attr.ib(factory=lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+
+    def add(self, seconds: float):
+        """Add the time taken by one operation"""
+        self.count += 1
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def merge(self, other: "LatencyHistogram"):
+        """Add in the operations of another histogram"""
+        self.count += other.count
+        self.total += other.total
+        self.maximum = max(self.maximum, other.maximum)
+        for index, count in enumerate(other.buckets):
+            self.buckets[index] += count
+
+    def quantile(self, fraction: float) -> float:
+        """
+        Estimate a quantile of the operation times
+
+        The operations within the bucket holding the quantile are taken to
+        be spread evenly across it, so the estimate is interpolated between
+        the bucket bounds.  The last bucket is taken to end at the maximum.
+        """
+        if self.count == 0:
+            return 0.0
+        wanted = fraction * self.count
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(LATENCY_BUCKETS + (None,), self.buckets):
+            upper = min(self.maximum, self.maximum if bound is None else bound)
+            if count > 0 and seen + count >= wanted:
+                part = max(wanted - seen, 0) / count
+                return lower + (upper - lower) * part
+            seen += count
+            if bound is not None:
+                lower = min(bound, self.maximum)
+        return self.maximum
+
+    def as_dict(self) -> dict:
+        """The histogram as a dictionary, suitable for JSON"""
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count > 0 else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "max": self.maximum,
+            "buckets": {
+                (f"le {bound}" if bound is not None else "slower"): count
+                for bound, count in zip(LATENCY_BUCKETS + (None,), self.buckets)
+            },
+        }
+
+
+class ConversionStats:
+    """
+    Counters and latency histograms for the stages of a conversion
+
+    Parameters:
+        started:    The `time.perf_counter` time the conversion started
+
+    The stats may be updated from several threads at once.  They pickle,
+    without their lock, so that worker processes can gather their own
+    stats and pass them back to be merged.
+    """
+
+    __slots__ = ("started", "counters", "latencies", "_lock")
+
+    def __init__(self, started: float = None):
+        self.started = time.perf_counter() if started is None else started
+        self.counters: Dict[str, int] = {}
+        self.latencies: Dict[str, LatencyHistogram] = {}
+        self._lock = threading.Lock()
+
+    def count(self, counter: str, amount: int = 1):
+        """Add to a counter"""
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def record(self, stage: str, seconds: float):
+        """Add the time taken by one operation in a stage"""
+        with self._lock:
+            if stage not in self.latencies:
+                self.latencies[stage] = LatencyHistogram()
+            self.latencies[stage].add(seconds)
+
+    @contextmanager
+    def timed(self, stage: str):
+        """Context manager recording the time taken within it against a stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def merge(self, other: "ConversionStats"):
+        """Add in the counters and latencies of another stats object"""
+        with self._lock:
+            for counter, amount in other.counters.items():
+                self.counters[counter] = self.counters.get(counter, 0) + amount
+            for stage, histogram in other.latencies.items():
+                if stage not in self.latencies:
+                    self.latencies[stage] = LatencyHistogram()
+                self.latencies[stage].merge(histogram)
+
+    def elapsed(self) -> float:
+        """Seconds since the conversion started"""
+        return time.perf_counter() - self.started
+
+    def as_dict(self) -> dict:
+        """The stats as a dictionary, suitable for JSON"""
+        with self._lock:
+            return {
+                "elapsed": self.elapsed(),
+                "counters": dict(sorted(self.counters.items())),
+                "latencies": {
+                    stage: histogram.as_dict()
+                    for stage, histogram in sorted(self.latencies.items())
+                },
+            }
+
+    def summary(self) -> List[str]:
+        """
+        Summarise the stats as lines of text
+
+        Each stage is shown with its operation count, total time and the
+        throughput that gives, followed by its median, 95th percentile and
+        slowest operation times.  The counters follow.
+        """
+        data = self.as_dict()
+        lines = [f"Elapsed {data['elapsed']:.1f}s"]
+        # the names are padded to line up, leaving a gap after the longest
+        width = max(
+            [len("stage")]
+            + [len(name) + 2 for name in data["latencies"]]
+            + [len(name) + 2 for name in data["counters"]],
+        )
+        if len(data["latencies"]) > 0:
+            lines.append(
+                f"{'stage':{width}s}{'count':>9s}{'total':>10s}{'rate':>11s}"
+                f"{'p50':>9s}{'p95':>9s}{'max':>9s}",
+            )
+        for stage, latency in data["latencies"].items():
+            rate = latency["count"] / latency["total"] if latency["total"] > 0 else 0
+            lines.append(
+                f"{stage:{width}s}{latency['count']:9d}{latency['total']:9.2f}s"
+                f"{rate:9.1f}/s{latency['p50'] * 1000:7.1f}ms"
+                f"{latency['p95'] * 1000:7.1f}ms{latency['max'] * 1000:7.1f}ms",
+            )
+        for counter, amount in data["counters"].items():
+            lines.append(f"{counter:{width}s}{amount:9d}")
+        return lines
+
+    def save_json(self, path: Path):
+        """Write the stats to a JSON file, for comparing runs"""
+        Path(path).write_text(json.dumps(self.as_dict(), indent=2) + "\n")
+
+    def __getstate__(self):
+        return {
+            "started": self.started,
+            "counters": self.counters,
+            "latencies": self.latencies,
+        }
+
+    def __setstate__(self, state):
+        self.__init__(state["started"])
+        self.counters.update(state["counters"])
+        self.latencies.update(state["latencies"])
+
+
+@attr.s(kw_only=True, slots=True)
+class TranslationTiming:
+    """
+    How the translation of one page went
+
+    Attributes:
+        parse:      Seconds spent extracting the content from the page HTML
+        pandoc:     Seconds of `pandoc` time given to this page
+        cached:     True if the translation came from the translation cache
+
+    Where several pages go through one `pandoc` run, the run time is shared
+    out between them in proportion to the size of their content.
+    """
+
+    parse: float = attr.ib(default=0.0)
+    pandoc: float = attr.ib(default=0.0)
+    cached: bool = attr.ib(default=False)
+
+
+@attr.s(kw_only=True, slots=True)
+class RevisionTrace:
+    """
+    A record of how one wiki revision was converted
+
+    Attributes:
+        page:       The wiki page name
+        revision:   The page revision
+        edit_type:  The kind of edit made by the revision
+        html_bytes: Size of the fetched page HTML
+        markdown_bytes: Size of the translated Markdown
+        fetch:      Seconds spent fetching the page HTML
+        parse:      Seconds spent extracting the content from the page HTML
+        pandoc:     Seconds of `pandoc` time given to this revision
+        write:      Seconds spent writing the revision to the fast-import stream
+        fetch_cached: True if the page HTML came from the fetch cache
+        translation_cached: True if the translation came from the translation cache
+        identical:  True if the translation of an identical earlier revision was reused
+        fetch_failed: True if the page HTML could not be fetched
+
+    """
+
+    page: str = attr.ib()
+    revision: str = attr.ib()
+    edit_type: str = attr.ib()
+    html_bytes: int = attr.ib(default=0)
+    markdown_bytes: int = attr.ib(default=0)
+    fetch: float = attr.ib(default=0.0)
+    parse: float = attr.ib(default=0.0)
+    pandoc: float = attr.ib(default=0.0)
+    write: float = attr.ib(default=0.0)
+    fetch_cached: bool = attr.ib(default=False)
+    translation_cached: bool = attr.ib(default=False)
+    identical: bool = attr.ib(default=False)
+    fetch_failed: bool = attr.ib(default=False)
+
+    TIMES = ("fetch", "parse", "pandoc", "write")
+
+    def add_translation(self, timing: TranslationTiming):
+        """Fill in the translation times"""
+        self.parse = timing.parse
+        self.pandoc = timing.pandoc
+        self.translation_cached = timing.cached
+
+    def total(self) -> float:
+        """Total seconds spent on this revision"""
+        return self.fetch + self.parse + self.pandoc + self.write
+
+    def as_json(self) -> str:
+        """The trace as a line of JSON"""
+        data = attr.asdict(self)
+        data["total"] = self.total()
+        return json.dumps(data)
+
+
+def rank_traces(
+    lines: Iterable[str],
+    by: str = "total",
+    per_revision: bool = False,
+) -> List[dict]:
+    """
+    Rank the pages in a trace, slowest first
+
+    Parameters:
+        lines:          The lines of a JSONL trace file, each a `RevisionTrace`
+        by:             The field to rank on - one of the times, `total`,
+                        `html_bytes` or `markdown_bytes`
+        per_revision:   Rank each revision on its own rather than totalling each page
+
+    When totalling each page, the result for a page has the sums over all
+    its revisions, along with its number of `revisions` and the `slowest`
+    revision total.
+    """
+    fields = RevisionTrace.TIMES + ("total", "html_bytes", "markdown_bytes")
+    if by not in fields:
+        raise ValueError(f"Cannot rank traces by {by}")
+    records = [json.loads(line) for line in lines if line.strip() != ""]
+    if not per_revision:
+        pages: Dict[str, dict] = {}
+        for record in records:
+            if record["page"] not in pages:
+                pages[record["page"]] = {
+                    "page": record["page"],
+                    "revisions": 0,
+                    "slowest": 0.0,
+                    **{field: 0 for field in fields},
+                }
+            page = pages[record["page"]]
+            page["revisions"] += 1
+            page["slowest"] = max(page["slowest"], record["total"])
+            for field in fields:
+                page[field] += record[field]
+        records = list(pages.values())
+    return sorted(records, key=lambda record: record[by], reverse=True)
+
+
+# end
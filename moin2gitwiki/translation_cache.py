@@ -0,0 +1,120 @@
+import gzip
+import hashlib
+import os
+import subprocess
+import uuid
+from pathlib import Path
+from typing import Iterable
+from typing import Optional
+
+import attr
+
+from . import __version__
+
+
+@attr.s(kw_only=True, frozen=True, slots=True)
+class TranslationCache:
+    """
+    Implements a local cache of translated Markdown which persists between runs
+
+    Each translated page is stored, gzip compressed, in a file named by a
+    key made from a hash of the fetched page HTML, the targets its links
+    were rewritten to, and a fingerprint of the `pandoc` version and
+    arguments, the HTML parser and this package version.  If any of those
+    change then the key changes, so there is no need for an index or
+    invalidation.
+
+    The cache holds only plain values so it can be handed to worker
+    processes, which may all read and write it at once.
+
+    Attributes:
+        cache_directory:    Path of the translation cache directory
+        fingerprint:        Fingerprint of the translation tools and settings
+
+    """
+
+    cache_directory: Path = attr.ib()
+    fingerprint: str = attr.ib()
+
+    @classmethod
+    def initialise_cache(
+        cls,
+        cache_directory: Path,
+        pandoc_command: list,
+        ctx,
+        html_parser: str = "beautifulsoup",
+    ):
+        """
+        Build the cache object
+
+        Parameters:
+            cache_directory:    Path of the translation cache directory
+            pandoc_command:     The pandoc command and arguments used to translate
+            ctx:                Context object (used for logging etc)
+            html_parser:        The HTML parser backend used on the pages
+
+        Creates if needed the passed `cache_directory`, and runs pandoc to
+        find its version for the fingerprint.
+        """
+        cache_directory.mkdir(mode=0o777, parents=True, exist_ok=True)
+        cache_directory = cache_directory.resolve(strict=True)
+        version = subprocess.run(
+            [pandoc_command[0], "--version"],
+            stdout=subprocess.PIPE,
+            check=True,
+        ).stdout.decode("utf-8")
+        fingerprint = "\n".join(
+            [
+                f"moin2gitwiki {__version__}",
+                version.splitlines()[0],
+                " ".join(pandoc_command),
+                f"html parser {html_parser}",
+            ],
+        )
+        ctx.logger.debug(f"Building translation cache in directory {cache_directory}")
+        return cls(cache_directory=cache_directory, fingerprint=fingerprint)
+
+    def make_key(self, html: str, link_targets: Iterable[str]) -> str:
+        """
+        Build the cache key for a page
+
+        Parameters:
+            html:           The fetched page HTML
+            link_targets:   Description of how each link in the page is rewritten
+
+        """
+        digest = hashlib.sha256()
+        digest.update(self.fingerprint.encode("utf-8"))
+        for link_target in link_targets:
+            digest.update(b"\0")
+            digest.update(link_target.encode("utf-8"))
+        digest.update(b"\0\0")
+        digest.update(html.encode("utf-8"))
+        return digest.hexdigest()
+
+    def item_path(self, key: str) -> Path:
+        """The path of the cache file for a key"""
+        return self.cache_directory.joinpath(key[:2], f"{key}.gz")
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return the cached translation for a key, or None if not cached"""
+        try:
+            return gzip.decompress(self.item_path(key).read_bytes())
+        except (OSError, EOFError):
+            return None
+
+    def put(self, key: str, content: bytes):
+        """
+        Store a translation in the cache
+
+        The file is written under a temporary name and renamed into place,
+        so a partly written file is never seen under its final name.
+        """
+        item_path = self.item_path(key)
+        item_path.parent.mkdir(mode=0o777, parents=True, exist_ok=True)
+        temp_path = item_path.with_name(f".{uuid.uuid4().hex}.tmp")
+        temp_path.write_bytes(gzip.compress(content))
+        os.replace(temp_path, item_path)
+
+
+# end
@@ -1,15 +1,30 @@
+import functools
 import os
-import re
+import sys
+from array import array
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from datetime import timedelta
 from enum import auto
 from enum import Enum
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Set
 from typing import Tuple
 
 import attr
 
+from .pipeline import ordered_map
 from .users import Moin2GitUser
 
+EPOCH = datetime(1970, 1, 1)
+
 
 class MoinEditType(Enum):
     PAGE = auto()
@@ -18,37 +33,25 @@ class MoinEditType(Enum):
     DELETE = auto()
 
 
-@attr.s(kw_only=True, frozen=True, slots=True)
-class MoinEditEntry:
-    """
-    Represents a Moin page revision
+# edit types are held in the revision columns as their index in this list
+EDIT_TYPES = list(MoinEditType)
+EDIT_TYPE_INDEXES = {edit_type: index for index, edit_type in enumerate(EDIT_TYPES)}
 
-    There are multiple revisions per page.
 
-    Attributes:
-        edit_date: The date of the edit
-        page_revision: The revision id of this revision - a string of a zero padded number
-        edit_type: Moin edit type
-        page_name: The name of the page from the index file
-        previous_page_name: The name the page previously had if renamed
-        page_path: The name on the filesystem of the page
-        attachment: attachment field - not used
-        comment: comment filed - only used for git comments
-        user: the mapped moin user
-        ctx: Context - there for moin_path and logging
+class MoinEditEntryMethods:
+    """
+    The methods shared by Moin revision entries and revision entry views
 
+    These only use the revision attributes, so work the same whether the
+    attributes are held in the object itself or looked up in the columns
+    of a `MoinEditEntries` collection.
     """
 
-    edit_date: datetime = attr.ib()
-    page_revision: str = attr.ib()
-    edit_type: MoinEditType = attr.ib()
-    page_name: str = attr.ib()
-    previous_page_name: str = attr.ib(default=None)
-    page_path: str = attr.ib()
-    attachment: str = attr.ib(default=None)
-    comment: str = attr.ib(default="")
-    user: Moin2GitUser = attr.ib()
-    ctx = attr.ib(repr=False)
+    __slots__ = ()
+
+    def edit_microseconds(self) -> int:
+        """The date of the edit as microseconds since the epoch, as in the edit-log"""
+        return (self.edit_date - EPOCH) // timedelta(microseconds=1)
 
     def wiki_content_path(self):
         """The file pathname of the revision file"""
@@ -103,7 +106,13 @@ class MoinEditEntry:
             self.attachment,
         )
 
-    def unescape(self, thing: str) -> str:
+    @staticmethod
+    def escape(thing: str) -> str:
+        """Escape a wiki name - translate / to (2f)"""
+        return thing.replace("/", "(2f)")
+
+    @staticmethod
+    def unescape(thing: str) -> str:
         """Uescape a wiki name - translate (2f) to /"""
         return thing.replace("(2f)", "/")
 
@@ -115,7 +124,8 @@ class MoinEditEntry:
         """Unescape the page path"""
         return self.unescape(self.page_path)
 
-    def markdown_transform(self, thing: str) -> str:
+    @staticmethod
+    def markdown_transform(thing: str) -> str:
         """Translates the (2f) to _ for use in Markdown page names"""
         return thing.replace("(2f)", "_")
 
@@ -129,148 +139,514 @@ class MoinEditEntry:
 
 
 @attr.s(kw_only=True, frozen=True, slots=True)
-class MoinEditEntries:
+class MoinEditEntry(MoinEditEntryMethods):
+    """
+    Represents a Moin page revision
+
+    There are multiple revisions per page.
+
+    Attributes:
+        edit_date: The date of the edit
+        page_revision: The revision id of this revision - a string of a zero padded number
+        edit_type: Moin edit type
+        page_name: The name of the page from the index file
+        previous_page_name: The name the page previously had if renamed
+        page_path: The name on the filesystem of the page
+        attachment: attachment field - not used
+        comment: comment filed - only used for git comments
+        user: the mapped moin user
+        ctx: Context - there for moin_path and logging
+
+    """
+
+    edit_date: datetime = attr.ib()
+    page_revision: str = attr.ib()
+    edit_type: MoinEditType = attr.ib()
+    page_name: str = attr.ib()
+    previous_page_name: str = attr.ib(default=None)
+    page_path: str = attr.ib()
+    attachment: str = attr.ib(default=None)
+    comment: str = attr.ib(default="")
+    user: Moin2GitUser = attr.ib()
+    ctx = attr.ib(repr=False)
+
+
+class MoinEditEntryView(MoinEditEntryMethods):
+    """
+    A lightweight view of one revision held within a `MoinEditEntries`
+
+    This has the same attributes and methods as a `MoinEditEntry`, but
+    holds only the collection and a row number - each attribute is looked
+    up in the columns of the collection as it is used.
+    """
+
+    __slots__ = ("_revisions", "_row")
+
+    def __init__(self, revisions: "MoinEditEntries", row: int):
+        self._revisions = revisions
+        self._row = row
+
+    @property
+    def edit_date(self) -> datetime:
+        return EPOCH + timedelta(microseconds=self._revisions.edit_times[self._row])
+
+    @property
+    def page_revision(self) -> str:
+        return self._revisions.page_revisions[self._row]
+
+    @property
+    def edit_type(self) -> MoinEditType:
+        return EDIT_TYPES[self._revisions.edit_types[self._row]]
+
+    @property
+    def page_name(self) -> str:
+        return self._revisions.page_names[self._row]
+
+    @property
+    def previous_page_name(self) -> Optional[str]:
+        return self._revisions.previous_page_names[self._row]
+
+    @property
+    def page_path(self) -> str:
+        return self._revisions.page_paths[self._row]
+
+    @property
+    def attachment(self) -> str:
+        return self._revisions.attachments[self._row]
+
+    @property
+    def comment(self) -> str:
+        return self._revisions.comments[self._row]
+
+    @property
+    def user(self) -> Moin2GitUser:
+        return self._revisions.users[self._revisions.user_indexes[self._row]]
+
+    @property
+    def ctx(self):
+        return self._revisions.ctx
+
+    def edit_microseconds(self) -> int:
+        return self._revisions.edit_times[self._row]
+
+    def __eq__(self, other):
+        if not isinstance(other, MoinEditEntryView):
+            return NotImplemented
+        return self._revisions is other._revisions and self._row == other._row
+
+    def __hash__(self):
+        return hash((id(self._revisions), self._row))
+
+    def __repr__(self):
+        return (
+            f"MoinEditEntryView(page_name={self.page_name!r}, "
+            f"page_revision={self.page_revision!r}, edit_type={self.edit_type})"
+        )
+
+
+class MoinEditEntryList(Sequence):
     """
-    A sorted collection of Moin revision entry objects
+    The revisions of a `MoinEditEntries` as a sequence of entry views
+
+    Views are made as each revision is looked at, so walking through the
+    sequence does not hold an object per revision.
+    """
+
+    __slots__ = ("_revisions",)
+
+    def __init__(self, revisions: "MoinEditEntries"):
+        self._revisions = revisions
+
+    def __len__(self) -> int:
+        return len(self._revisions.edit_times)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[row] for row in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("revision index out of range")
+        return MoinEditEntryView(self._revisions, index)
+
+
+@attr.s(kw_only=True, frozen=True, slots=True)
+class MoinLinkTable:
+    """
+    A snapshot of the link targets within the wiki
+
+    This holds just plain strings so can be pickled and handed to worker
+    processes, unlike the revision entries themselves.
+
+    Attributes:
+        link_table: maps unescaped page names to markdown page names
+        attachment_link_table: maps tab joined unescaped page name and
+            attachment name to attachment destination
+
     """
 
-    entries: list = attr.ib()
     link_table: dict = attr.ib()
     attachment_link_table: dict = attr.ib()
+
+    def get_new_link_target(self, link):
+        return self.link_table.get(link)
+
+    def get_new_attachment_link_target(self, link, attachment):
+        key = "\t".join([link, attachment])
+        return self.attachment_link_table.get(key)
+
+
+@attr.s(kw_only=True, frozen=True, slots=True)
+class MoinDirectoryLinkTable:
+    """
+    Link targets within the wiki, looked up in the wiki pages directory
+
+    Used in place of a `MoinLinkTable` where only a few pages are to be
+    translated - rather than reading every page edit-log up front, each
+    link is checked against the wiki filesystem as it is resolved.
+
+    Attributes:
+        pages_dir: Path of the wiki `pages` directory
+
+    """
+
+    pages_dir: str = attr.ib()
+
+    def page_directory(self, link) -> Optional[str]:
+        """The name on the filesystem of a linked page, if it is in the wiki"""
+        page_path = MoinEditEntryMethods.escape(link)
+        if page_path in ("", ".", ".."):
+            return None
+        if not os.path.isfile(os.path.join(self.pages_dir, page_path, "edit-log")):
+            return None
+        return page_path
+
+    def get_new_link_target(self, link):
+        page_path = self.page_directory(link)
+        if page_path is None:
+            return None
+        return MoinEditEntryMethods.markdown_transform(page_path)
+
+    def get_new_attachment_link_target(self, link, attachment):
+        page_path = self.page_directory(link)
+        if page_path is None or "/" in attachment:
+            return None
+        if not os.path.isfile(
+            os.path.join(self.pages_dir, page_path, "attachments", attachment),
+        ):
+            return None
+        return os.path.join("_attachments", page_path, attachment)
+
+
+@attr.s(kw_only=True, frozen=True, slots=True)
+class MoinEditEntries:
+    """
+    A sorted collection of Moin revision entries
+
+    The revisions are held as columns rather than as an object each -
+    times as integer microseconds, edit types and users as small integer
+    indexes, and strings interned so each distinct page name, path or
+    revision id is held only once.  The `entries` sequence gives a view of
+    each revision with the same attributes and methods as a `MoinEditEntry`.
+
+    Attributes:
+        edit_times: Edit times, in microseconds since the epoch
+        page_revisions: Revision ids
+        edit_types: Indexes into `EDIT_TYPES` of the edit types
+        page_names: Page names from the edit-log
+        previous_page_names: Page names before a rename, otherwise None
+        page_paths: Page names on the filesystem
+        attachments: Attachment names
+        comments: Edit comments
+        user_indexes: Indexes into `users` of the mapped moin users
+        users: The distinct mapped moin users
+        link_table: maps unescaped page names to the row of their latest revision
+        attachment_link_table: maps tab joined page name and attachment to
+            the row of its latest revision
+        ctx: Context - there for moin_path and logging
+
+    The `(page_name, revision)` lookup used by `find_revision` is only
+    built when first used.
+
+    """
+
+    edit_times: array = attr.ib(repr=False)
+    page_revisions: list = attr.ib(repr=False)
+    edit_types: array = attr.ib(repr=False)
+    page_names: list = attr.ib(repr=False)
+    previous_page_names: list = attr.ib(repr=False)
+    page_paths: list = attr.ib(repr=False)
+    attachments: list = attr.ib(repr=False)
+    comments: list = attr.ib(repr=False)
+    user_indexes: array = attr.ib(repr=False)
+    users: list = attr.ib(repr=False)
+    link_table: dict = attr.ib(repr=False)
+    attachment_link_table: dict = attr.ib(repr=False)
     ctx = attr.ib(repr=False)
+    _revision_rows: dict = attr.ib(factory=dict, init=False, repr=False)
 
     @classmethod
-    def create_edit_entries(cls, ctx):
+    def create_edit_entries(cls, ctx, revision_index=None):
+        """
+        Build the collection by reading the edit-log of every wiki page
+
+        Parameters:
+            ctx:            Context object
+            revision_index: Optional `RevisionIndex` holding already parsed edit-logs
+
+        The edit-logs are parsed across a pool of `ctx.scan_workers`
+        threads, since on network storage the time goes in waiting on the
+        filesystem rather than in parsing.  With a revision index only the
+        edit-logs changed since the index was last updated are parsed.
+        """
         pages_dir = os.path.join(ctx.moin_data, "pages")
         pages = os.listdir(pages_dir)
-        epoch = datetime(1970, 1, 1)
-        attachment_link_table = {}
-        entries = []
-        for page in pages:
+        if revision_index is None:
+            scanned = scan_pages(
+                functools.partial(read_page_edit_log, pages_dir),
+                pages,
+                workers=ctx.scan_workers,
+            )
+        else:
+            scanned = revision_index.scan_edit_logs(pages_dir, pages, ctx=ctx)
+        return cls.create_from_rows(scanned, ctx=ctx)
+
+    @classmethod
+    def create_page_entries(cls, ctx, page_path: str):
+        """
+        Build the collection from the edit-log of a single wiki page
+
+        Parameters:
+            ctx:        Context object
+            page_path:  The name on the filesystem of the page
+
+        """
+        pages_dir = os.path.join(ctx.moin_data, "pages")
+        rows = read_page_edit_log(pages_dir, page_path)
+        return cls.create_from_rows([(page_path, rows)], ctx=ctx)
+
+    @classmethod
+    def create_from_rows(
+        cls,
+        scanned: Iterable[Tuple[str, Optional[List[tuple]]]],
+        ctx,
+    ):
+        """
+        Build the collection from the parsed edit-log rows of each page
+
+        Parameters:
+            scanned:    `(page, rows)` pairs as returned by `read_page_edit_log`
+            ctx:        Context object
+
+        """
+        edit_times = array("q")
+        page_revisions = []
+        edit_types = array("B")
+        page_names = []
+        previous_page_names = []
+        page_paths = []
+        attachments = []
+        comments = []
+        user_indexes = array("I")
+        users = []
+        user_ids: Dict[str, int] = {}
+        for page, rows in scanned:
             ctx.logger.debug(f"Reading page {page}")
-            edit_log_file = os.path.join(pages_dir, page, "edit-log")
-            # read the edit-log file
-            try:
-                with open(edit_log_file) as f:
-                    edit_log_data = f.readlines()
-            except OSError:
+            if rows is None:
                 ctx.logger.warning(f"No edit-log for page {page}")
                 continue
-            # read the lines in the edit-log file
-            for edit_line in edit_log_data:
-                if not re.match(r"\d{15}", edit_line):  # check its an edit entry
-                    continue
-                # extract the fields out the edit entry
-                edit_fields = edit_line.rstrip("\n").split("\t")
-                edit_date = epoch + timedelta(microseconds=int(edit_fields[0]))
-                page_revision = edit_fields[1]
-                edit_type = edit_fields[2]
-                if edit_type == "SAVE/RENAME":
-                    previous_page_name = page_name
-                    ed_type = MoinEditType.RENAME
-                else:
-                    previous_page_name = None
-                    if edit_type in ("SAVENEW", "SAVE", "SAVE/REVERT"):
-                        if ctx.moin_data.joinpath(
-                            "pages",
-                            page,
-                            "revisions",
-                            page_revision,
-                        ).is_file():
-                            ed_type = MoinEditType.PAGE
-                        else:
-                            ed_type = MoinEditType.DELETE
-                    elif edit_type == "ATTNEW":
-                        attachment_path = os.path.join(
-                            pages_dir,
-                            page,
-                            "attachments",
-                            edit_fields[7],
-                        )
-                        if os.path.isfile(attachment_path):
-                            # attachment exists
-                            ed_type = MoinEditType.ATTACH
-                        else:
-                            # cannot find attachment - ignore it and move on
-                            continue
-                    else:
-                        # unrecognised edit_type - just move on
-                        continue
-                page_name = edit_fields[3]
-                entry = MoinEditEntry(
-                    edit_date=edit_date,
-                    page_revision=page_revision,
-                    edit_type=ed_type,
-                    page_name=page_name,
-                    previous_page_name=previous_page_name,
-                    attachment=edit_fields[7],
-                    comment=edit_fields[8],
-                    page_path=page,
-                    user=ctx.users.get_user_by_id_or_anonymous(edit_fields[6]),
-                    ctx=ctx,
-                )
-                entries.append(entry)
-                if ed_type == MoinEditType.ATTACH:
-                    key = "\t".join([entry.page_name_unescaped(), edit_fields[7]])
-                    attachment_link_table[key] = entry
+            page = sys.intern(page)
+            for row in rows:
+                edit_times.append(row[0])
+                page_revisions.append(sys.intern(row[1]))
+                edit_types.append(EDIT_TYPE_INDEXES[row[2]])
+                page_names.append(sys.intern(row[3]))
+                previous_page_names.append(row[4])
+                page_paths.append(page)
+                attachments.append(sys.intern(row[5]))
+                comments.append(row[6])
+                if row[7] not in user_ids:
+                    user_ids[row[7]] = len(users)
+                    users.append(ctx.users.get_user_by_id_or_anonymous(row[7]))
+                user_indexes.append(user_ids[row[7]])
         ctx.logger.debug("Sorting edit entries")
-        entries.sort(key=lambda x: x.edit_date)
-        link_table = {revision.page_name_unescaped(): revision for revision in entries}
+        order = sorted(range(len(edit_times)), key=edit_times.__getitem__)
+        page_names = reorder(page_names, order)
+        edit_types = reorder(edit_types, order)
+        attachments = reorder(attachments, order)
+        #
+        # the link tables map to the latest revision of each page or attachment
+        link_table = {}
+        attachment_link_table = {}
+        attach = EDIT_TYPE_INDEXES[MoinEditType.ATTACH]
+        unescape = MoinEditEntryMethods.unescape
+        for row, page_name in enumerate(page_names):
+            link_table[unescape(page_name)] = row
+            if edit_types[row] == attach:
+                key = "\t".join([unescape(page_name), attachments[row]])
+                attachment_link_table[key] = row
         ctx.logger.debug("Building edit entries object")
         return cls(
-            entries=entries,
+            edit_times=reorder(edit_times, order),
+            page_revisions=reorder(page_revisions, order),
+            edit_types=edit_types,
+            page_names=page_names,
+            previous_page_names=reorder(previous_page_names, order),
+            page_paths=reorder(page_paths, order),
+            attachments=attachments,
+            comments=reorder(comments, order),
+            user_indexes=reorder(user_indexes, order),
+            users=users,
             link_table=link_table,
             attachment_link_table=attachment_link_table,
             ctx=ctx,
         )
 
+    @property
+    def entries(self) -> MoinEditEntryList:
+        """The revisions, in edit date order, as a sequence of entry views"""
+        return MoinEditEntryList(self)
+
+    def entry(self, row: int) -> MoinEditEntryView:
+        """A view of the revision in a row"""
+        return MoinEditEntryView(self, row)
+
     def count(self) -> int:
-        return len(self.entries)
+        return len(self.edit_times)
+
+    def find_revision(
+        self, page_name: str, revision: int
+    ) -> Optional[MoinEditEntryView]:
+        """
+        Find a revision of a page
+
+        Parameters:
+            page_name:  The name of the page as in the edit-log
+            revision:   The revision number
+
+        Attachments are not page revisions so are not found.  Returns None
+        if there is no such revision.
+        """
+        if len(self._revision_rows) == 0:
+            attach = EDIT_TYPE_INDEXES[MoinEditType.ATTACH]
+            for row, page_revision in enumerate(self.page_revisions):
+                if self.edit_types[row] != attach:
+                    self._revision_rows[
+                        (self.page_names[row], int(page_revision))
+                    ] = row
+        row = self._revision_rows.get((page_name, revision))
+        return None if row is None else self.entry(row)
+
+    def link_snapshot(self) -> MoinLinkTable:
+        """Build a picklable snapshot of the link and attachment tables"""
+        return MoinLinkTable(
+            link_table={
+                link: self.entry(row).markdown_page_name()
+                for link, row in self.link_table.items()
+            },
+            attachment_link_table={
+                key: self.entry(row).attachment_destination()
+                for key, row in self.attachment_link_table.items()
+            },
+        )
 
-    def create_home_page(self) -> Tuple[MoinEditEntry, str]:
-        """Builds a synthetic home page to link all the wiki entries together"""
-        revision = MoinEditEntry(
+    def live_pages(self) -> List[str]:
+        """
+        The names of the pages present after the last revision
+
+        Pages whose last revision deleted them, or which have been renamed
+        away, are left out.
+        """
+        pages: Dict[str, None] = {}
+        page_type = EDIT_TYPE_INDEXES[MoinEditType.PAGE]
+        rename = EDIT_TYPE_INDEXES[MoinEditType.RENAME]
+        delete = EDIT_TYPE_INDEXES[MoinEditType.DELETE]
+        for row, edit_type in enumerate(self.edit_types):
+            if edit_type == page_type:
+                pages[self.page_names[row]] = None
+            elif edit_type == rename:
+                pages.pop(self.previous_page_names[row], None)
+                pages[self.page_names[row]] = None
+            elif edit_type == delete:
+                pages.pop(self.page_names[row], None)
+        return list(pages)
+
+    def create_synthetic_revision(self, page_name: str, comment: str) -> MoinEditEntry:
+        """Builds a revision entry for a page made up by the conversion"""
+        return MoinEditEntry(
             edit_date=datetime.now(),
             page_revision="1",
             edit_type=MoinEditType.PAGE,
-            page_name="Home",
+            page_name=page_name,
             attachment="",
-            comment="Synthetic Home Page",
-            page_path="Home",
+            comment=comment,
+            page_path=page_name,
             user=self.ctx.users.get_user_by_id_or_anonymous("0"),
             ctx=self.ctx,
         )
-        pages = {}
-        for entry in self.entries:
-            page_path = entry.markdown_page_name()
-            page_split = entry.page_name.split("(2f)")
-            page_name = page_split.pop()
-            pages[page_path] = (
-                len(page_split) * "  "
-            ) + f"- [{page_name}]({page_path})\n"
-            while len(page_split) > 0:
-                page_path = "_".join(page_split)
-                page_name = page_split.pop()
-                if page_path not in pages:
-                    pages[page_path] = (len(page_split) * "  ") + f"- {page_name}\n"
-
-        content = "# Home Page\n\n"
-        for item in sorted(pages.keys()):
-            content += pages[item]
-        content += "\n----\n"
-
-        return (revision, content)
+
+    def create_home_page(self) -> Tuple[MoinEditEntry, str]:
+        """Builds a synthetic home page to link all the wiki entries together"""
+        revision = self.create_synthetic_revision("Home", "Synthetic Home Page")
+        lines = ["# Home Page\n\n"]
+        render_page_trie(build_page_trie(self.live_pages()), lines)
+        lines.append("\n----\n")
+        return (revision, "".join(lines))
+
+    def create_index_pages(self) -> List[Tuple[MoinEditEntry, str]]:
+        """
+        Builds a synthetic home page split up into per namespace index pages
+
+        The home page lists the top level pages, and links to an index page
+        for each top level namespace - named `Home-` followed by the
+        namespace - which lists the pages within it.  This keeps each page
+        a manageable size on wikis with very many pages.
+
+        Returns a list of `(revision, content)` tuples, the home page first.
+        """
+        trie = build_page_trie(self.live_pages())
+        home = ["# Home Page\n\n"]
+        index_pages = []
+        for name in sorted(trie.children):
+            node = trie.children[name]
+            if len(node.children) == 0:
+                home.append(f"- [{name}]({node.page})\n")
+                continue
+            index_name = f"Home-{MoinEditEntryMethods.markdown_transform(name)}"
+            if node.page is None:
+                home.append(f"- [{name}]({index_name})\n")
+            else:
+                home.append(f"- [{name}]({node.page}) - [index]({index_name})\n")
+            lines = [f"# {name}\n\n"]
+            if node.page is not None:
+                lines.append(f"- [{name}]({node.page})\n")
+            render_page_trie(node, lines)
+            lines.append("\n----\n\n[Home Page](Home)\n")
+            index_pages.append(
+                (
+                    self.create_synthetic_revision(index_name, f"Index of {name}"),
+                    "".join(lines),
+                ),
+            )
+        home.append("\n----\n")
+        home_page = (
+            self.create_synthetic_revision("Home", "Synthetic Home Page"),
+            "".join(home),
+        )
+        return [home_page] + index_pages
 
     def get_new_link_target(self, link):
         if link in self.link_table:
-            return self.link_table[link].markdown_page_name()
+            return self.entry(self.link_table[link]).markdown_page_name()
         else:
             return None
 
     def get_new_attachment_link_target(self, link, attachment):
         key = "\t".join([link, attachment])
         if key in self.attachment_link_table:
-            destination = self.attachment_link_table[key].attachment_destination()
+            destination = self.entry(
+                self.attachment_link_table[key],
+            ).attachment_destination()
             self.ctx.logger.debug(f"Attachment {link} {attachment} -> {destination}")
             return destination
         else:
@@ -278,4 +654,187 @@ class MoinEditEntries:
             return None
 
 
+# -----------------------------------------------------------------------
+@attr.s(kw_only=True, slots=True)
+class PageTrieNode:
+    """
+    A node in a trie of page names, split at each `/`
+
+    Attributes:
+        page: The markdown page name if there is a page here, otherwise None
+        children: Maps each next name component to its node
+
+    """
+
+    page: Optional[str] = attr.ib(default=None)
+    children: dict = attr.ib(factory=dict)
+
+
+def build_page_trie(page_names: Iterable[str]) -> PageTrieNode:
+    """Build a trie from escaped page names, each visited once"""
+    root = PageTrieNode()
+    for page_name in page_names:
+        node = root
+        for component in page_name.split("(2f)"):
+            child = node.children.get(component)
+            if child is None:
+                child = node.children[component] = PageTrieNode()
+            node = child
+        node.page = MoinEditEntryMethods.markdown_transform(page_name)
+    return root
+
+
+def render_page_trie(root: PageTrieNode, lines: List[str]):
+    """
+    Add a nested Markdown list of the pages beneath a trie node to `lines`
+
+    Pages are linked, and names which are only namespaces are listed as
+    plain text - each level is indented under its parent and sorted.
+    """
+    stack = [
+        (name, root.children[name], 0) for name in sorted(root.children, reverse=True)
+    ]
+    while len(stack) > 0:
+        name, node, depth = stack.pop()
+        indent = depth * "  "
+        if node.page is not None:
+            lines.append(f"{indent}- [{name}]({node.page})\n")
+        else:
+            lines.append(f"{indent}- {name}\n")
+        for child in sorted(node.children, reverse=True):
+            stack.append((child, node.children[child], depth + 1))
+
+
+def reorder(column, order: List[int]):
+    """Return a copy of a list or array column with its rows in a new order"""
+    if isinstance(column, array):
+        return array(column.typecode, map(column.__getitem__, order))
+    return list(map(column.__getitem__, order))
+
+
+def scan_pages(
+    function: Callable,
+    pages: Iterable[str],
+    workers: int,
+) -> Iterator[Tuple[str, Any]]:
+    """
+    Apply a function to each wiki page, returning `(page, result)` in order
+
+    Parameters:
+        function:   Function taking a page name
+        pages:      The names on the filesystem of the pages
+        workers:    Number of threads to run the function in
+
+    """
+    if workers <= 1:
+        yield from ordered_map(function, pages)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        yield from ordered_map(function, pages, executor=executor, window=workers * 4)
+
+
+def directory_files(path: str, check_files: bool = True) -> Set[str]:
+    """
+    The names of the files within a directory - empty if it does not exist
+
+    Parameters:
+        path:           Path of the directory
+        check_files:    Leave out any entries which are not files
+
+    Checking the entries uses the file types given by the directory listing,
+    but where the filesystem does not give them - as with some network
+    filesystems - each entry has to be looked at in turn.  Directories whose
+    entries are all files can be listed without `check_files`.
+    """
+    try:
+        with os.scandir(path) as directory:
+            if not check_files:
+                return {item.name for item in directory}
+            return {item.name for item in directory if item.is_file()}
+    except OSError:
+        return set()
+
+
+def read_page_edit_log(pages_dir: str, page: str) -> Optional[List[tuple]]:
+    """
+    Parse the edit-log of a single wiki page
+
+    Parameters:
+        pages_dir:  Path of the wiki `pages` directory
+        page:       The name on the filesystem of the page
+
+    Returns a list of tuples, one per usable revision, of the edit time in
+    microseconds, revision, `MoinEditType`, page name, previous page name,
+    attachment, comment and user id - or `None` if the page has no edit-log.
+
+    Which revisions and attachments exist is found by listing the
+    `revisions` and `attachments` directories once each, rather than by
+    checking for each file in turn.  This only touches plain values so may
+    be run in several threads at once.
+    """
+    page_dir = os.path.join(pages_dir, page)
+    try:
+        with open(os.path.join(page_dir, "edit-log")) as f:
+            edit_log_data = f.readlines()
+    except OSError:
+        return None
+    revision_files = None
+    attachment_files = None
+    page_name = None
+    rows = []
+    # read the lines in the edit-log file
+    for edit_line in edit_log_data:
+        # check its an edit entry
+        if len(edit_line) < 15 or not edit_line[:15].isdigit():
+            continue
+        # extract the fields out the edit entry
+        edit_fields = edit_line.rstrip("\n").split("\t")
+        page_revision = edit_fields[1]
+        edit_type = edit_fields[2]
+        if edit_type == "SAVE/RENAME":
+            previous_page_name = page_name
+            ed_type = MoinEditType.RENAME
+        else:
+            previous_page_name = None
+            if edit_type in ("SAVENEW", "SAVE", "SAVE/REVERT"):
+                if revision_files is None:
+                    # moin keeps nothing but the revision files in here
+                    revision_files = directory_files(
+                        os.path.join(page_dir, "revisions"),
+                        check_files=False,
+                    )
+                if page_revision in revision_files:
+                    ed_type = MoinEditType.PAGE
+                else:
+                    ed_type = MoinEditType.DELETE
+            elif edit_type == "ATTNEW":
+                if attachment_files is None:
+                    attachment_files = directory_files(
+                        os.path.join(page_dir, "attachments"),
+                    )
+                if edit_fields[7] in attachment_files:
+                    # attachment exists
+                    ed_type = MoinEditType.ATTACH
+                else:
+                    # cannot find attachment - ignore it and move on
+                    continue
+            else:
+                # unrecognised edit_type - just move on
+                continue
+        page_name = edit_fields[3]
+        rows.append(
+            (
+                int(edit_fields[0]),
+                page_revision,
+                ed_type,
+                page_name,
+                previous_page_name,
+                edit_fields[7],
+                edit_fields[8],
+                edit_fields[6],
+            ),
+        )
+    return rows
+
+
 # end
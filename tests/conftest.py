@@ -0,0 +1,31 @@
+"""Shared fixtures for the tests."""
+import logging
+
+import pytest
+
+from moin2gitwiki.context import Moin2GitContext
+from moin2gitwiki.users import Moin2GitUserSet
+
+
+@pytest.fixture
+def make_ctx():
+    """
+    A factory of context objects, logging to the `moin2gitwiki.test` logger
+
+    Any context attributes can be given - `users` may be given as a list of
+    users, which is made into a user set.
+    """
+    logger = logging.getLogger("moin2gitwiki.test")
+
+    def make_ctx(users=None, **kwargs):
+        if users is not None:
+            kwargs["users"] = Moin2GitUserSet.create_from_users(users, logger=logger)
+        return Moin2GitContext(logger=logger, **kwargs)
+
+    return make_ctx
+
+
+@pytest.fixture
+def ctx(make_ctx):
+    """A context object with the default settings"""
+    return make_ctx()
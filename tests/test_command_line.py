@@ -37,3 +37,72 @@ def test_command_line_interface():
     version_result = runner.invoke(cli.moin2gitwiki, ["--version"])
     assert version_result.exit_code == 0
     assert f", version {__version__}" in version_result.output
+
+
+@pytest.mark.parametrize(
+    "option",
+    [
+        ["--packing", "fast"],
+        ["--packing", "aggressive"],
+        ["--pack-threads", "2"],
+        ["--pack-window", "10"],
+        ["--pack-depth", "20"],
+        ["--pack-window-memory", "256m"],
+        ["--import-depth", "10"],
+        ["--max-pack-size", "1g"],
+        ["--big-file-threshold", "1m"],
+    ],
+)
+def test_stream_file_rejects_git_options(tmp_path, option):
+    """Test that options only used with a git repository are not ignored."""
+    tmp_path.joinpath("user").mkdir()
+    runner = CliRunner()
+    result = runner.invoke(
+        cli.moin2gitwiki,
+        ["--moin-data", str(tmp_path), "fast-export"]
+        + ["--cache-directory", str(tmp_path), "--url-prefix", "http://wiki/"]
+        + ["--stream-file", str(tmp_path / "stream.fi")]
+        + option,
+    )
+    assert result.exit_code == 2
+    assert f"{option[0]} cannot be used with --stream-file" in result.output
+    assert not tmp_path.joinpath("stream.fi").exists()
+
+
+@pytest.mark.parametrize("lazy", ["--lazy", "--no-lazy"])
+@pytest.mark.parametrize(
+    "page,found",
+    [("Foo/Bar", "Foo(2f)Bar 1"), ("Foo(2f)Bar", "Foo(2f)Bar 1"), ("Old", "Old 1")],
+)
+def test_translate_page_names(tmp_path, monkeypatch, lazy, page, found):
+    """Test that page names are found with and without --lazy."""
+    tmp_path.joinpath("user").mkdir()
+    edit_logs = {
+        "Foo(2f)Bar": ["1300000001000000\t00000001\tSAVENEW\tFoo(2f)Bar"],
+        "New": [
+            "1300000002000000\t00000001\tSAVENEW\tOld",
+            "1300000003000000\t00000002\tSAVE/RENAME\tNew",
+        ],
+    }
+    for page_path, lines in edit_logs.items():
+        revisions_dir = tmp_path / "pages" / page_path / "revisions"
+        revisions_dir.mkdir(parents=True)
+        for line in lines:
+            revisions_dir.joinpath(line.split("\t")[1]).write_text("text")
+        edit_log = "".join(f"{line}\t127.0.0.1\thost\t\t\t\n" for line in lines)
+        revisions_dir.parent.joinpath("edit-log").write_text(edit_log)
+    monkeypatch.setattr(
+        cli.Moin2Markdown,
+        "retrieve_and_translate",
+        lambda self, revision: (
+            f"{revision.page_name} {int(revision.page_revision)}".encode("utf-8")
+        ),
+    )
+    runner = CliRunner()
+    result = runner.invoke(
+        cli.moin2gitwiki,
+        ["--moin-data", str(tmp_path), "translate-page"]
+        + ["--cache-directory", str(tmp_path / "cache"), lazy, page, "1"],
+    )
+    assert result.exit_code == 0, result.output
+    assert result.output.splitlines()[-1] == found
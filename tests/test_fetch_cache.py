@@ -0,0 +1,139 @@
+"""Tests for the fetch cache."""
+import gzip
+import http.server
+import json
+import logging
+import threading
+
+import pytest
+
+from moin2gitwiki.fetch_cache import FetchCache
+from moin2gitwiki.fetch_cache import FetchCacheIndex
+
+
+class PageHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/ok":
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(b"<html>ok</html>")
+        elif self.path == "/gzip":
+            body = gzip.compress(b"<html>" + b"compressible " * 100 + b"</html>")
+            self.send_response(200)
+            self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_error(404)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), PageHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+
+
+def test_index_set_and_get(tmp_path):
+    logger = logging.getLogger("moin2gitwiki.test")
+    index = FetchCacheIndex.open_index(tmp_path / "index.sqlite", logger=logger)
+    assert index.get("http://example.org/a") is None
+    index.set("http://example.org/a", "item-a")
+    index.set("http://example.org/b", "item-b")
+    index.set("http://example.org/a", "item-c")
+    assert index.get("http://example.org/a") == "item-c"
+    assert "http://example.org/b" in index
+    assert len(index) == 2
+    #
+    # entries survive reopening the index
+    reopened = FetchCacheIndex.open_index(tmp_path / "index.sqlite", logger=logger)
+    assert sorted(reopened.items()) == [
+        ("http://example.org/a", "item-c"),
+        ("http://example.org/b", "item-b"),
+    ]
+
+
+def test_json_index_is_migrated(tmp_path, make_ctx):
+    (tmp_path / "0123").write_text("cached page")
+    (tmp_path / "index.json").write_text(
+        json.dumps({"http://example.org/page": "0123"}, indent=2),
+    )
+    cache = FetchCache.initialise_cache(cache_directory=tmp_path, ctx=make_ctx())
+    assert not (tmp_path / "index.json").exists()
+    assert (tmp_path / "index.json.migrated").exists()
+    assert cache.index.get("http://example.org/page") == "0123"
+    assert cache.fetch("http://example.org/page") == "cached page"
+
+
+def test_content_is_stored_once_compressed(tmp_path, make_ctx):
+    cache = FetchCache.initialise_cache(cache_directory=tmp_path, ctx=make_ctx())
+    first = cache.store_item("<html>same page</html>")
+    second = cache.store_item("<html>same page</html>")
+    other = cache.store_item("<html>other page</html>")
+    assert first == second
+    assert first != other
+    assert first.endswith(".gz")
+    assert cache.read_item(first) == "<html>same page</html>"
+    assert len(list((tmp_path / "objects").glob("*/*.gz"))) == 2
+
+
+def test_failures_are_not_cached(tmp_path, server, make_ctx):
+    ctx = make_ctx(http_retries=0, http_timeout=5)
+    cache = FetchCache.initialise_cache(cache_directory=tmp_path, ctx=ctx)
+    assert cache.fetch(f"{server}/ok") == "<html>ok</html>"
+    assert f"{server}/ok" in cache.index
+    assert cache.fetch(f"{server}/missing") is None
+    assert cache.failures == 1
+    assert f"{server}/missing" not in cache.index
+
+
+def test_prefetch(tmp_path, server, make_ctx):
+    ctx = make_ctx(http_retries=0, http_timeout=5)
+    cache = FetchCache.initialise_cache(cache_directory=tmp_path, ctx=ctx)
+    urls = [f"{server}/ok", f"{server}/missing", f"{server}/ok"]
+    cache.prefetch(urls, concurrency=2)
+    assert (cache.hits, cache.misses, cache.failures) == (0, 1, 1)
+    assert cache.bytes_fetched == len(b"<html>ok</html>")
+    cache.prefetch(urls, concurrency=2)
+    assert (cache.hits, cache.misses, cache.failures) == (1, 1, 2)
+
+
+def test_keyed_entries(tmp_path, server, make_ctx):
+    ctx = make_ctx(http_retries=0, http_timeout=5)
+    cache = FetchCache.initialise_cache(cache_directory=tmp_path, ctx=ctx)
+    assert cache.fetch_item(f"{server}/ok", key="page:1") == ("<html>ok</html>", False)
+    assert "page:1" in cache.index and f"{server}/ok" not in cache.index
+    #
+    # the key still finds the page when the URL has changed
+    assert cache.fetch_item("http://moved.invalid/ok", key="page:1")[1] is True
+    #
+    # entries cached under the URL are picked up and copied to the key
+    cache.fetch(f"{server}/ok")
+    assert cache.fetch_item(f"{server}/ok", key="page:2")[1] is True
+    assert cache.index.get("page:2") == cache.index.get(f"{server}/ok")
+    assert cache.index.copy_keys([(f"{server}/ok", "page:3"), ("missing", "x")]) == 1
+    assert "page:3" in cache.index and "x" not in cache.index
+
+
+def test_empty_legacy_entries_are_refetched(tmp_path, server, make_ctx):
+    (tmp_path / "0123").write_text("")
+    (tmp_path / "index.json").write_text(json.dumps({f"{server}/ok": "0123"}))
+    ctx = make_ctx(http_retries=0, http_timeout=5)
+    cache = FetchCache.initialise_cache(cache_directory=tmp_path, ctx=ctx)
+    assert cache.fetch(f"{server}/ok") == "<html>ok</html>"
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert cache.index.get(f"{server}/ok").endswith(".gz")
+
+
+def test_bytes_fetched_counts_the_wire_length(tmp_path, server, make_ctx):
+    ctx = make_ctx(http_retries=0, http_timeout=5)
+    cache = FetchCache.initialise_cache(cache_directory=tmp_path, ctx=ctx)
+    content = cache.fetch(f"{server}/gzip")
+    assert len(content) > 1300
+    assert 0 < cache.bytes_fetched < 100
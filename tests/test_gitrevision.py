@@ -0,0 +1,231 @@
+"""Tests for the git fast-import stream output."""
+import io
+import shutil
+import subprocess
+from datetime import datetime
+
+import pytest
+
+from moin2gitwiki.gitrevision import GitExportState
+from moin2gitwiki.gitrevision import GitExportStream
+from moin2gitwiki.gitrevision import GitPackingPolicy
+from moin2gitwiki.users import Moin2GitUser
+from moin2gitwiki.wikiindex import MoinEditEntry
+from moin2gitwiki.wikiindex import MoinEditType
+
+
+def make_revision(ctx, page_name, revision=1, **kwargs):
+    return MoinEditEntry(
+        edit_date=datetime(2020, 1, 1, 12, 0, revision),
+        page_revision=f"{revision:08d}",
+        edit_type=kwargs.pop("edit_type", MoinEditType.PAGE),
+        page_name=page_name,
+        page_path=page_name,
+        user=Moin2GitUser(moin_id="1.2.3", moin_name="User"),
+        ctx=ctx,
+        **kwargs,
+    )
+
+
+def test_commit_stream(ctx):
+    output = io.BytesIO()
+    export = GitExportStream(output=output, ctx=ctx)
+    revision = make_revision(ctx, "Page")
+    export.add_wiki_revision(revision=revision, content=b"hello\n")
+    export.end_stream()
+    when = str(int(revision.edit_date.timestamp())).encode("utf-8")
+    assert output.getvalue() == (
+        b"blob\nmark :1\ndata 6\nhello\n"
+        b"reset refs/heads/master\n"
+        b"commit refs/heads/master\nmark :2\n"
+        b"author User <user@example.org> " + when + b" +0000\n"
+        b"committer User <user@example.org> " + when + b" +0000\n"
+        b"data 19\nAdd/Update Page.md\n"
+        b"M 100644 :1 Page.md\n\n"
+        b"reset refs/heads/master\nfrom :2\n"
+    )
+
+
+def test_identical_blobs_are_output_once(ctx):
+    output = io.BytesIO()
+    export = GitExportStream(output=output, ctx=ctx)
+    export.add_wiki_revision(revision=make_revision(ctx, "Page"), content=b"same\n")
+    export.add_wiki_revision(revision=make_revision(ctx, "Other"), content=b"same\n")
+    export.add_wiki_revision(revision=make_revision(ctx, "Page", 2), content=b"new\n")
+    stream = output.getvalue()
+    assert stream.count(b"blob\n") == 2
+    assert b"M 100644 :1 Page.md\n" in stream
+    assert b"M 100644 :1 Other.md\n" in stream
+
+
+def test_attachment_blob_is_streamed(tmp_path, monkeypatch, ctx):
+    monkeypatch.setattr("moin2gitwiki.gitrevision.BLOB_CHUNK_SIZE", 7)
+    content = bytes(range(256)) * 10
+    attachment = tmp_path / "file.bin"
+    attachment.write_bytes(content)
+    output = io.BytesIO()
+    export = GitExportStream(output=output, ctx=ctx)
+    assert export.output_blob_file(attachment) == 1
+    assert export.output_blob(content) == 1
+    assert output.getvalue() == b"blob\nmark :1\ndata 2560\n" + content
+
+
+class CountingOutput(io.BytesIO):
+    writes = 0
+
+    def write(self, data):
+        self.writes += 1
+        return super().write(data)
+
+
+def test_commit_is_written_in_one_go(ctx):
+    output = CountingOutput()
+    export = GitExportStream(output=output, ctx=ctx)
+    export.add_wiki_revision(revision=make_revision(ctx, "Page"), content=b"hello\n")
+    assert output.writes == 1
+    export.add_wiki_revision(revision=make_revision(ctx, "Page", 2), content=b"bye\n")
+    assert output.writes == 2
+
+
+def test_export_state_round_trip(tmp_path, ctx):
+    assert GitExportState.load_state(tmp_path) is None
+    revision = make_revision(ctx, "Page")
+    state = GitExportState(
+        last_edit_date=revision.edit_microseconds(),
+        last_commit_mark=4,
+        mark_number=5,
+    )
+    state.save_state(tmp_path)
+    assert GitExportState.load_state(tmp_path) == state
+    assert state.last_edit_date == 1577880001000000
+
+
+def test_export_state_new_revisions(ctx):
+    revisions = [make_revision(ctx, "Page", number) for number in range(1, 5)]
+    state = GitExportState(
+        last_edit_date=revisions[1].edit_microseconds(),
+        last_commit_mark=4,
+        mark_number=5,
+    )
+    assert state.new_revisions(revisions) == revisions[2:]
+    assert state.new_revisions(revisions[:2]) == []
+
+
+def test_export_state_continues_stream(ctx):
+    state = GitExportState(last_edit_date=0, last_commit_mark=4, mark_number=5)
+    output = io.BytesIO()
+    export = state.create_stream(output, ctx=ctx)
+    revision = make_revision(ctx, "Page", 2)
+    export.add_wiki_revision(revision=revision, content=b"hello\n")
+    export.end_stream()
+    stream = output.getvalue()
+    assert stream.startswith(b"blob\nmark :5\n")
+    assert b"reset refs/heads/master\ncommit" not in stream
+    assert b"commit refs/heads/master\nmark :6\n" in stream
+    assert b"from :4\nM 100644 :5 Page.md\n" in stream
+    assert stream.endswith(b"reset refs/heads/master\nfrom :6\n")
+    after = GitExportState.from_export(
+        export=export,
+        revisions=[revision],
+        previous=state,
+    )
+    assert after == GitExportState(
+        last_edit_date=revision.edit_microseconds(),
+        last_commit_mark=6,
+        mark_number=7,
+    )
+
+
+def test_export_state_without_revisions(ctx):
+    export = GitExportStream(output=io.BytesIO(), ctx=ctx)
+    assert GitExportState.from_export(export=export, revisions=[]).last_edit_date == 0
+    previous = GitExportState(last_edit_date=12, last_commit_mark=4, mark_number=5)
+    export = previous.create_stream(io.BytesIO(), ctx=ctx)
+    assert (
+        GitExportState.from_export(export=export, revisions=[], previous=previous)
+        == previous
+    )
+
+
+@pytest.mark.skipif(shutil.which("git") is None, reason="needs git")
+def test_export_resumes_after_failed_run(tmp_path, ctx):
+    repository = tmp_path / "repository"
+    subprocess.run(["git", "init", "-q", str(repository)], check=True)
+    git_dir = repository / ".git"
+
+    def run_export(state, revisions):
+        output = io.BytesIO()
+        if state is None:
+            export = GitExportStream(output=output, ctx=ctx)
+        else:
+            export = state.create_stream(output, ctx=ctx)
+        for revision, content in revisions:
+            export.add_wiki_revision(revision=revision, content=content)
+        export.end_stream()
+        subprocess.run(
+            ["git", "fast-import", "--quiet"]
+            + GitExportState.fast_import_options(git_dir, state),
+            input=output.getvalue(),
+            cwd=repository,
+            check=True,
+        )
+        return GitExportState.from_export(
+            export=export,
+            revisions=[revision for revision, _ in revisions],
+            previous=state,
+        )
+
+    def git_output(*command):
+        return subprocess.run(
+            ["git", *command],
+            cwd=repository,
+            check=True,
+            capture_output=True,
+        ).stdout
+
+    run_export(None, [(make_revision(ctx, "Page", 1), b"one\n")]).save_state(git_dir)
+    #
+    # a run which could not fetch every page moves the branch on, but does
+    # not save its state
+    state = GitExportState.load_state(git_dir)
+    run_export(state, [(make_revision(ctx, "Other", 2), b"partial\n")])
+    assert len(git_output("rev-list", "master").split()) == 2
+    #
+    # the next run goes on from the saved state, replacing the failed run
+    state = GitExportState.load_state(git_dir)
+    revisions = [
+        (make_revision(ctx, "Other", 2), b"two\n"),
+        (make_revision(ctx, "Page", 3), b"three\n"),
+    ]
+    run_export(state, revisions).save_state(git_dir)
+    assert len(git_output("rev-list", "master").split()) == 3
+    assert git_output("show", "master:Other.md") == b"two\n"
+    assert git_output("show", "master:Page.md") == b"three\n"
+    state = GitExportState.load_state(git_dir)
+    assert state.last_edit_date == revisions[-1][0].edit_microseconds()
+
+
+def test_packing_policy():
+    assert GitPackingPolicy(packing="none").pack_command() is None
+    assert GitPackingPolicy().pack_command() == ["git", "gc", "--aggressive"]
+    assert GitPackingPolicy().fast_import_options() == []
+    policy = GitPackingPolicy(
+        packing="fast",
+        threads=4,
+        window_memory="256m",
+        import_depth=10,
+        max_pack_size="1g",
+    )
+    assert policy.pack_command() == [
+        "git",
+        "-c",
+        "pack.threads=4",
+        "-c",
+        "pack.windowMemory=256m",
+        "repack",
+        "-a",
+        "-d",
+        "--window=10",
+        "--depth=20",
+    ]
+    assert policy.fast_import_options() == ["--depth=10", "--max-pack-size=1g"]
@@ -0,0 +1,399 @@
+"""Tests for the HTML to Markdown translator."""
+import pickle
+import re
+import shutil
+from datetime import datetime
+from pathlib import Path
+
+import attr
+import pytest
+from furl import furl
+
+from moin2gitwiki.moin2markdown import HtmlTranslator
+from moin2gitwiki.moin2markdown import LruCache
+from moin2gitwiki.moin2markdown import Moin2Markdown
+from moin2gitwiki.moin2markdown import TranslationReuse
+from moin2gitwiki.stats import ConversionStats
+from moin2gitwiki.translation_cache import TranslationCache
+from moin2gitwiki.users import Moin2GitUser
+from moin2gitwiki.wikiindex import MoinEditEntry
+from moin2gitwiki.wikiindex import MoinEditType
+from moin2gitwiki.wikiindex import MoinLinkTable
+
+PAGE_HTML = """<html><head><title>Foo</title></head><body>
+<div id="header"><a href="/wiki/FrontPage">Front</a></div>
+<div id="content" lang="en">
+<span class="anchor" id="top"></span>
+<p class="line867">Some text with a <a class="interwiki" href="/wiki/Foo/Bar">link</a>
+and a <a href="/wiki/Foo?action=AttachFile&amp;do=get&amp;target=file.txt">file</a>
+and <a href="/wiki/Foo?action=edit">an action</a>.
+<img alt=":)" src="/moin_static/smile.png" title=":)" /></p>
+<div><form><input type="hidden" name="x" />Form text</form></div>
+</div>
+</body></html>
+"""
+
+
+CORPUS = sorted(Path(__file__).parent.joinpath("corpus").glob("*.html"))
+
+
+def make_translator(link_table=None, translation_cache=None):
+    links = MoinLinkTable(
+        link_table=link_table or {"Foo/Bar": "Foo_Bar"},
+        attachment_link_table={"Foo\tfile.txt": "_attachments/Foo/file.txt"},
+    )
+    return HtmlTranslator(
+        url_prefix=furl("http://wiki.example.org/wiki/"),
+        links=links,
+        translation_cache=translation_cache,
+    )
+
+
+def test_extract_content_section():
+    result = make_translator().extract_content_section(PAGE_HTML)
+    assert 'href="Foo_Bar"' in result
+    assert 'href="_attachments/Foo/file.txt"' in result
+    assert "an action" in result and "action=edit" not in result
+    assert ":slightly_smiling_face:" in result
+    assert "Front" not in result
+    assert "anchor" not in result
+    assert "<form" not in result and "<input" not in result
+    assert "<div" not in result
+
+
+def test_extract_content_section_no_content():
+    assert make_translator().extract_content_section("<html></html>") == ""
+
+
+def test_translator_is_picklable():
+    translator = make_translator()
+    copy = pickle.loads(pickle.dumps(translator))
+    assert copy.extract_content_section(PAGE_HTML) == (
+        translator.extract_content_section(PAGE_HTML)
+    )
+
+
+@pytest.mark.skipif(shutil.which("pandoc") is None, reason="needs pandoc")
+def test_translate_batch_matches_single():
+    translator = make_translator()
+    fragments = [
+        "<p>hello</p>",
+        "",
+        "<ul><li>a</li><li>b</li></ul>",
+        "<pre>code\n\n\n</pre>",
+        "<table><tr><td>x</td></tr></table>",
+        "<ol><li>one</li></ol>",
+    ]
+    assert translator.translate_batch(fragments) == [
+        translator.translate(fragment) for fragment in fragments
+    ]
+
+
+def test_pandoc_time_is_recorded_per_page():
+    translator = make_translator()
+    stats = ConversionStats()
+    timings = []
+    translator.translate_html_batch([PAGE_HTML, None, PAGE_HTML], stats, timings)
+    assert stats.latencies["pandoc batches"].count == 1
+    assert stats.latencies["pandoc"].count == 2
+    pandoc = sum(timing.pandoc for timing in timings if timing is not None)
+    assert abs(stats.latencies["pandoc"].total - pandoc) < 1e-9
+    assert abs(stats.latencies["pandoc batches"].total - pandoc) < 1e-9
+
+
+def test_translation_cache(tmp_path, monkeypatch):
+    cache = TranslationCache(cache_directory=tmp_path, fingerprint="test")
+    translator = make_translator(translation_cache=cache)
+    #
+    # the output of a failed pandoc run is not cached
+    monkeypatch.setattr(
+        HtmlTranslator,
+        "translate_batch_checked",
+        lambda self, inputs: [(b"", False) for _ in inputs],
+    )
+    assert translator.translate_html_batch([PAGE_HTML]) == [b""]
+    monkeypatch.setattr(
+        HtmlTranslator,
+        "translate_batch_checked",
+        lambda self, inputs: [(b"translated\n", True) for _ in inputs],
+    )
+    assert translator.translate_html_batch([PAGE_HTML, None]) == [b"translated\n", None]
+    #
+    # a second translation comes from the cache without translating
+    monkeypatch.setattr(HtmlTranslator, "translate_batch_checked", None)
+    assert translator.translate_html(PAGE_HTML) == b"translated\n"
+    #
+    # but not if a link in the page would be rewritten differently
+    relinked = make_translator(
+        link_table={"Foo/Bar": "Foo_Bar", "FrontPage": "FrontPage"},
+        translation_cache=cache,
+    )
+    key = cache.make_key(PAGE_HTML, relinked.link_targets(PAGE_HTML))
+    assert cache.get(key) is None
+
+
+def html_words_and_links(html):
+    text = re.sub(r"<[^>]*>", " ", html)
+    links = sorted(re.findall(r'(?:href|src)="([^"]*)"', html))
+    return (text.split(), links)
+
+
+@pytest.mark.parametrize("page", CORPUS, ids=lambda page: page.name)
+def test_lxml_parser_parity(page):
+    pytest.importorskip("lxml")
+    html = page.read_text()
+    soup = make_translator()
+    lxml = attr.evolve(soup, html_parser="lxml")
+    soup_section = soup.extract_content_section(html)
+    lxml_section = lxml.extract_content_section(html)
+    #
+    # the parsers close unclosed tags in different places, so the HTML may
+    # differ in structure but must keep the same text and links
+    assert html_words_and_links(lxml_section) == html_words_and_links(soup_section)
+    if shutil.which("pandoc") is not None:
+        assert lxml.translate(lxml_section) == soup.translate(soup_section)
+
+
+def test_lxml_parser_linemark_rule():
+    pytest.importorskip("lxml")
+    # the linemark pattern has always matched a literal backslash, so Moin
+    # line paragraphs are kept - both parsers must do the same
+    html = '<div id="content"><p class="line867">a</p><p class="line\\d1">b</p></div>'
+    soup = make_translator()
+    lxml = attr.evolve(soup, html_parser="lxml")
+    assert soup.extract_content_section(html) == '<p class="line867">a</p>b'
+    assert lxml.extract_content_section(html) == '<p class="line867">a</p>b'
+
+
+def test_lxml_parser_falls_back_to_soup():
+    pytest.importorskip("lxml")
+    # lxml refuses a str with an encoding declaration - BeautifulSoup is
+    # used for it instead
+    html = '<?xml version="1.0" encoding="utf-8"?>\n' + PAGE_HTML
+    soup = make_translator()
+    lxml = attr.evolve(soup, html_parser="lxml")
+    section = lxml.extract_content_section(html)
+    assert "Some text with a" in section
+    assert section == soup.extract_content_section(html)
+    assert lxml.extract_content_section("") == ""
+
+
+def test_link_resolution_is_memoised(monkeypatch):
+    translator = make_translator()
+    looked_up = []
+    lookup_link = HtmlTranslator.lookup_link
+
+    def counting_lookup(self, target):
+        looked_up.append(target)
+        return lookup_link(self, target)
+
+    monkeypatch.setattr(HtmlTranslator, "lookup_link", counting_lookup)
+    first = translator.extract_content_section(PAGE_HTML)
+    assert translator.extract_content_section(PAGE_HTML) == first
+    assert sorted(looked_up) == sorted(set(looked_up))
+    assert translator.link_cache.hits > 0
+    #
+    # the cache is bounded, and not carried along when pickled
+    small = LruCache(2)
+    for key in ("a", "b", "a", "c"):
+        small.get_or_compute(key, str.upper, key)
+    assert len(small) == 2
+    assert small.get_or_compute("a", None) == "A"
+    assert len(pickle.loads(pickle.dumps(small))) == 0
+
+
+def test_failed_pandoc_run_is_reported(monkeypatch, caplog):
+    monkeypatch.setattr(
+        "moin2gitwiki.moin2markdown.PANDOC_COMMAND",
+        ["sh", "-c", "cat; exit 3"],
+    )
+    translator = make_translator()
+    assert translator.translate_checked("<p>x</p>") == (b"<p>x</p>", False)
+    assert translator.translate_batch_checked(["<p>a</p>", "<p>b</p>"]) == [
+        (b"<p>a</p>", False),
+        (b"<p>b</p>", False),
+    ]
+    assert "pandoc exited with status 3" in caplog.text
+
+
+def make_page_revisions(tmp_path, ctx):
+    """Revisions of two pages, with a revert, a delete and an attachment"""
+    sources = [
+        ("A", "1", MoinEditType.PAGE, "one"),
+        ("A", "2", MoinEditType.PAGE, "two"),
+        ("A", "3", MoinEditType.PAGE, "one"),
+        ("A", "4", MoinEditType.DELETE, None),
+        ("A", "4", MoinEditType.ATTACH, None),
+        ("B", "1", MoinEditType.PAGE, "one"),
+        ("A", "5", MoinEditType.PAGE, "two"),
+    ]
+    revisions = []
+    for page, revision, edit_type, source in sources:
+        revisions_dir = tmp_path / "pages" / page / "revisions"
+        revisions_dir.mkdir(parents=True, exist_ok=True)
+        if source is not None:
+            (revisions_dir / revision).write_text(source)
+        revisions.append(
+            MoinEditEntry(
+                edit_date=datetime(2020, 1, 1),
+                page_revision=revision,
+                edit_type=edit_type,
+                page_name=page,
+                page_path=page,
+                attachment="file.txt" if edit_type == MoinEditType.ATTACH else None,
+                user=Moin2GitUser(moin_id="1.2.3", moin_name="User"),
+                ctx=ctx,
+            ),
+        )
+    return revisions
+
+
+class RecordingFetchCache:
+    """Stands in for the fetch cache, recording the page revisions fetched"""
+
+    def __init__(self, failing=()):
+        self.fetched = []
+        self.failing = failing
+
+    def fetch(self, url, key=None):
+        content, _ = self.fetch_item(url, key=key)
+        return content
+
+    def fetch_item(self, url, key=None):
+        url = furl(url)
+        page_revision = [str(url.path.segments[-1]), url.args["rev"]]
+        self.fetched.append(page_revision)
+        if page_revision in self.failing:
+            return (None, False)
+        return (f'<div id="content"><p>{url}</p></div>', False)
+
+
+@pytest.mark.parametrize("fetch_workers", [0, 2])
+def test_identical_revisions_are_reused(
+    tmp_path,
+    monkeypatch,
+    make_ctx,
+    fetch_workers,
+):
+    ctx = make_ctx(moin_data=tmp_path)
+    revisions = make_page_revisions(tmp_path, ctx)
+    fetch_cache = RecordingFetchCache()
+    translator = Moin2Markdown(
+        fetch_cache=fetch_cache,
+        url_prefix=furl("http://wiki.example.org/wiki/"),
+        revisions=None,
+        html_translator=make_translator(),
+        ctx=ctx,
+    )
+    monkeypatch.setattr(
+        HtmlTranslator,
+        "translate_batch_checked",
+        lambda self, inputs: [(input.encode("utf-8"), True) for input in inputs],
+    )
+    results = list(
+        translator.translate_revisions_traced(
+            revisions=revisions,
+            fetch_workers=fetch_workers,
+            skip_identical=True,
+        ),
+    )
+    contents = [content for _, content, _ in results]
+    identical = [trace.identical for _, _, trace in results]
+    #
+    # the reverts of page A reuse the earlier translations, while the same
+    # source on page B is translated for itself
+    assert sorted(fetch_cache.fetched) == [["A", "1"], ["A", "2"], ["B", "1"]]
+    assert contents[2] == contents[0] and contents[6] == contents[1]
+    assert contents[5] != contents[0]
+    assert identical == [False, False, True, False, False, False, True]
+    #
+    # revisions without content are never repeats
+    assert contents[3] is None and contents[4] is None
+
+
+def test_failed_fetches_are_not_reused(tmp_path, make_ctx):
+    ctx = make_ctx(moin_data=tmp_path)
+    revisions = make_page_revisions(tmp_path, ctx)
+    fetch_cache = RecordingFetchCache(failing=[["A", "1"]])
+    translator = Moin2Markdown(
+        fetch_cache=fetch_cache,
+        url_prefix=furl("http://wiki.example.org/wiki/"),
+        revisions=None,
+        html_translator=make_translator(),
+        ctx=ctx,
+    )
+    results = list(
+        translator.translate_revisions_traced(revisions=revisions, skip_identical=True),
+    )
+    #
+    # the revert to the failed revision is fetched itself, rather than
+    # being given an empty translation
+    failed = [trace.fetch_failed for _, _, trace in results]
+    assert failed == [True, False, False, False, False, False, False]
+    assert results[0][1] is None and results[2][1] is not None
+    assert ["A", "3"] in fetch_cache.fetched
+    assert not results[2][2].identical
+    #
+    # repeats already claimed when the fetch fails take None, while a later
+    # repeat is fetched again
+    reuse = TranslationReuse()
+    assert reuse.claim(("A", "x")) is False
+    assert reuse.claim(("A", "x")) is True
+    reuse.fail(("A", "x"))
+    assert reuse.take(("A", "x")) is None
+    assert reuse.claim(("A", "x")) is False
+
+
+def test_translation_reuse_is_released():
+    reuse = TranslationReuse(limit=0)
+    assert reuse.claim(None) is False
+    assert reuse.claim(("A", "x")) is False
+    assert reuse.claim(("A", "x")) is True
+    assert reuse.claim(("A", "x")) is True
+    reuse.store(("A", "x"), b"first")
+    assert reuse.take(("A", "x")) == b"first"
+    assert ("A", "x") in reuse.held
+    assert reuse.take(("A", "x")) == b"first"
+    # released after the last claimed repeat takes it
+    assert len(reuse.held) == 0 and len(reuse.pending) == 0
+    #
+    # otherwise only the most recently used are held
+    reuse = TranslationReuse(limit=2)
+    for key in ("a", "b", "c"):
+        reuse.claim(key)
+        reuse.store(key, key.encode("utf-8"))
+    assert list(reuse.held) == ["b", "c"]
+    assert reuse.claim("a") is False
+
+
+@pytest.mark.parametrize("skip_identical", [False, True])
+def test_revision_sources_are_read_once(
+    tmp_path,
+    monkeypatch,
+    make_ctx,
+    skip_identical,
+):
+    ctx = make_ctx(moin_data=tmp_path)
+    revisions = make_page_revisions(tmp_path, ctx)
+    translator = Moin2Markdown(
+        fetch_cache=RecordingFetchCache(),
+        url_prefix=furl("http://wiki.example.org/wiki/"),
+        revisions=None,
+        html_translator=make_translator(),
+        ctx=ctx,
+    )
+    monkeypatch.setattr(
+        HtmlTranslator,
+        "translate_batch_checked",
+        lambda self, inputs: [(input.encode("utf-8"), True) for input in inputs],
+    )
+    read = []
+    wiki_content_bytes = MoinEditEntry.wiki_content_bytes
+
+    def counting_read(self):
+        read.append((self.page_path, self.page_revision))
+        return wiki_content_bytes(self)
+
+    monkeypatch.setattr(MoinEditEntry, "wiki_content_bytes", counting_read)
+    list(translator.translate_revisions(revisions, skip_identical=skip_identical))
+    assert len(read) == len(revisions)
@@ -0,0 +1,38 @@
+"""Tests for the ordered pipeline helpers."""
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from moin2gitwiki.pipeline import ordered_map
+
+
+def slow_square(value):
+    time.sleep(random.random() / 1000)
+    return value * value
+
+
+def test_ordered_map_inline():
+    results = list(ordered_map(slow_square, range(10)))
+    assert results == [(x, x * x) for x in range(10)]
+
+
+def test_ordered_map_keeps_order():
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(
+            ordered_map(slow_square, range(200), executor=executor, window=16),
+        )
+    assert results == [(x, x * x) for x in range(200)]
+
+
+def test_ordered_map_window_is_bounded():
+    pulled = []
+
+    def items():
+        for x in range(100):
+            pulled.append(x)
+            yield x
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        for item, _ in ordered_map(slow_square, items(), executor=executor, window=5):
+            # never more than the window pulled ahead of the consumer
+            assert len(pulled) - item <= 5
@@ -0,0 +1,65 @@
+"""Tests for the conversion statistics."""
+import json
+import pickle
+
+from moin2gitwiki.stats import ConversionStats
+from moin2gitwiki.stats import rank_traces
+from moin2gitwiki.stats import RevisionTrace
+
+
+def test_stats_merge_and_summary(tmp_path):
+    stats = ConversionStats()
+    for seconds in (0.0005, 0.003, 0.004, 0.3):
+        stats.record("fetch", seconds)
+    stats.count("fetch cache hits", 3)
+    with stats.timed("pandoc"):
+        pass
+    #
+    # stats gathered in a worker process come back pickled to be merged
+    worker = ConversionStats()
+    worker.record("fetch", 12.0)
+    worker.count("fetch cache hits")
+    stats.merge(pickle.loads(pickle.dumps(worker)))
+    fetch = stats.latencies["fetch"]
+    assert fetch.count == 5
+    assert fetch.buckets[0] == 1 and fetch.buckets[-1] == 1
+    # the median falls in the 0.002 - 0.005 bucket, whose two operations
+    # are taken to be spread evenly across it
+    assert abs(fetch.quantile(0.5) - 0.00425) < 1e-9
+    assert fetch.quantile(1.0) == 12.0
+    assert fetch.quantile(0.0) == 0.0
+    assert stats.counters == {"fetch cache hits": 4}
+    assert any(line.startswith("fetch ") for line in stats.summary())
+    stats.save_json(tmp_path / "stats.json")
+    data = json.loads((tmp_path / "stats.json").read_text())
+    assert data["latencies"]["fetch"]["max"] == 12.0
+    assert data["latencies"]["pandoc"]["count"] == 1
+
+
+def test_summary_columns_fit_long_names():
+    stats = ConversionStats()
+    stats.record("fetch", 0.1)
+    stats.count("a counter with a very long name", 2)
+    header, fetch, counter = stats.summary()[1:]
+    # the count column lines up below its heading whatever the name lengths
+    assert header.index("count") + len("count") == fetch.index(" 1 ") + 2
+    assert counter.endswith(" 2") and len(counter) == fetch.index(" 1 ") + 2
+    assert counter.startswith("a counter with a very long name  ")
+
+
+def test_rank_traces():
+    traces = [
+        RevisionTrace(page="A", revision="1", edit_type="PAGE", fetch=1.0),
+        RevisionTrace(page="B", revision="1", edit_type="PAGE", pandoc=1.5),
+        RevisionTrace(page="A", revision="2", edit_type="PAGE", pandoc=1.0),
+    ]
+    lines = [trace.as_json() for trace in traces] + [""]
+    pages = rank_traces(lines)
+    assert [(page["page"], page["revisions"]) for page in pages] == [("A", 2), ("B", 1)]
+    assert pages[0]["total"] == 2.0 and pages[0]["slowest"] == 1.0
+    by_pandoc = rank_traces(lines, by="pandoc", per_revision=True)
+    assert [(trace["page"], trace["revision"]) for trace in by_pandoc] == [
+        ("B", "1"),
+        ("A", "2"),
+        ("A", "1"),
+    ]
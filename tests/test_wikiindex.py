@@ -0,0 +1,189 @@
+"""Tests for the wiki revision index."""
+
+from moin2gitwiki.revision_index import RevisionIndex
+from moin2gitwiki.users import Moin2GitUser
+from moin2gitwiki.wikiindex import directory_files
+from moin2gitwiki.wikiindex import MoinDirectoryLinkTable
+from moin2gitwiki.wikiindex import MoinEditEntries
+from moin2gitwiki.wikiindex import MoinEditType
+from moin2gitwiki.wikiindex import read_page_edit_log
+
+EDIT_LOG = """1300000001000000\t00000001\tSAVENEW\tOldName\t127.0.0.1\thost\t1.2.3\t\t
+1300000002000000\t00000002\tSAVE/RENAME\tNewName\t127.0.0.1\thost\t1.2.3\t\tmoved
+1300000003000000\t99999999\tATTNEW\tNewName\t127.0.0.1\thost\t1.2.3\tfile.txt\t
+1300000004000000\t99999999\tATTNEW\tNewName\t127.0.0.1\thost\t1.2.3\tgone.txt\t
+1300000005000000\t00000003\tSAVE\tNewName\t127.0.0.1\thost\t1.2.3\t\t
+not an entry
+"""
+
+
+def test_read_page_edit_log(tmp_path):
+    page_dir = tmp_path / "pages" / "NewName"
+    (page_dir / "revisions").mkdir(parents=True)
+    (page_dir / "attachments").mkdir()
+    (page_dir / "revisions" / "00000001").write_text("one")
+    (page_dir / "attachments" / "file.txt").write_text("file")
+    (page_dir / "edit-log").write_text(EDIT_LOG)
+    rows = read_page_edit_log(str(tmp_path / "pages"), "NewName")
+    assert [(row[0], row[2], row[3], row[4], row[5]) for row in rows] == [
+        (1300000001000000, MoinEditType.PAGE, "OldName", None, ""),
+        (1300000002000000, MoinEditType.RENAME, "NewName", "OldName", ""),
+        (1300000003000000, MoinEditType.ATTACH, "NewName", None, "file.txt"),
+        (1300000005000000, MoinEditType.DELETE, "NewName", None, ""),
+    ]
+    assert read_page_edit_log(str(tmp_path / "pages"), "Missing") is None
+
+
+def test_directory_files(tmp_path):
+    (tmp_path / "file.txt").write_text("file")
+    (tmp_path / "directory").mkdir()
+    assert directory_files(str(tmp_path)) == {"file.txt"}
+    assert directory_files(str(tmp_path), check_files=False) == {
+        "file.txt",
+        "directory",
+    }
+    assert directory_files(str(tmp_path / "missing")) == set()
+
+
+def test_rename_does_not_see_other_pages(tmp_path):
+    for page in ("First", "Second"):
+        (tmp_path / page).mkdir()
+    (tmp_path / "First" / "edit-log").write_text(EDIT_LOG.splitlines()[0] + "\n")
+    (tmp_path / "Second" / "edit-log").write_text(EDIT_LOG.splitlines()[1] + "\n")
+    read_page_edit_log(str(tmp_path), "First")
+    rows = read_page_edit_log(str(tmp_path), "Second")
+    assert rows[0][4] is None
+
+
+def test_revision_index(tmp_path, monkeypatch, ctx):
+    pages_dir = tmp_path / "pages"
+    for page in ("First", "Second"):
+        (pages_dir / page).mkdir(parents=True)
+        (pages_dir / page / "edit-log").write_text(EDIT_LOG.splitlines()[0] + "\n")
+    index_path = tmp_path / "index.sqlite"
+    index = RevisionIndex.open_index(index_path, moin_data=tmp_path, logger=ctx.logger)
+    first = list(index.scan_edit_logs(str(pages_dir), ["First", "Second"], ctx=ctx))
+    #
+    # only a changed edit-log is read again
+    (pages_dir / "Second" / "edit-log").write_text(EDIT_LOG)
+    read = []
+
+    def reading(pages_dir, page):
+        read.append(page)
+        return read_page_edit_log(pages_dir, page)
+
+    monkeypatch.setattr("moin2gitwiki.revision_index.read_page_edit_log", reading)
+    index = RevisionIndex.open_index(index_path, moin_data=tmp_path, logger=ctx.logger)
+    second = list(index.scan_edit_logs(str(pages_dir), ["First", "Second"], ctx=ctx))
+    assert read == ["Second"]
+    assert second[0] == first[0]
+    assert second[1] == ("Second", read_page_edit_log(str(pages_dir), "Second"))
+    #
+    # and an index of another wiki is not used
+    other = RevisionIndex.open_index(index_path, moin_data=pages_dir, logger=ctx.logger)
+    assert other.connection.execute("SELECT COUNT(*) FROM pages").fetchone() == (0,)
+
+
+def test_edit_entries_columns(make_ctx):
+    user = Moin2GitUser(moin_id="1.2.3", moin_name="User")
+    ctx = make_ctx(users=[user])
+    scanned = [
+        (
+            "Foo(2f)Bar",
+            [(3, "00000002", MoinEditType.PAGE, "Foo(2f)Bar", None, "", "", "1.2.3")],
+        ),
+        ("Missing", None),
+        (
+            "Other",
+            [
+                (1, "00000001", MoinEditType.PAGE, "Other", None, "", "first", "9.9.9"),
+                (
+                    2,
+                    "99999999",
+                    MoinEditType.ATTACH,
+                    "Other",
+                    None,
+                    "a.txt",
+                    "",
+                    "1.2.3",
+                ),
+            ],
+        ),
+    ]
+    revisions = MoinEditEntries.create_from_rows(scanned, ctx=ctx)
+    assert revisions.count() == 3
+    entries = revisions.entries
+    assert [entry.markdown_page_path() for entry in entries] == [
+        "Other.md",
+        "Other.md",
+        "Foo_Bar.md",
+    ]
+    assert entries[0].comment == "first"
+    assert entries[0].user.moin_name == "anonymous"
+    assert entries[-1].user is user
+    assert entries[-1].page_name_unescaped() == "Foo/Bar"
+    assert entries[1].edit_type == MoinEditType.ATTACH
+    assert entries[1].edit_microseconds() == 2
+    assert entries[1].attachment_destination() == "_attachments/Other/a.txt"
+    assert entries[1] == revisions.entry(1)
+    assert revisions.find_revision("Other", 1) == entries[0]
+    assert revisions.find_revision("Other", 99999999) is None
+    assert revisions.get_new_link_target("Foo/Bar") == "Foo_Bar"
+    assert revisions.get_new_attachment_link_target("Other", "a.txt") == (
+        "_attachments/Other/a.txt"
+    )
+
+
+def test_directory_link_table(tmp_path):
+    (tmp_path / "Foo(2f)Bar" / "attachments").mkdir(parents=True)
+    (tmp_path / "Foo(2f)Bar" / "edit-log").write_text("")
+    (tmp_path / "Foo(2f)Bar" / "attachments" / "a.txt").write_text("a")
+    (tmp_path / "NoLog").mkdir()
+    links = MoinDirectoryLinkTable(pages_dir=str(tmp_path))
+    assert links.get_new_link_target("Foo/Bar") == "Foo_Bar"
+    assert links.get_new_link_target("NoLog") is None
+    assert links.get_new_link_target("..") is None
+    assert links.get_new_attachment_link_target("Foo/Bar", "a.txt") == (
+        "_attachments/Foo(2f)Bar/a.txt"
+    )
+    assert links.get_new_attachment_link_target("Foo/Bar", "b.txt") is None
+
+
+def test_home_and_index_pages(make_ctx):
+    ctx = make_ctx(users=[])
+    page = MoinEditType.PAGE
+    scanned = [
+        ("A(2f)B(2f)C", [(1, "00000001", page, "A(2f)B(2f)C", None, "", "", "")]),
+        ("A", [(2, "00000001", page, "A", None, "", "", "")]),
+        ("Z", [(3, "00000001", page, "Z", None, "", "", "")]),
+        (
+            "Gone",
+            [
+                (4, "00000001", page, "Gone", None, "", "", ""),
+                (5, "00000002", MoinEditType.DELETE, "Gone", None, "", "", ""),
+            ],
+        ),
+        (
+            "New",
+            [
+                (6, "00000001", page, "Old", None, "", "", ""),
+                (7, "00000002", MoinEditType.RENAME, "New", "Old", "", "", ""),
+            ],
+        ),
+    ]
+    revisions = MoinEditEntries.create_from_rows(scanned, ctx=ctx)
+    _, content = revisions.create_home_page()
+    assert content == (
+        "# Home Page\n\n"
+        "- [A](A)\n"
+        "  - B\n"
+        "    - [C](A_B_C)\n"
+        "- [New](New)\n"
+        "- [Z](Z)\n"
+        "\n----\n"
+    )
+    (home, home_content), (index, index_content) = revisions.create_index_pages()
+    assert home.markdown_page_path() == "Home.md"
+    assert "- [A](A) - [index](Home-A)\n" in home_content
+    assert index.markdown_page_path() == "Home-A.md"
+    assert index_content.startswith("# A\n\n- [A](A)\n- B\n  - [C](A_B_C)\n")